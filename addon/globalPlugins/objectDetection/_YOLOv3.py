@@ -2,9 +2,13 @@
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
 import os
+import threading
 from ctypes import *
-from collections import Counter
 from ._detectionResult import Detection
+from . import _instrumentation
+from ._resolution import MODEL_INPUT_SIZE
+from ._labels import CLASSES_SINGULAR, CLASSES_PLURAL, LABELS, SentenceFormatter
+from ._resourceGovernor import prepareThreadLimit, setOpenCVThreads
 
 
 class YOLOv3Detection():
@@ -25,31 +29,21 @@ class YOLOv3Detection():
 		self.dllPaths = [self.baseDir + dllPath for dllPath in self.dllPaths]
 		self._checkFiles()
 
-	# define singular and plural forms of class labels
-	CLASSES_SINGULAR = ['a person', 'a bicycle', 'a car', 'a motorbike', 'an aeroplane', 'a bus', 'a train',
-						'a truck', 'a boat', 'a traffic light', 'a fire hydrant', 'a stop sign', 'a parking meter',
-						'a bench', 'a bird', 'a cat', 'a dog', 'a horse', 'a sheep', 'a cow', 'an elephant', 'a bear',
-						'a zebra', 'a giraffe', 'a backpack', 'an umbrella', 'a handbag', 'a tie', 'a suitcase',
-						'a frisbee', 'a pair of skis', 'a snowboard', 'a sports ball', 'a kite', 'a baseball bat',
-						'a baseball glove', 'a skateboard', 'a surfboard', 'a tennis racket', 'a bottle',
-						'a wine glass', 'a cup', 'a fork', 'a knife', 'a spoon', 'a bowl', 'a banana', 'an apple',
-						'a sandwich', 'an orange', 'broccoli', 'a carrot', 'a hot dog', 'a pizza', 'a donut', 'a cake',
-						'a chair', 'a sofa', 'a potted plant', 'a bed', 'a dining table', 'a toilet', 'a tv monitor',
-						'a laptop', 'a mouse', 'a remote', 'a keyboard', 'a cell phone', 'a microwave', 'an oven',
-						'a toaster', 'a sink', 'a refrigerator', 'a book', 'a clock', 'a vase', 'a scissor',
-						'a teddy bear', 'a hairdryer', 'a toothbrush']
-
-	CLASSES_PLURAL = ['people', 'bicycles', 'cars', 'motorbikes', 'aeroplanes', 'buses', 'trains', 'trucks', 'boats',
-					'traffic lights', 'fire hydrants', 'stop signs', 'parking meters', 'benches', 'birds', 'cats',
-					'dogs', 'horses', 'multiple sheep', 'cows', 'elephants', 'bears', 'zebras', 'giraffes',
-					'backpacks', 'umbrellas', 'handbags', 'ties', 'suitcases', 'frisbees', 'skis', 'snowboards',
-					'sports balls', 'kites', 'baseball bats', 'baseball gloves', 'skateboards', 'surfboards',
-					'tennis rackets', 'bottles', 'wine glasses', 'cups', 'forks', 'knives', 'spoons', 'bowls',
-					'bananas', 'apples', 'sandwiches', 'oranges', 'broccoli', 'carrots', 'hot dogs', 'pizzas',
-					'donuts', 'cakes', 'chairs', 'sofas', 'potted plants', 'beds', 'dining tables', 'toilets',
-					'tv monitors', 'laptops', 'mice', 'remotes', 'keyboards', 'cell phones', 'microwaves', 'ovens',
-					'toasters', 'sinks', 'refrigerators', 'books', 'clocks', 'vases', 'scissors', 'teddy bears',
-					'hairdryers', 'toothbrushes']
+	#: Network input size the DLL runs the model at, see L{MODEL_INPUT_SIZE}. It cannot be changed.
+	INPUT_SIZE = MODEL_INPUT_SIZE
+	#: The loaded YOLOv3 DLL. DLLs stay loaded once loaded, so they are only loaded once per session. The model
+	#: is not: C{doDetection} reads the config and weights and frees the network on every call.
+	_lib = None
+	#: Serializes DLL loading and inference, which may run on the pipeline and warm-up threads
+	_lock = threading.Lock()
+	#: The loaded OpenCV core DLL, used to change the number of inference threads
+	_coreLib = None
+	#: Number of threads OpenCV may use for inference, 0 for OpenCV's default. See L{setThreadCount}.
+	_threadCount = 0
+
+	# singular and plural forms of class labels, kept here for existing users of these attributes
+	CLASSES_SINGULAR = CLASSES_SINGULAR
+	CLASSES_PLURAL = CLASSES_PLURAL
 
 	# python definition of 'Detection' struct
 	class Detection(Structure):
@@ -81,16 +75,49 @@ class YOLOv3Detection():
 			raise FileNotFoundError(notFound)
 
 	def _loadDLLs(self):
-		"""Loads all the DLL files."""
-		# loads all the DLLs required by the YOLOv3 DLL
-		for dllPath in self.dllPaths[:-1]:
-			# all the d
-			_ = CDLL(dllPath)
-
-		# load the YOLOv3 DLL
-		lib = CDLL(self.dllPaths[-1])
+		"""Loads all the DLL files, unless they were already loaded."""
+		if YOLOv3Detection._lib:
+			return YOLOv3Detection._lib
+		# Only counts and times loading the DLLs. The DLL reads the model files again on every detection, so
+		# loading the model is part of the inference time.
+		_instrumentation.increment("dllLoads")
+		if self._threadCount:
+			prepareThreadLimit(self._threadCount)
+		with _instrumentation.span("dllLoad"):
+			# loads all the DLLs required by the YOLOv3 DLL
+			dlls = [CDLL(dllPath) for dllPath in self.dllPaths[:-1]]
+
+			# load the YOLOv3 DLL
+			lib = CDLL(self.dllPaths[-1])
+		YOLOv3Detection._coreLib = dlls[0]
+		if self._threadCount:
+			setOpenCVThreads(dlls[0], self._threadCount)
+		YOLOv3Detection._lib = lib
 		return lib
 
+	def loadDLLs(self):
+		"""Loads the DLLs, unless they were already loaded. Only the DLLs stay loaded: the DLL reads the model
+		files and creates the network again on every detection."""
+		with self._lock:
+			self._loadDLLs()
+
+	@classmethod
+	def setThreadCount(cls, threads: int):
+		"""Limits the number of threads OpenCV uses for inference, from the next detection on.
+		@param threads: the number of threads
+		"""
+		with cls._lock:
+			if threads == cls._threadCount:
+				return
+			cls._threadCount = threads
+			if cls._coreLib:
+				setOpenCVThreads(cls._coreLib, threads)
+
+	@classmethod
+	def isLoaded(cls) -> bool:
+		"""Checks if the DLLs have been loaded in this session."""
+		return bool(cls._lib)
+
 	def _getDetections(self, lib) -> iter:
 		"""Calls the DLL public methods and gets the object detection results.
 		@return: List of L{Detection} objects
@@ -116,45 +143,40 @@ class YOLOv3Detection():
 		else:
 			return []
 
-	def _createSentence(self) -> str:
-		"""Creates a English sentence from the labels of all detected objects
-		@return: sentence form of object detection result
+	def detect(self) -> iter:
+		"""Runs the YOLOv3 model on the input image.
+		@return: array of DLL L{Detection} structs
 		"""
 		self._checkFiles()
-		lib = self._loadDLLs()
-		results = self._getDetections(lib)
-		if results:
-			# get class labels and their frequency counts
-			# assuming singular
-			classLabels = [self.CLASSES_SINGULAR[d.classId] for d in results]
-			counts = Counter(classLabels)
-			number_of_items = len(counts)
-
-			output_string = "The image contains "
-			for i, key in enumerate(counts.keys()):
-				if counts[key] == 1:
-					output_string = output_string + key
-				# if there are multiple instances of the same object in the image, use plural form
-				else:
-					output_string = output_string + self.CLASSES_PLURAL[self.CLASSES_SINGULAR.index(key)]
-
-				# rules for listing out identified objects
-				if i < (number_of_items - 2):
-					# add commas only if there are more than two objects
-					if number_of_items > 2:
-						output_string = output_string + ", "
-					else:
-						output_string = output_string + " "
-				# use and if its the second last object
-				elif i == (number_of_items - 2):
-					output_string = output_string + " and "
-				# end sentence with a full-stop
-				else:
-					output_string = output_string + "."
-
-			return output_string
-		else:
-			return "Cannot identify any objects in the image."
+		with self._lock:
+			lib = self._loadDLLs()
+			return self._getDetections(lib)
+
+	def getBoxes(self, detections) -> list:
+		"""Converts the DLL detections to L{_detectionResult.Detection} objects.
+		@param detections: detections returned by L{detect}
+		@return: list of the locations of the detected objects along with the associated object label
+		"""
+		return [
+			Detection(LABELS[d.classId].bare, d.x, d.y, d.width, d.height, d.classId, d.probability)
+			for d in detections
+		]
+
+	@staticmethod
+	def getSentence(detections, orderBySalience: bool = False) -> str:
+		"""Creates the sentence form of the detections in the current NVDA language.
+		@param detections: detections returned by L{detect}, or L{Detection} boxes
+		@param orderBySalience: list the most salient (confident and large) objects first instead of
+			listing them in detection order
+		"""
+		# imported here so that the DLL interface can also be used outside NVDA, see L{_backends}
+		import languageHandler
+		formatter = SentenceFormatter.forLanguage(languageHandler.getLanguage())
+		classIds = [d.classId for d in detections]
+		if orderBySalience:
+			saliences = [d.probability * d.width * d.height for d in detections]
+			return formatter.format(classIds, saliences)
+		return formatter.format(classIds)
 
 	def getResults(self) -> tuple:
 		"""Performs object detection on input image and returns the result in sentence form and the object
@@ -162,14 +184,5 @@ class YOLOv3Detection():
 		@return: Tuple of the form (sentence, boxes) where sentence is the result in sentence form and
 		boxes is a list of the locations of the detected objects along with the associated object label.
 		"""
-		lib = self._loadDLLs()
-		detections = self._getDetections(lib)
-		boxes = []
-		sentence = self._createSentence()
-		for detection in detections:
-			words = self.CLASSES_SINGULAR[detection.classId].split(" ")
-			# get only relevant part of the class label in singular form
-			classLabel = " ".join(words[1:]) if len(words) > 1 else words[0]
-			boxes.append(Detection(classLabel, detection.x, detection.y, detection.width, detection.height))
-
-		return (sentence, boxes)
+		detections = self.detect()
+		return (self.getSentence(detections), self.getBoxes(detections))
@@ -1,19 +1,37 @@
 # Object Detection: global plugin main module, result presentation and result caching
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
+import time
+#: Used to measure the cost of loading the add-on during NVDA startup
+_loadStartTime = time.perf_counter()
+
+import os
+import shutil
+import wx
+import gui
+import globalVars
 import globalPluginHandler
 from scriptHandler import script
 from globalCommands import SCRCAT_VISION
 import vision
 import ui
-import time
+import api
+import winUser
+import mouseHandler
+from logHandler import log
 from contentRecog import SimpleTextResult
 from contentRecog.recogUi import RecogResultNVDAObject
 from collections import deque
+from typing import Dict, Optional
 
-from ._doObjectDetection import DoDetectionYOLOv3
 from ._detectionResult import ObjectDetectionResults
 from ._resultUI import recognizeNavigatorObject
+from ._spatial import describe
+from . import _instrumentation
+from . import _offlineIndex
+from . import _classIndex
+from ._labels import LABELS
+from ._warmup import WarmUpService
 
 from visionEnhancementProviders.screenCurtain import ScreenCurtainSettings
 from visionEnhancementProviders.objectDetection import ObjectDetection
@@ -48,6 +66,23 @@ def getObjectDetectionVisionProvider() -> ObjectDetection:
 _cachedResults = deque(maxlen=10)
 
 
+def cacheResult(result: ObjectDetectionResults):
+	"""Caches the result in _cachedResults unless it is already cached. A cached result of the same image
+	that was detected at a lower input size is replaced.
+	@param result: object detection result
+	"""
+	global _cachedResults
+	# the index also keeps the objects of results that are no longer cached
+	_classIndex.addResult(result)
+	for cachedResult in _cachedResults:
+		if result.imageHash == cachedResult.imageHash:
+			if not cachedResult.isRerunWorthwhile(result.inputSize):
+				return
+			_cachedResults.remove(cachedResult)
+			break
+	_cachedResults.appendleft(result)
+
+
 class SpeakResults():
 	"""ResultHandlerClass that speaks the obtained result and draws boxes around the detected objects."""
 
@@ -68,22 +103,16 @@ class SpeakResults():
 		# if no objects were detected, stop here
 		if not boxes:
 			return
-		# if objects were detected draw bounding boxes for them
+		# if objects were detected draw bounding boxes for them, replacing the boxes of a previous result
 		od = getObjectDetectionVisionProvider()
+		od.clearObjectRects()
 		for box in boxes:
 			od.addObjectRect(box.label, RectLTRB(box.left, box.top, box.right, box.bottom))
 
 	def cacheResult(self):
 		"""Caches the result in _cachedResults unless it is already cached. The result may already be
 		cached since the same ResultHandlerClass is used to present result in case of cache hits."""
-		global _cachedResults
-		alreadyCached = False
-		for cachedResult in _cachedResults:
-			if self.result.imageHash == cachedResult.imageHash:
-				alreadyCached = True
-				break
-		if not alreadyCached:
-			_cachedResults.appendleft(self.result)
+		cacheResult(self.result)
 
 
 class BrowseableResults():
@@ -101,9 +130,16 @@ class BrowseableResults():
 		self.presentResult()
 
 	def presentResult(self):
-		"""converts the result sentence from string to L{SimpleTextResult}, create a virtual result window
-		using it and set focus onto the window."""
-		sentenceResult = SimpleTextResult(self.result.sentence)
+		"""converts the result sentence, followed by the object positions if enabled, from string to
+		L{SimpleTextResult}, create a virtual result window using it and set focus onto the window."""
+		text = self.result.sentence
+		# add the position of every object and the relations between them if the user asked for them
+		if ObjectDetection.getSettings().describeObjectPositions:
+			imgInfo = self.result.imgInfo
+			lines = describe(self.result.boxes, imgInfo.recogWidth, imgInfo.recogHeight)
+			if lines:
+				text = "\n".join([text] + lines)
+		sentenceResult = SimpleTextResult(text)
 		resObj = RecogResultNVDAObject(result=sentenceResult)
 		resObj.setFocus()
 
@@ -111,14 +147,110 @@ class BrowseableResults():
 		"""Caches the result in _cachedResults unless it is already cached. The result may already be
 			cached since the same ResultHandlerClass is used to present result in case of cache hits.
 		"""
-		global _cachedResults
-		alreadyCached = False
-		for cachedResult in _cachedResults:
-			if self.result.imageHash == cachedResult.imageHash:
-				alreadyCached = True
-				break
-		if not alreadyCached:
-			_cachedResults.appendleft(self.result)
+		cacheResult(self.result)
+
+
+#: The detection stack (L{_doObjectDetection} and the YOLOv3 interface) is only imported when it is first
+#: needed, or by the warm-up service during idle time, so that it does not add to NVDA's startup time.
+_detectionModule = None
+
+
+def getDetectionModule():
+	"""Imports the detection stack if it was not imported yet and returns it.
+	@return: the L{_doObjectDetection} module
+	"""
+	global _detectionModule
+	if not _detectionModule:
+		startTime = time.perf_counter()
+		from . import _doObjectDetection
+		_detectionModule = _doObjectDetection
+		log.debug(
+			f"(objectDetection) detection stack imported in {(time.perf_counter() - startTime) * 1000:.1f}ms"
+		)
+	return _detectionModule
+
+
+def getOfflineIndexPath() -> str:
+	"""Returns the path the offline index is imported to, in the NVDA user configuration directory so that it
+	is kept when the add-on is updated."""
+	return os.path.join(globalVars.appArgs.configPath, "objectDetection", "offlineIndex.odx")
+
+
+def loadOfflineIndex() -> int:
+	"""Loads the imported offline index, if any. Only the header is read, the rest of the index is mapped
+	into memory and paged in by lookups.
+	@return: number of images in the index
+	"""
+	try:
+		count = _offlineIndex.loadIndex(getOfflineIndexPath())
+	except (OSError, ValueError):
+		log.error("(objectDetection) could not load the offline index", exc_info=True)
+		return 0
+	if count:
+		log.debug(f"(objectDetection) offline index with {count} images loaded")
+	return count
+
+
+def importOfflineIndex(path: str):
+	"""Copies an offline index written by the bulk detection tool to the NVDA user configuration and loads
+	it, replacing any previously imported index.
+	@param path: path of the index to import
+	"""
+	try:
+		# check the file before replacing the current index with it
+		_offlineIndex.OfflineIndex(path).close()
+	except (OSError, ValueError):
+		log.debugWarning(f"(objectDetection) {path} is not an offline index", exc_info=True)
+		# Translators: Reported when the file chosen for import is not an object detection offline index
+		ui.message(_("The selected file is not an object detection offline index"))
+		return
+	destination = getOfflineIndexPath()
+	# the current index must be closed first since a mapped file cannot be replaced on Windows
+	_offlineIndex.loadIndex(None)
+	try:
+		os.makedirs(os.path.dirname(destination), exist_ok=True)
+		shutil.copyfile(path, destination + ".tmp")
+		os.replace(destination + ".tmp", destination)
+	except OSError:
+		log.error("(objectDetection) could not import the offline index", exc_info=True)
+		# the previously imported index, if any, is still in place
+		loadOfflineIndex()
+		# Translators: Reported when an offline index could not be copied to the NVDA configuration
+		ui.message(_("Could not import the offline index"))
+		return
+	count = loadOfflineIndex()
+	# Translators: Reported after an offline index was imported, with the number of images it contains
+	ui.message(_("Offline index imported with {count} images").format(count=count))
+
+
+def getForegroundArea() -> Optional[_classIndex.Area]:
+	"""Returns the screen rectangle of the foreground window, which objects are searched for in by
+	L{GlobalPlugin.script_findObject}, or None if it has no location."""
+	location = api.getForegroundObject().location
+	if not location:
+		return None
+	return (location.left, location.top, location.left + location.width, location.top + location.height)
+
+
+def moveToObject(classId: int, area: Optional[_classIndex.Area]) -> bool:
+	"""Moves the mouse to the centre of the most salient indexed object of a class, and the navigator object
+	to the object under it, then speaks the object label.
+	@param classId: class of the object
+	@param area: screen rectangle the object is searched in, see L{getForegroundArea}
+	@return: False if no object of the class was found
+	"""
+	found = _classIndex.findBest(classId, area)
+	if not found:
+		return False
+	x = (found.left + found.right) // 2
+	y = (found.top + found.bottom) // 2
+	winUser.setCursorPos(x, y)
+	mouseHandler.executeMouseMoveEvent(x, y)
+	obj = api.getDesktopObject().objectFromPoint(x, y)
+	if obj:
+		api.setNavigatorObject(obj)
+	ui.message(LABELS[classId].bare)
+	return True
 
 
 # Stores timestamp of when the script was last called. Initially set to zero.
@@ -139,6 +271,26 @@ def recentlyCalled() -> bool:
 
 class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 
+	def __init__(self):
+		super().__init__()
+		# applied here as well as on every detection, so that the warm-up and the first request are recorded
+		_instrumentation.setEnabled(ObjectDetection.getSettings().recordPerformanceStatistics)
+		# Import the detection stack and load the model once the user is idle so the first gesture does not
+		# have to pay for it.
+		self._warmUpService = WarmUpService(getDetectionModule, ObjectDetection.getSettings().warmUpDelay)
+		self._warmUpService.start()
+		loadOfflineIndex()
+		log.info(
+			f"(objectDetection) add-on loaded in {(time.perf_counter() - _loadStartTime) * 1000:.1f}ms"
+		)
+
+	def terminate(self):
+		self._warmUpService.terminate()
+		if _detectionModule:
+			_detectionModule.terminatePipeline()
+		_offlineIndex.loadIndex(None)
+		super().terminate()
+
 	@script(
 		description=_("Perform object detection on focused image. Press once to speak result, more than "
 					"once to present result in a virtual window."),
@@ -147,33 +299,108 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 	def script_detectObjectsYOLOv3(self, gesture):
 		global _cachedResults
 		wasRecentlyCalled = recentlyCalled()
-		od: ObjectDetection = getObjectDetectionVisionProvider()
+		_instrumentation.setEnabled(ObjectDetection.getSettings().recordPerformanceStatistics)
 		# get filterNonGraphic preference
 		filterNonGraphic = ObjectDetection.getSettings().filterNonGraphicElements
 
 		# If the screen curtain is enabled, a screenshot of the element will only contain black pixels.
 		# Such an image won't produce good results so inform the user and quit.
 		if not isScreenCurtainEnabled():
-			# Script not called in the last 3 seconds so use SpeakResults as resultHandlerClass
-			if not wasRecentlyCalled:
-				# if the bounding boxes are still being displayed, the user has not moved on to another
-				# image and so we can just present the previous result.
-				if od.currentlyDisplayingRects():
-					od.clearObjectRects()
-					# The most recent/previous result is stored at index 0
-					SpeakResults(_cachedResults[0])
-				else:
-					recognizer = DoDetectionYOLOv3(resultHandlerClass=SpeakResults, timeCreated=time.time())
-					recognizeNavigatorObject(recognizer, filterNonGraphic=filterNonGraphic,
-											cachedResults=_cachedResults)
-
-			# Script was called in the last 3 seconds so the user probably pressed the gesture multiple
-			# times and wants the result to be presented in a virtual result window.
-			else:
-				if od.currentlyDisplayingRects():
-					od.clearObjectRects()
-					BrowseableResults(_cachedResults[0])
-				else:
-					recognizer = DoDetectionYOLOv3(resultHandlerClass=BrowseableResults, timeCreated=time.time())
-					recognizeNavigatorObject(recognizer, filterNonGraphic=filterNonGraphic,
-											cachedResults=_cachedResults)
+			# Script not called in the last 3 seconds so use SpeakResults as resultHandlerClass. Otherwise the
+			# user probably pressed the gesture multiple times and wants the result to be presented in a
+			# virtual result window.
+			resultHandlerClass = BrowseableResults if wasRecentlyCalled else SpeakResults
+			# If the user has not moved on to another image, the previous result is found by
+			# L{recognizeNavigatorObject} without capturing and hashing the whole image again.
+			recognizer = getDetectionModule().DoDetectionYOLOv3(
+				resultHandlerClass=resultHandlerClass,
+				timeCreated=time.time()
+			)
+			recognizeNavigatorObject(recognizer, filterNonGraphic=filterNonGraphic,
+									cachedResults=_cachedResults)
+
+	@script(
+		# Translators: Describes a command that reports object detection performance statistics
+		description=_("Report object detection performance statistics and write them to the NVDA log"),
+		category=SCRCAT_VISION
+	)
+	def script_reportDetectionStatistics(self, gesture):
+		if not ObjectDetection.getSettings().recordPerformanceStatistics:
+			# Translators: Reported when performance statistics are requested but recording them is disabled
+			ui.message(_("Performance statistics are not being recorded. Enable them in the add-on settings."))
+			return
+		lines = _instrumentation.getReport()
+		if not lines:
+			# Translators: Reported when performance statistics are requested but nothing was recorded yet
+			ui.message(_("No performance statistics recorded yet"))
+			return
+		log.info("(objectDetection) performance statistics:\n" + "\n".join(lines))
+		ui.message("\n".join(lines))
+
+	@script(
+		# Translators: Describes a command that imports detection results computed offline
+		description=_("Import an object detection offline index created with the bulk detection tool"),
+		category=SCRCAT_VISION
+	)
+	def script_importOfflineIndex(self, gesture):
+		wx.CallAfter(self._showImportOfflineIndexDialog)
+
+	@script(
+		# Translators: Describes a command that finds an object, such as a person, in the detected images
+		description=_("Find an object in the images detected in the current window and move the mouse and "
+					"navigator object to it"),
+		category=SCRCAT_VISION
+	)
+	def script_findObject(self, gesture):
+		area = getForegroundArea()
+		counts = _classIndex.getClassCounts(area)
+		if not counts:
+			# Translators: Reported when objects are searched for but none were detected in the current window
+			ui.message(_("No objects detected in this window yet"))
+			return
+		wx.CallAfter(self._showFindObjectDialog, counts, area)
+
+	def _showFindObjectDialog(self, counts: Dict[int, int], area: Optional[_classIndex.Area]):
+		classIds = sorted(counts, key=lambda classId: LABELS[classId].bare)
+		choices = [
+			# Translators: An entry of the dialog used to choose the kind of object to find, such as "dog (2)"
+			_("{label} ({count})").format(label=LABELS[classId].bare, count=counts[classId])
+			for classId in classIds
+		]
+		gui.mainFrame.prePopup()
+		dialog = wx.SingleChoiceDialog(
+			gui.mainFrame,
+			# Translators: Message of the dialog used to choose the kind of object to find
+			_("Find an object in this window:"),
+			# Translators: Title of the dialog used to choose the kind of object to find
+			_("Find object"),
+			choices
+		)
+		try:
+			if dialog.ShowModal() != wx.ID_OK:
+				return
+			classId = classIds[dialog.GetSelection()]
+		finally:
+			dialog.Destroy()
+			gui.mainFrame.postPopup()
+		# the dialog had the focus, so wait for focus to return to the window before moving the navigator
+		wx.CallLater(100, moveToObject, classId, area)
+
+	def _showImportOfflineIndexDialog(self):
+		gui.mainFrame.prePopup()
+		dialog = wx.FileDialog(
+			gui.mainFrame,
+			# Translators: Title of the dialog used to choose an offline index to import
+			message=_("Import offline index"),
+			# Translators: File type shown in the dialog used to choose an offline index to import
+			wildcard=_("Offline index") + " (*.odx)|*.odx",
+			style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST
+		)
+		try:
+			if dialog.ShowModal() != wx.ID_OK:
+				return
+			path = dialog.GetPath()
+		finally:
+			dialog.Destroy()
+			gui.mainFrame.postPopup()
+		importOfflineIndex(path)
@@ -0,0 +1,168 @@
+# Object Detection: pluggable CPU detection backends usable inside and outside NVDA
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+from collections import namedtuple
+from typing import Dict, List, Type
+
+from ._labels import NUM_CLASSES
+from ._modelStore import getModelStore
+from ._resolution import MODEL_INPUT_SIZE
+
+
+class RawDetection(namedtuple("RawDetection", ("classId", "probability", "x", "y", "width", "height"))):
+	"""A single detection in image co-ordinates, with the same fields as the DLL's C{Detection} struct so
+	that backends can be used interchangeably with L{YOLOv3Detection}."""
+
+
+class DetectorBackend():
+	"""Base class for detection backends. A backend loads the model once and then detects objects in any
+	number of images. One backend instance must only be used by one thread at a time."""
+
+	#: Name used to select the backend
+	name: str = ""
+
+	def __init__(self, modelsDir: str):
+		"""
+		@param modelsDir: directory containing the yolov3.cfg and yolov3.weights files
+		"""
+		self.modelsDir = modelsDir
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		"""Checks if the backend can be used on this system."""
+		raise NotImplementedError
+
+	def load(self):
+		"""Loads the model. Called once, before the first detection."""
+		raise NotImplementedError
+
+	def setThreadCount(self, threads: int):
+		"""Limits the number of threads used for inference.
+		@param threads: the number of threads
+		"""
+		raise NotImplementedError
+
+	def detect(self, imagePath: str, inputSize: int = 0) -> List[RawDetection]:
+		"""Detects objects in an image.
+		@param imagePath: path of the image
+		@param inputSize: network input size, 0 for L{MODEL_INPUT_SIZE}
+		@return: all detections
+		@raise ValueError: if the backend cannot run at I{inputSize}
+		"""
+		raise NotImplementedError
+
+
+class DllBackend(DetectorBackend):
+	"""Runs detection with the YOLOv3 DLL shipped with the add-on (Windows only). The DLL always uses the
+	model files in the add-on's models directory and always runs at L{MODEL_INPUT_SIZE}."""
+	name = "dll"
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		return os.name == "nt"
+
+	def load(self):
+		from ._YOLOv3 import YOLOv3Detection
+		self._detectorClass = YOLOv3Detection
+
+	def setThreadCount(self, threads: int):
+		self._detectorClass.setThreadCount(threads)
+
+	def detect(self, imagePath: str, inputSize: int = 0) -> List[RawDetection]:
+		if inputSize and inputSize != MODEL_INPUT_SIZE:
+			raise ValueError(f"objectDetection: the dll backend only runs at input size {MODEL_INPUT_SIZE}")
+		detections = self._detectorClass(imagePath).detect()
+		return [RawDetection(d.classId, d.probability, d.x, d.y, d.width, d.height) for d in detections or ()]
+
+
+class OpenCVBackend(DetectorBackend):
+	"""Runs detection with the OpenCV DNN Python bindings, loading the model from the memory-mapped model
+	store so that the darknet files are converted and checked once for all workers. OpenCV copies the weights
+	into the network's own buffers, so every worker still holds a private copy of them; only the page cache
+	copy of the blob they are read from is shared."""
+	name = "opencv"
+
+	#: Detections less confident than this are dropped, matching the DLL
+	confidenceThreshold = 0.5
+	#: Overlap threshold used for non-maximum suppression, matching the DLL
+	nmsThreshold = 0.4
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		try:
+			import cv2  # noqa: F401
+			import numpy  # noqa: F401
+		except ImportError:
+			return False
+		return True
+
+	def load(self):
+		import cv2
+		import numpy
+		self._cv2 = cv2
+		self._numpy = numpy
+		blob = getModelStore(self.modelsDir).open()
+		self._net = cv2.dnn.readNetFromDarknet(
+			numpy.frombuffer(blob.config, dtype=numpy.uint8),
+			numpy.frombuffer(blob.darknetWeights, dtype=numpy.uint8)
+		)
+		self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+		self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+		self._outputNames = self._net.getUnconnectedOutLayersNames()
+
+	def setThreadCount(self, threads: int):
+		self._cv2.setNumThreads(threads)
+
+	def detect(self, imagePath: str, inputSize: int = 0) -> List[RawDetection]:
+		cv2, numpy = self._cv2, self._numpy
+		image = cv2.imread(imagePath)
+		if image is None:
+			raise ValueError(f"objectDetection: cannot read image {imagePath}")
+		height, width = image.shape[:2]
+		# YOLOv3 is fully convolutional, so the same network runs at every input size
+		size = inputSize or MODEL_INPUT_SIZE
+		self._net.setInput(cv2.dnn.blobFromImage(image, 1 / 255, (size, size), swapRB=True, crop=False))
+		outputs = numpy.concatenate(self._net.forward(self._outputNames))
+		scores = outputs[:, 5:5 + NUM_CLASSES]
+		classIds = scores.argmax(axis=1)
+		confidences = scores[numpy.arange(len(scores)), classIds]
+		keep = confidences > self.confidenceThreshold
+		outputs, classIds, confidences = outputs[keep], classIds[keep], confidences[keep]
+		boxWidths = outputs[:, 2] * width
+		boxHeights = outputs[:, 3] * height
+		lefts = outputs[:, 0] * width - boxWidths / 2
+		tops = outputs[:, 1] * height - boxHeights / 2
+		boxes = numpy.stack([lefts, tops, boxWidths, boxHeights], axis=1).astype(int).tolist()
+		indices = cv2.dnn.NMSBoxes(boxes, confidences.tolist(), self.confidenceThreshold, self.nmsThreshold)
+		return [
+			RawDetection(int(classIds[i]), float(confidences[i]), *boxes[i])
+			for i in numpy.array(indices).flatten()
+		]
+
+
+#: All known backends keyed by name, in order of preference
+BACKENDS: Dict[str, Type[DetectorBackend]] = {
+	backend.name: backend for backend in (DllBackend, OpenCVBackend)
+}
+
+
+def getBackend(name: str, modelsDir: str) -> DetectorBackend:
+	"""Creates and loads a backend.
+	@param name: name of the backend, or "auto" for the first available one
+	@param modelsDir: directory containing the model files
+	@raise ValueError: if the backend is unknown or not available on this system
+	"""
+	if name == "auto":
+		for backendClass in BACKENDS.values():
+			if backendClass.isAvailable():
+				break
+		else:
+			raise ValueError("objectDetection: no detection backend is available")
+	else:
+		backendClass = BACKENDS.get(name)
+		if not backendClass or not backendClass.isAvailable():
+			raise ValueError(f"objectDetection: detection backend {name!r} is not available")
+	backend = backendClass(modelsDir)
+	backend.load()
+	return backend
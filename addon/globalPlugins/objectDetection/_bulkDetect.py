@@ -0,0 +1,501 @@
+# Object Detection: offline bulk detection of image folders
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Detects objects in every image of a folder outside NVDA and writes one JSON line per image, including
+the sentence the add-on would speak. Run it with C{tools/bulkDetect.py}; see C{--help} for the options.
+"""
+
+import os
+import sys
+import json
+import gettext
+import time
+import argparse
+import threading
+import multiprocessing
+from typing import Iterable, List, Optional, Set, Tuple
+
+from ._backends import BACKENDS, DetectorBackend, getBackend
+from ._labels import LABELS, SentenceFormatter
+from ._resolution import MODEL_INPUT_SIZE
+from ._fingerprint import perceptualHash
+from ._offlineIndex import writeIndex
+from ._instrumentation import percentile
+from . import _resourceGovernor
+from ._triage import DEFAULT_THRESHOLDS, TriageThresholds, getStatistics, triage
+
+#: Files with these extensions are detected
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+#: Seconds between progress reports
+_progressInterval = 5.0
+#: Seconds the responsiveness probe of L{benchmarkThreads} sleeps between checks
+_probeInterval = 0.01
+
+#: The backend of a worker process, created by L{_initWorker}
+_backend: Optional[DetectorBackend] = None
+#: Why L{_initWorker} failed in a pool worker process, see L{_initPoolWorker}
+_initError: Optional[str] = None
+#: Input size used by the worker process
+_inputSize = 0
+#: Formats sentences the way the add-on speaks them in English
+_formatter: Optional[SentenceFormatter] = None
+
+
+def findImages(imageDir: str) -> List[str]:
+	"""Walks a directory and returns the paths of all images relative to it, with forward slashes, sorted so
+	that runs are reproducible."""
+	images = []
+	for dirPath, dirNames, fileNames in os.walk(imageDir):
+		dirNames.sort()
+		for fileName in fileNames:
+			if os.path.splitext(fileName)[1].lower() in IMAGE_EXTENSIONS:
+				relativePath = os.path.relpath(os.path.join(dirPath, fileName), imageDir)
+				images.append(relativePath.replace(os.sep, "/"))
+	images.sort()
+	return images
+
+
+def loadCheckpoint(outputPath: str) -> Set[str]:
+	"""Reads the images already recorded in an existing output file so that an interrupted run can resume.
+	A partially written last line, left by a crash, is removed from the file.
+	@return: relative paths of the images that are already done
+	"""
+	done = set()
+	if not os.path.exists(outputPath):
+		return done
+	validLength = 0
+	with open(outputPath, "rb") as f:
+		for line in f:
+			if not line.endswith(b"\n"):
+				break
+			try:
+				done.add(json.loads(line)["path"])
+			except (ValueError, KeyError):
+				break
+			validLength += len(line)
+	if validLength != os.path.getsize(outputPath):
+		with open(outputPath, "r+b") as f:
+			f.truncate(validLength)
+	return done
+
+
+def readPixels(imagePath: str) -> Optional[Tuple[bytes, int, int, Tuple[int, int, int]]]:
+	"""Decodes an image to packed 3 byte pixels with OpenCV or Pillow, whichever is installed.
+	@return: the pixels, width, height and offsets of the red, green and blue bytes within a pixel, or None
+		if no decoder is available
+	"""
+	try:
+		import cv2
+	except ImportError:
+		cv2 = None
+	if cv2:
+		image = cv2.imread(imagePath, cv2.IMREAD_COLOR)
+		if image is None:
+			raise ValueError(f"objectDetection: cannot read image {imagePath}")
+		height, width = image.shape[:2]
+		return image.tobytes(), width, height, (2, 1, 0)
+	try:
+		from PIL import Image
+	except ImportError:
+		return None
+	with Image.open(imagePath) as image:
+		image = image.convert("RGB")
+		width, height = image.size
+		return image.tobytes(), width, height, (0, 1, 2)
+
+
+def readFingerprint(imagePath: str) -> Optional[Tuple[int, int, int]]:
+	"""Decodes an image, see L{readPixels}, and calculates its L{perceptualHash}, the key the add-on uses to
+	find the image in an offline index.
+	@return: the fingerprint, width and height of the image, or None if no decoder is available
+	"""
+	image = readPixels(imagePath)
+	if not image:
+		return None
+	data, width, height, channelOffsets = image
+	return perceptualHash(data, width, height, 3, channelOffsets), width, height
+
+
+def _initWorker(
+		backendName: str, modelsDir: str, inputSize: int, threads: int = 0, lowPriority: bool = False,
+		memoryLimit: int = 0, backend: Optional[DetectorBackend] = None
+):
+	"""Runs once in every worker process, applies the resource limits and loads that worker's model.
+	@param threads: inference threads of the worker, 0 for the backend's default
+	@param lowPriority: run the worker below normal priority
+	@param memoryLimit: memory ceiling of the worker in megabytes, 0 for no ceiling
+	@param backend: an already loaded backend to use instead of loading one
+	"""
+	global _backend, _inputSize, _formatter
+	if memoryLimit:
+		_resourceGovernor.limitProcessMemory(memoryLimit)
+	if lowPriority:
+		_resourceGovernor.lowerProcessPriority()
+	_backend = backend or getBackend(backendName, modelsDir)
+	if threads:
+		_backend.setThreadCount(threads)
+	_inputSize = inputSize
+	# sentences are written in English, without a translation
+	gettext.NullTranslations().install()
+	_formatter = SentenceFormatter.forLanguage("en")
+
+
+def _initPoolWorker(*initArgs):
+	"""Runs L{_initWorker} in a pool worker process. An exception must not leave the initializer, since the
+	pool would then replace the worker with a new one that fails the same way, forever. It is raised by
+	L{_detectImage} instead, which ends the run."""
+	global _initError
+	try:
+		_initWorker(*initArgs)
+	except Exception as e:
+		_initError = f"{type(e).__name__}: {e}"
+
+
+def _detectImage(task) -> dict:
+	"""Detects the objects in one image.
+	@param task: tuple of the image directory and the path of the image relative to it
+	@return: JSON serializable record of the result
+	@raise RuntimeError: if the worker process could not be initialized
+	"""
+	if _initError:
+		raise RuntimeError(f"objectDetection: detection worker could not start: {_initError}")
+	imageDir, relativePath = task
+	imagePath = os.path.join(imageDir, relativePath)
+	startTime = time.perf_counter()
+	try:
+		detections = _backend.detect(imagePath, _inputSize)
+		fingerprint = readFingerprint(imagePath)
+	except Exception as e:
+		return {"path": relativePath, "error": str(e)}
+	record = {
+		"path": relativePath,
+		"sentence": _formatter.format([d.classId for d in detections]),
+		"detections": [
+			{
+				"classId": d.classId,
+				"label": LABELS[d.classId].bare,
+				"probability": round(d.probability, 4),
+				"x": d.x,
+				"y": d.y,
+				"width": d.width,
+				"height": d.height,
+			}
+			for d in detections
+		],
+		"seconds": round(time.perf_counter() - startTime, 4),
+	}
+	if fingerprint:
+		key, record["width"], record["height"] = fingerprint
+		# as a hex string, since not every JSON reader supports 64 bit integers
+		record["fingerprint"] = f"{key:016x}"
+	return record
+
+
+def _runTasks(
+		tasks: List[tuple], workers: int, initArgs: tuple, backend: Optional[DetectorBackend] = None
+) -> Iterable[dict]:
+	"""Runs the tasks in a pool of worker processes, or in this process if only one worker is requested,
+	and yields the results as they are completed.
+	@param backend: loaded backend used when the tasks run in this process
+	@raise RuntimeError: if a worker process could not be initialized
+	"""
+	if workers <= 1:
+		_initWorker(*initArgs, backend=backend)
+		for task in tasks:
+			yield _detectImage(task)
+		return
+	# leaving the with block because of an exception terminates the remaining workers
+	with multiprocessing.Pool(workers, initializer=_initPoolWorker, initargs=initArgs) as pool:
+		yield from pool.imap_unordered(_detectImage, tasks, chunksize=4)
+
+
+def bulkDetect(
+		imageDir: str, outputPath: str, backendName: str = "auto", workers: int = 0, inputSize: int = 0,
+		modelsDir: Optional[str] = None, resume: bool = True, checkpointEvery: int = 50, threads: int = 0,
+		lowPriority: bool = False, memoryLimit: int = 0, log=sys.stderr
+) -> dict:
+	"""Detects objects in every image of a directory and appends one JSON line per image to the output.
+	@param imageDir: directory searched recursively for images
+	@param outputPath: JSONL file the results are appended to. It also serves as the checkpoint.
+	@param backendName: name of the detection backend, see L{BACKENDS}
+	@param workers: number of worker processes, 0 for one per CPU
+	@param inputSize: network input size, 0 for L{MODEL_INPUT_SIZE}. Only the opencv backend can use other sizes.
+	@param modelsDir: directory containing the model files, defaults to the add-on's models directory
+	@param resume: skip images already in the output
+	@param checkpointEvery: number of results after which the output is flushed to disk
+	@param threads: inference threads per worker, 0 to share the processors evenly between the workers
+	@param lowPriority: run the workers below normal priority
+	@param memoryLimit: memory ceiling of every worker in megabytes, 0 for no ceiling
+	@param log: stream progress and the throughput report are written to
+	@return: throughput report
+	@raise ValueError: if the backend is not available
+	@raise RuntimeError: if a worker process could not be initialized
+	"""
+	if modelsDir is None:
+		modelsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+	# Load the backend here before starting any worker, so that a backend that is not available or a model
+	# that cannot be loaded fails once rather than in every worker. This also builds the model store that the
+	# workers open.
+	backend = getBackend(backendName, modelsDir)
+	workers = workers or os.cpu_count() or 1
+	# workers that each use every processor would only compete with each other
+	threads = threads or max(1, (os.cpu_count() or 1) // workers)
+	images = findImages(imageDir)
+	done = loadCheckpoint(outputPath) if resume else set()
+	tasks = [(imageDir, image) for image in images if image not in done]
+	print(f"{len(images)} images found, {len(images) - len(tasks)} already done, {workers} workers", file=log)
+	startTime = lastReport = time.perf_counter()
+	count = errors = 0
+	initArgs = (backend.name, modelsDir, inputSize, threads, lowPriority, memoryLimit)
+	if workers > 1:
+		# every worker loads its own model
+		backend = None
+	with open(outputPath, "a" if resume else "w", encoding="utf-8") as output:
+		for record in _runTasks(tasks, workers, initArgs, backend):
+			output.write(json.dumps(record) + "\n")
+			count += 1
+			errors += "error" in record
+			if count % checkpointEvery == 0:
+				output.flush()
+				os.fsync(output.fileno())
+			now = time.perf_counter()
+			if now - lastReport >= _progressInterval:
+				lastReport = now
+				print(f"{count}/{len(tasks)} images, {count / (now - startTime):.2f} images/s", file=log)
+	elapsed = time.perf_counter() - startTime
+	report = {
+		"images": count,
+		"errors": errors,
+		"skipped": len(images) - len(tasks),
+		"seconds": round(elapsed, 2),
+		"imagesPerSecond": round(count / elapsed, 2) if elapsed else 0.0,
+	}
+	print(
+		f"{count} images in {elapsed:.1f}s ({report['imagesPerSecond']} images/s), {errors} errors",
+		file=log
+	)
+	return report
+
+
+class _ResponsivenessProbe():
+	"""Measures how late a thread that wakes up at a fixed interval is woken, as a stand-in for how long
+	NVDA's speech and input handling wait for a processor while inference runs."""
+	def __init__(self):
+		self.lateness: List[float] = []
+		self._stop = threading.Event()
+		self._thread = threading.Thread(name="objectDetection.responsivenessProbe", target=self._run)
+		self._thread.daemon = True
+
+	def _run(self):
+		while not self._stop.is_set():
+			expected = time.perf_counter() + _probeInterval
+			time.sleep(_probeInterval)
+			self.lateness.append(max(0.0, time.perf_counter() - expected))
+
+	def start(self):
+		self._thread.start()
+
+	def stop(self) -> List[float]:
+		"""Stops the probe.
+		@return: sorted lateness samples in seconds
+		"""
+		self._stop.set()
+		self._thread.join()
+		return sorted(self.lateness)
+
+
+def benchmarkThreads(
+		imageDir: str, backendName: str = "auto", threadCounts: Optional[List[int]] = None,
+		sampleSize: int = 20, inputSize: int = 0, modelsDir: Optional[str] = None, log=sys.stderr
+) -> List[dict]:
+	"""Detects a sample of images once for every thread count and reports the detection latency against
+	the responsiveness of the rest of the system, to help choose the inference thread setting.
+	@param imageDir: directory searched recursively for images
+	@param threadCounts: thread counts to compare, by default every count from 1 to the number of processors
+	@param sampleSize: number of images detected at each thread count
+	@return: one report per thread count
+	"""
+	if modelsDir is None:
+		modelsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+	threadCounts = threadCounts or list(range(1, (os.cpu_count() or 1) + 1))
+	images = [os.path.join(imageDir, image) for image in findImages(imageDir)[:sampleSize]]
+	if not images:
+		raise ValueError(f"objectDetection: no images found in {imageDir}")
+	backend = getBackend(backendName, modelsDir)
+	# load the model and fill the caches before measuring
+	backend.detect(images[0], inputSize)
+	reports = []
+	print("threads  p50 latency  p95 latency  p95 probe delay", file=log)
+	for threads in threadCounts:
+		backend.setThreadCount(threads)
+		probe = _ResponsivenessProbe()
+		probe.start()
+		latencies = []
+		for image in images:
+			startTime = time.perf_counter()
+			backend.detect(image, inputSize)
+			latencies.append(time.perf_counter() - startTime)
+		lateness = probe.stop()
+		latencies.sort()
+		report = {
+			"threads": threads,
+			"p50LatencyMs": round(percentile(latencies, 0.5) * 1000, 1),
+			"p95LatencyMs": round(percentile(latencies, 0.95) * 1000, 1),
+			"p95ProbeDelayMs": round(percentile(lateness, 0.95) * 1000, 1) if lateness else 0.0,
+		}
+		reports.append(report)
+		print(
+			f"{threads:7d}  {report['p50LatencyMs']:9.1f}ms  {report['p95LatencyMs']:9.1f}ms  "
+			f"{report['p95ProbeDelayMs']:13.1f}ms",
+			file=log
+		)
+	return reports
+
+
+def benchmarkTriage(
+		imageDir: str, outputPath: str, thresholds: TriageThresholds = DEFAULT_THRESHOLDS, log=sys.stderr
+) -> dict:
+	"""Checks how well triage thresholds separate the images worth detecting from the others, using the
+	results of an earlier L{bulkDetect} run as labels. An image is labelled as worth detecting if the model
+	found any objects in it, unless its record has a C{worthDetecting} value, which can be added by hand to
+	correct the label.
+	@param imageDir: directory the images of the earlier run are in
+	@param outputPath: JSONL file written by L{bulkDetect}
+	@param thresholds: thresholds to evaluate
+	@param log: stream the report is written to
+	@return: counts of correct and wrong rejections, precision and recall of the rejections, triage time
+		and the detection time that correct rejections save
+	"""
+	counts = {"images": 0, "worthDetecting": 0, "rejected": 0, "correctRejections": 0, "wrongRejections": 0}
+	times = []
+	savedSeconds = 0.0
+	wrongRejections = []
+	with open(outputPath, "r", encoding="utf-8") as f:
+		records = [json.loads(line) for line in f]
+	for record in records:
+		if "error" in record:
+			continue
+		image = readPixels(os.path.join(imageDir, record["path"]))
+		if not image:
+			raise RuntimeError("objectDetection: evaluating triage needs opencv-python or Pillow")
+		data, width, height, channelOffsets = image
+		startTime = time.perf_counter()
+		reason = triage(getStatistics(data, width, height, 3, channelOffsets), thresholds)
+		times.append(time.perf_counter() - startTime)
+		worthDetecting = record.get("worthDetecting", bool(record["detections"]))
+		counts["images"] += 1
+		counts["worthDetecting"] += worthDetecting
+		if not reason:
+			continue
+		counts["rejected"] += 1
+		if worthDetecting:
+			counts["wrongRejections"] += 1
+			wrongRejections.append(f"{record['path']} ({reason}): {record['sentence']}")
+		else:
+			counts["correctRejections"] += 1
+			savedSeconds += record["seconds"]
+	if not times:
+		raise ValueError(f"objectDetection: no results found in {outputPath}")
+	times.sort()
+	notWorthDetecting = counts["images"] - counts["worthDetecting"]
+	report = dict(
+		counts,
+		precision=round(counts["correctRejections"] / counts["rejected"], 3) if counts["rejected"] else 1.0,
+		recall=round(counts["correctRejections"] / notWorthDetecting, 3) if notWorthDetecting else 1.0,
+		p50TriageMs=round(percentile(times, 0.5) * 1000, 2),
+		p95TriageMs=round(percentile(times, 0.95) * 1000, 2),
+		savedDetectionSeconds=round(savedSeconds, 2),
+	)
+	print(f"{thresholds}", file=log)
+	print(
+		f"{counts['rejected']} of {counts['images']} images rejected, {counts['correctRejections']} of "
+		f"{notWorthDetecting} images without objects (precision {report['precision']}, recall "
+		f"{report['recall']}), saving {report['savedDetectionSeconds']}s of detection",
+		file=log
+	)
+	print(f"triage time: p50 {report['p50TriageMs']}ms, p95 {report['p95TriageMs']}ms", file=log)
+	for line in wrongRejections:
+		print(f"wrongly rejected: {line}", file=log)
+	return report
+
+
+def buildIndex(outputPath: str, indexPath: str, inputSize: int = 0, log=sys.stderr) -> int:
+	"""Writes an offline index that the add-on can import from the results of L{bulkDetect}. Records without
+	a fingerprint, from failed detections or runs without an image decoder, are skipped.
+	@param outputPath: JSONL file written by L{bulkDetect}
+	@param indexPath: path of the index file
+	@param inputSize: network input size the detections were made at, 0 if unknown
+	@param log: stream the summary is written to
+	@return: number of images in the index
+	"""
+	def iterEntries():
+		with open(outputPath, "r", encoding="utf-8") as f:
+			for line in f:
+				record = json.loads(line)
+				if "fingerprint" not in record:
+					continue
+				width, height = record["width"], record["height"]
+				yield int(record["fingerprint"], 16), width, height, [
+					(
+						d["classId"], d["probability"],
+						d["x"] / width, d["y"] / height, d["width"] / width, d["height"] / height
+					)
+					for d in record["detections"]
+				]
+	count = writeIndex(iterEntries(), indexPath, inputSize)
+	print(f"{count} images written to the offline index {indexPath}", file=log)
+	return count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="Detect objects in every image of a folder.")
+	parser.add_argument("imageDir", help="directory searched recursively for images")
+	parser.add_argument("output", help="JSONL file results are appended to, also used to resume")
+	parser.add_argument("--backend", default="auto", choices=["auto"] + list(BACKENDS))
+	parser.add_argument("--workers", type=int, default=0, help="worker processes, default one per CPU")
+	parser.add_argument(
+		"--input-size", type=int, default=MODEL_INPUT_SIZE,
+		help="network input size, eg. 320, 416 or 608. The dll backend only runs at 416."
+	)
+	parser.add_argument("--models", help="directory containing yolov3.cfg and yolov3.weights")
+	parser.add_argument("--no-resume", action="store_true", help="overwrite the output instead of resuming")
+	parser.add_argument("--checkpoint-every", type=int, default=50, help="results between disk flushes")
+	parser.add_argument("--index", help="also write an offline index of all results that NVDA can import")
+	parser.add_argument("--threads", type=int, default=0, help="inference threads per worker")
+	parser.add_argument("--low-priority", action="store_true", help="run the workers below normal priority")
+	parser.add_argument("--memory-limit", type=int, default=0, help="memory ceiling per worker in megabytes")
+	parser.add_argument(
+		"--benchmark-threads", nargs="*", type=int, metavar="THREADS",
+		help="instead of writing results, compare detection latency and responsiveness at each thread count "
+		"(default: 1 to the number of processors) on a sample of the images"
+	)
+	parser.add_argument("--benchmark-images", type=int, default=20, help="images detected per thread count")
+	parser.add_argument(
+		"--benchmark-triage", action="store_true",
+		help="instead of detecting, check the triage thresholds against the results in OUTPUT of an earlier "
+		"run, where images without objects are the ones triage should reject"
+	)
+	parser.add_argument("--min-variance", type=float, default=DEFAULT_THRESHOLDS.minVariance)
+	parser.add_argument("--text-max-entropy", type=float, default=DEFAULT_THRESHOLDS.textMaxEntropy)
+	parser.add_argument("--text-min-edge-density", type=float, default=DEFAULT_THRESHOLDS.textMinEdgeDensity)
+	args = parser.parse_args(argv)
+	if args.benchmark_triage:
+		thresholds = TriageThresholds(args.min_variance, args.text_max_entropy, args.text_min_edge_density)
+		benchmarkTriage(args.imageDir, args.output, thresholds)
+		return 0
+	if args.benchmark_threads is not None:
+		benchmarkThreads(
+			args.imageDir, backendName=args.backend, threadCounts=args.benchmark_threads,
+			sampleSize=args.benchmark_images, inputSize=args.input_size, modelsDir=args.models
+		)
+		return 0
+	bulkDetect(
+		args.imageDir, args.output, backendName=args.backend, workers=args.workers,
+		inputSize=args.input_size, modelsDir=args.models, resume=not args.no_resume,
+		checkpointEvery=args.checkpoint_every, threads=args.threads, lowPriority=args.low_priority,
+		memoryLimit=args.memory_limit
+	)
+	if args.index:
+		buildIndex(args.output, args.index, args.input_size)
+	return 0
@@ -0,0 +1,193 @@
+# Object Detection: index of recently detected objects by class
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Finds objects of a class, such as a person, in every image recognized recently, without running the model
+again. The boxes of every class are kept in two flat arrays: the keys of the images they were found in, and
+their class-independent fields packed as 16 bit fractions of the image size, like in L{_offlineIndex}. Boxes
+stay valid when an image moves or is scaled, only the screen location of the image is updated.
+Only used on the main thread, where results are presented.
+"""
+
+from array import array
+from collections import namedtuple
+from typing import Dict, Optional, Sequence, Tuple
+
+#: Most images whose boxes are kept. When there are more, the least recently seen quarter is dropped.
+_maxImages = 2000
+
+#: Every box is stored as five unsigned 16 bit values: probability and the box left, top, width and height,
+#: all scaled from 0-1 to 0-65535 so boxes can be mapped onto the image wherever and at whatever size it is
+#: shown
+_boxFields = 5
+_boxScale = 65535
+
+#: Screen rectangle as left, top, right and bottom
+Area = Tuple[int, int, int, int]
+
+
+class _ImageEntry(
+		namedtuple("_ImageEntry", ("left", "top", "width", "height", "inputSize", "classIds", "lastSeen"))
+):
+	"""Screen location of an indexed image, the input size its boxes were detected at, the classes it has
+	boxes of and when it was last seen, as a counter that increases with every added result."""
+
+
+class FoundObject(namedtuple("FoundObject", ("classId", "probability", "left", "top", "right", "bottom"))):
+	"""An object found by L{ClassIndex.findBest}, in screen co-ordinates."""
+
+
+def _toFixed(value: float) -> int:
+	return min(max(int(round(value * _boxScale)), 0), _boxScale)
+
+
+def _overlaps(left: int, top: int, right: int, bottom: int, area: Optional[Area]) -> bool:
+	if area is None:
+		return True
+	return left < area[2] and right > area[0] and top < area[3] and bottom > area[1]
+
+
+class ClassIndex():
+	"""Maps class IDs to the boxes of that class in recently recognized images, see the module docstring."""
+	def __init__(self, maxImages: int = _maxImages):
+		"""
+		@param maxImages: most images whose boxes are kept
+		"""
+		self.maxImages = maxImages
+		#: Keys of the image of every box, per class ID
+		self._keys: Dict[int, array] = {}
+		#: L{_boxFields} values per box, in the order of L{_keys}, per class ID
+		self._boxes: Dict[int, array] = {}
+		self._images: Dict[int, _ImageEntry] = {}
+		self._counter = 0
+
+	def __len__(self) -> int:
+		"""Returns the number of indexed images."""
+		return len(self._images)
+
+	def addResult(self, result):
+		"""Adds the boxes of a result, or only updates the location of the image if its boxes are already
+		indexed from a result detected at the same or a larger input size.
+		@param result: an L{ObjectDetectionResults}
+		"""
+		key = result.imageHash
+		imgInfo = result.imgInfo
+		self._counter += 1
+		location = (imgInfo.screenLeft, imgInfo.screenTop, imgInfo.screenWidth, imgInfo.screenHeight)
+		entry = self._images.get(key)
+		if entry is not None and entry.inputSize >= result.inputSize:
+			self._images[key] = entry._replace(
+				left=location[0], top=location[1], width=location[2], height=location[3], lastSeen=self._counter
+			)
+			return
+		if entry is not None:
+			self._removeImages({key}, entry.classIds)
+		width, height = imgInfo.recogWidth, imgInfo.recogHeight
+		classIds = set()
+		for box in result.boxes:
+			if box.classId < 0:
+				continue
+			classIds.add(box.classId)
+			self._keys.setdefault(box.classId, array("q")).append(key)
+			self._boxes.setdefault(box.classId, array("H")).extend((
+				_toFixed(box.probability), _toFixed(box.x / width), _toFixed(box.y / height),
+				_toFixed(box.width / width), _toFixed(box.height / height)
+			))
+		self._images[key] = _ImageEntry(*location, result.inputSize, frozenset(classIds), self._counter)
+		if len(self._images) > self.maxImages:
+			self._evict()
+
+	def _evict(self):
+		"""Drops the least recently seen quarter of the images."""
+		byAge = sorted(self._images, key=lambda key: self._images[key].lastSeen)
+		keys = set(byAge[:max(1, len(byAge) // 4)])
+		classIds = set()
+		for key in keys:
+			classIds.update(self._images[key].classIds)
+		self._removeImages(keys, classIds)
+
+	def _removeImages(self, keys: set, classIds: Sequence[int]):
+		"""Removes images and their boxes. Only the arrays of I{classIds} are rebuilt."""
+		for key in keys:
+			del self._images[key]
+		for classId in classIds:
+			oldKeys, oldBoxes = self._keys[classId], self._boxes[classId]
+			newKeys, newBoxes = array("q"), array("H")
+			for index, key in enumerate(oldKeys):
+				if key not in keys:
+					newKeys.append(key)
+					newBoxes.extend(oldBoxes[index * _boxFields:(index + 1) * _boxFields])
+			if newKeys:
+				self._keys[classId], self._boxes[classId] = newKeys, newBoxes
+			else:
+				del self._keys[classId], self._boxes[classId]
+
+	def _iterObjects(self, classId: int, area: Optional[Area]):
+		"""Yields the L{FoundObject}s of a class in the images that overlap I{area}."""
+		boxes = self._boxes.get(classId)
+		if not boxes:
+			return
+		for index, key in enumerate(self._keys[classId]):
+			image = self._images[key]
+			if not _overlaps(image.left, image.top, image.left + image.width, image.top + image.height, area):
+				continue
+			probability, x, y, width, height = boxes[index * _boxFields:(index + 1) * _boxFields]
+			left = image.left + round(x * image.width / _boxScale)
+			top = image.top + round(y * image.height / _boxScale)
+			yield FoundObject(
+				classId, probability / _boxScale, left, top,
+				left + round(width * image.width / _boxScale), top + round(height * image.height / _boxScale)
+			)
+
+	def getClassCounts(self, area: Optional[Area] = None) -> Dict[int, int]:
+		"""Counts the indexed objects of every class.
+		@param area: only count objects in images that overlap this screen rectangle, if given
+		@return: number of objects keyed by class ID, only for classes with objects
+		"""
+		counts = {}
+		for classId in self._keys:
+			count = sum(1 for found in self._iterObjects(classId, area))
+			if count:
+				counts[classId] = count
+		return counts
+
+	def findBest(self, classId: int, area: Optional[Area] = None) -> Optional[FoundObject]:
+		"""Finds the most salient object of a class, the one with the largest product of confidence and screen
+		size, as used to order result sentences.
+		@param area: only consider images that overlap this screen rectangle, if given
+		@return: the object, or None if there is no object of the class
+		"""
+		return max(
+			self._iterObjects(classId, area),
+			key=lambda found: found.probability * (found.right - found.left) * (found.bottom - found.top),
+			default=None
+		)
+
+	def clear(self):
+		self._keys.clear()
+		self._boxes.clear()
+		self._images.clear()
+
+
+#: The index of every result cached by the add-on, see L{addResult}
+_index = ClassIndex()
+
+
+def addResult(result):
+	"""Adds a result to the index as it is cached, whether it was detected, found in the result cache or found
+	in the offline index. See L{ClassIndex.addResult}."""
+	_index.addResult(result)
+
+
+def getClassCounts(area: Optional[Area] = None) -> Dict[int, int]:
+	"""Counts the indexed objects of every class, see L{ClassIndex.getClassCounts}."""
+	return _index.getClassCounts(area)
+
+
+def findBest(classId: int, area: Optional[Area] = None) -> Optional[FoundObject]:
+	"""Finds the most salient indexed object of a class, see L{ClassIndex.findBest}."""
+	return _index.findBest(classId, area)
+
+
+def clear():
+	"""Forgets every indexed object."""
+	_index.clear()
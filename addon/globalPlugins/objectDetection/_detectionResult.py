@@ -1,40 +1,68 @@
 # Object Detection: detection and result classes
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
-from contentRecog import RecogImageInfo
 from collections import namedtuple
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+	# Only needed for annotations, so that detections can also be used outside NVDA, see L{_backends}
+	from contentRecog import RecogImageInfo
 
 
 class Detection():
 	"""Stores the detials of a single detection."""
-	def __init__(self, label: str, x: int, y: int, width: int, height: int):
+	def __init__(self, label: str, x: int, y: int, width: int, height: int, classId: int = -1,
+			probability: float = 1.0):
 		"""
 		@param label: Label of detected object
 		@param x: x co-ordinate of top left corner of object bounding box
 		@param y: y co-ordinate of top left corner of object bounding box
 		@param width: width of object bounding box
 		@param height: height of object bounding box
+		@param classId: index of the object class in the label tables, -1 if unknown
+		@param probability: confidence of the detection
 		"""
 		self.label = label
 		self.x = x
 		self.y = y
 		self.width = width
 		self.height = height
+		self.classId = classId
+		self.probability = probability
 
 
 class ObjectDetectionResults():
 	"""Stores image info and the details of detected objects."""
-	def __init__(self, imageHash: int, imgInfo: RecogImageInfo, sentence: str, boxes: iter):
+	def __init__(self, imageHash: int, imgInfo: "RecogImageInfo", sentence: str, boxes: iter, inputSize: int = 0):
 		"""
 		@param imageHash: hash used to uniquely identify the recognized image
 		@param imgInfo: stores details of the recognized image
 		@param sentence: Object detection result in sentence form
 		@param boxes: List of all objects detected stored as L{Detection} objects
+		@param inputSize: network input size the detection was run at, 0 if unknown
 		"""
 		self.imageHash = imageHash
 		self.imgInfo = imgInfo
 		self.sentence = sentence
 		self.boxes = boxes
+		self.inputSize = inputSize
+
+	def isRerunWorthwhile(self, inputSize: int) -> bool:
+		"""Checks if detecting the same image again at I{inputSize} could give a better result than this one.
+		@param inputSize: network input size that would be used for the new detection
+		@return: True if I{inputSize} is larger than the size this result was detected at
+		"""
+		return inputSize > self.inputSize
+
+	def movedTo(self, imgInfo: "RecogImageInfo") -> "ObjectDetectionResults":
+		"""Returns this result for the same image recognized again, which may be shown elsewhere on the screen,
+		so that boxes are drawn where the image is now.
+		@param imgInfo: details of the image as it was recognized now
+		@return: this result if it has the same image info, otherwise a copy with I{imgInfo}
+		"""
+		if imgInfo is self.imgInfo:
+			return self
+		return ObjectDetectionResults(self.imageHash, imgInfo, self.sentence, self.boxes, self.inputSize)
 
 	def getAdjustedLTRBBoxes(self) -> namedtuple:
 		"""Adjusts the in-image co-ordinates of the detections to screen co-ordinates
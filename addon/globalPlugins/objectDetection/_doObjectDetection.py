@@ -2,18 +2,27 @@
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
 import os
-import threading
+import time
 import tempfile
 import wx
 import ui
-from typing import Any
+import queueHandler
+from typing import Any, Optional
 import contentRecog
 from logHandler import log
 from locationHelper import RectLTWH
 from controlTypes import ROLE_GRAPHIC
+from visionEnhancementProviders.objectDetection import ObjectDetection
 
 from ._detectionResult import ObjectDetectionResults
 from ._YOLOv3 import YOLOv3Detection
+from ._pipeline import DetectionPipeline, PipelineJob
+from . import _instrumentation
+from ._warmup import noteDetectionTime
+from ._fingerprint import imageHash, perceptualHash
+from . import _offlineIndex
+from . import _resourceGovernor
+from . import _triage
 
 #: Elements with width or height small than this value will not be processed
 _sizeThreshold = 128
@@ -30,53 +39,30 @@ class DoDetectionYOLOv3(contentRecog.ContentRecognizer):
 		self.timeCreated = timeCreated
 		# Set to True only if Focus mode is enabled
 		self.checkChildren = False
+		# The pipeline job created by L{recognize}
+		self._job: Optional[PipelineJob] = None
+		# Identity and sampled checksum of the recognized object, set by L{recognizeNavigatorObject}
+		self.identity: Optional[tuple] = None
+		self.sampleChecksum: Optional[int] = None
 
-	def recognize(self, imageHash, pixels, imgInfo, onResult):
-		""" Starts the object detection process on a new thread and sets the I{onResult} method
-		@param imageHash: hash used to uniquely identify the recognized image
+	def recognize(self, pixels, imgInfo, onResult, cachedResults=None):
+		""" Submits the captured image to the detection pipeline and returns immediately. Fingerprinting,
+		cache lookup, preprocessing, inference, postprocessing and sentence building happen on the
+		pipeline threads.
 		@param pixels: 2D array of RGBAQUAD values that store image pixels
 		@param imgInfo: stores details of the image to be recognized
 		@param onResult: Function that defines logic for what to do when result is obtained
+		@param cachedResults: previous recognition results to look up before running inference
 		"""
-		self.imageHash = imageHash
 		self.imgInfo = imgInfo
-		# Copy pixels to empty bitmap and save it as a temporary jpeg image
-		bmp = wx.EmptyBitmap(imgInfo.recogWidth, imgInfo.recogHeight, 32)
-		bmp.CopyFromBuffer(pixels, wx.BitmapBufferFormat_RGB32)
-		self._imagePath = tempfile.mktemp(prefix="nvda_ObjectDetect_", suffix=".jpg")
-		bmp.SaveFile(self._imagePath, wx.BITMAP_TYPE_JPEG)
-		# Set L{onResult} method
-		self._onResult = onResult
-		# Start object detection on separate thread
-		t = threading.Thread(target=self._bgRecog)
-		t.daemon = True
-		t.start()
-
-	def _bgRecog(self):
-		"""Handles the object detection process thread and calls L{onResult} when the result is ready."""
-		try:
-			result = self.detect(self._imagePath)
-		except Exception as e:
-			result = e
-		finally:
-			# Delete temporary image file since we don't need it anymore
-			os.remove(self._imagePath)
-		if self._onResult:
-			self._onResult(result)
+		self._job = PipelineJob(self, pixels, imgInfo, onResult, cachedResults)
+		getPipeline().submit(self._job)
 
 	def cancel(self):
 		"""Cancels object detection process
-		@note: process runs but nothing is done on completion."""
-		self._onResult = None
-
-	def detect(self, imagePath: str) -> ObjectDetectionResults:
-		""" Gets the object detection results and returns it
-		@param imagePath: file system path to input image
-		@return: L{ObjectDetectionResults}
-		"""
-		sentence, boxes = YOLOv3Detection(imagePath).getResults()
-		result = ObjectDetectionResults(self.imageHash, self.imgInfo, sentence, boxes)
-		return result
+		@note: stages that already started run to completion but nothing is done on completion."""
+		if self._job:
+			self._job.cancel()
 
 	def validateObject(self, obj) -> bool:
 		"""Checks if the focus or navigator object or any of its children (only in case of focus objects)
@@ -121,3 +107,176 @@ class DoDetectionYOLOv3(contentRecog.ContentRecognizer):
 		@return: instance of I{self.resultHandlerClass}
 		"""
 		return self.resultHandlerClass(result)
+
+
+def _fingerprint(job: PipelineJob) -> bool:
+	"""Pipeline stage that calculates L{PipelineJob.imageHash}, and the L{PipelineJob.perceptualHash} if an
+	offline index is loaded. A job for an image that is already being detected, such as when the gesture is
+	pressed again to get a browseable result, is attached to the running job and ends here."""
+	data = bytes(job.pixels)
+	job.imageHash = imageHash(data)
+	if job.pipeline.coalesce(job):
+		job.pixels = None
+		return False
+	# later stages read the bytes rather than copying the captured bitmap again
+	job.pixels = data
+	if _offlineIndex.hasIndex():
+		job.perceptualHash = perceptualHash(data, job.imgInfo.recogWidth, job.imgInfo.recogHeight)
+	return True
+
+
+def _lookupCache(job: PipelineJob) -> bool:
+	"""Pipeline stage that checks if the hash of the current object matches that of any previous result. If
+	so, and the result was detected at an input size at least as large as the one the DLL runs at, the cached
+	result becomes the job result and the job ends here. Otherwise the image is looked up in the offline
+	index, whose results are used whatever size they were detected at."""
+	job.inputSize = YOLOv3Detection.INPUT_SIZE
+	# iterate over a copy since the cache is updated on the main thread
+	for result in list(job.cachedResults):
+		if result.imageHash == job.imageHash and not result.isRerunWorthwhile(job.inputSize):
+			_instrumentation.increment("cacheHits")
+			# the same image may be shown elsewhere on the screen, boxes must be drawn where it is now
+			job.result = result.movedTo(job.imgInfo)
+			return False
+	if job.perceptualHash:
+		found = _offlineIndex.findDetections(job.perceptualHash, job.imgInfo.recogWidth, job.imgInfo.recogHeight)
+		if found:
+			_instrumentation.increment("offlineIndexHits")
+			boxes, inputSize = found
+			orderBySalience = ObjectDetection.getSettings().orderObjectsBySalience
+			sentence = YOLOv3Detection.getSentence(boxes, orderBySalience=orderBySalience)
+			# handed to the result handler, which adds it to the result cache like any other result
+			job.result = ObjectDetectionResults(job.imageHash, job.imgInfo, sentence, boxes, inputSize)
+			return False
+	_instrumentation.increment("cacheMisses")
+	return True
+
+
+def _triageImage(job: PipelineJob) -> bool:
+	"""Pipeline stage that checks if the image is worth detecting, see L{_triage}. Images that are almost
+	entirely one colour or only show text end here with an L{ImageRejectedError} that explains why."""
+	settings = ObjectDetection.getSettings()
+	if settings.skipImagesWithoutObjects:
+		statistics = _triage.getStatistics(job.pixels, job.imgInfo.recogWidth, job.imgInfo.recogHeight)
+		reason = _triage.triage(statistics, getTriageThresholds(settings))
+		if reason:
+			log.debug(f"(objectDetection) image not detected ({reason}): {statistics}")
+			_instrumentation.increment("triageRejections")
+			job.pixels = None
+			if reason == _triage.BLANK:
+				# Translators: Reported instead of a result when the image is almost entirely one colour, such as
+				# an image that has not loaded yet.
+				message = _("The image is almost entirely one colour, there are no objects to detect.")
+			else:
+				# Translators: Reported instead of a result when the image seems to show only text.
+				message = _("The image seems to show only text. Try text recognition instead.")
+			job.result = _triage.ImageRejectedError(message)
+			return False
+	# Translators: Reporting when content recognition begins.
+	queueHandler.queueFunction(queueHandler.eventQueue, ui.message, _("Recognizing"))
+	return True
+
+
+def _preprocess(job: PipelineJob) -> bool:
+	"""Pipeline stage that converts the captured pixels to RGB and saves them as a temporary jpeg image."""
+	width, height = job.imgInfo.recogWidth, job.imgInfo.recogHeight
+	# pixels are stored as BGRX quads, reorder them to packed RGB using strided slices
+	bgrx = bytes(job.pixels)
+	rgb = bytearray(width * height * 3)
+	rgb[0::3] = bgrx[2::4]
+	rgb[1::3] = bgrx[1::4]
+	rgb[2::3] = bgrx[0::4]
+	# The bitmap is no longer needed, release it as early as possible
+	job.pixels = None
+	image = wx.Image(width, height, rgb)
+	job.imagePath = tempfile.mktemp(prefix="nvda_ObjectDetect_", suffix=".jpg")
+	image.SaveFile(job.imagePath, wx.BITMAP_TYPE_JPEG)
+	return True
+
+
+def _infer(job: PipelineJob) -> bool:
+	"""Pipeline stage that runs the YOLOv3 model on the temporary image. Cancelled jobs are not run unless
+	other requests are waiting for their result."""
+	try:
+		if job.pipeline.isAbandoned(job):
+			return False
+		applyResourceLimits()
+		job.detector = YOLOv3Detection(job.imagePath)
+		startTime = time.perf_counter()
+		job.detections = job.detector.detect()
+		noteDetectionTime(time.perf_counter() - startTime)
+	finally:
+		# Delete temporary image file since we don't need it anymore
+		os.remove(job.imagePath)
+	return True
+
+
+def _postprocess(job: PipelineJob) -> bool:
+	"""Pipeline stage that converts the raw detections to L{Detection} boxes."""
+	job.boxes = job.detector.getBoxes(job.detections)
+	return True
+
+
+def _buildSentence(job: PipelineJob) -> bool:
+	"""Pipeline stage that creates the sentence form of the result and the final result object."""
+	orderBySalience = ObjectDetection.getSettings().orderObjectsBySalience
+	sentence = job.detector.getSentence(job.detections, orderBySalience=orderBySalience)
+	job.result = ObjectDetectionResults(job.imageHash, job.imgInfo, sentence, job.boxes, job.inputSize)
+	return False
+
+
+def getTriageThresholds(settings) -> _triage.TriageThresholds:
+	"""Converts the triage settings of the provider, which are whole numbers, to L{_triage.TriageThresholds}.
+	@param settings: the settings of the L{ObjectDetection} provider
+	"""
+	return _triage.TriageThresholds(
+		minVariance=float(settings.triageMinVariance),
+		textMaxEntropy=settings.triageTextMaxEntropy / 10,
+		textMinEdgeDensity=settings.triageTextMinEdgeDensity / 100,
+	)
+
+
+def applyResourceLimits():
+	"""Applies the user's thread count, priority and memory settings to the calling thread and the DLL. Called
+	on the thread that is about to run inference. The priority does not reach OpenCV's worker threads, see
+	L{_resourceGovernor.setCurrentThreadPriority}.
+	@raise MemoryError: if running the detection would exceed the memory limit
+	"""
+	settings = ObjectDetection.getSettings()
+	_resourceGovernor.setCurrentThreadPriority(settings.lowerInferencePriority)
+	YOLOv3Detection.setThreadCount(_resourceGovernor.getThreadCount(settings.inferenceThreads))
+	# The DLL reads the weights into a new network on every detection, even once it is loaded, and the
+	# weights make up almost all of the memory that network uses
+	weightsFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "yolov3.weights")
+	expectedGrowth = os.path.getsize(weightsFile) if os.path.exists(weightsFile) else 0
+	_resourceGovernor.checkMemory(settings.memoryLimit, expectedGrowth)
+
+
+#: The pipeline shared by all recognizers. Created on first use.
+_pipeline: Optional[DetectionPipeline] = None
+
+
+def getPipeline() -> DetectionPipeline:
+	"""Returns the detection pipeline, creating it if required. Only used to submit jobs: stage functions use
+	the L{PipelineJob.pipeline} of their job, so that a job that is still running when the pipeline is
+	terminated does not create a new one."""
+	global _pipeline
+	if not _pipeline:
+		_pipeline = DetectionPipeline([
+			("fingerprint", _fingerprint),
+			("cacheLookup", _lookupCache),
+			("triage", _triageImage),
+			("preprocess", _preprocess),
+			("inference", _infer),
+			("postprocess", _postprocess),
+			("sentence", _buildSentence),
+		])
+	return _pipeline
+
+
+def terminatePipeline():
+	"""Stops the pipeline threads if the pipeline was created."""
+	global _pipeline
+	if _pipeline:
+		_pipeline.terminate()
+		_pipeline = None
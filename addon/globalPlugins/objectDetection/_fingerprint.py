@@ -0,0 +1,77 @@
+# Object Detection: image fingerprints used to find cached results
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from typing import Iterable, List
+
+#: Fractions of the image height at which rows are sampled for L{sampleChecksum}
+_sampleRowFractions = (0.25, 0.5, 0.75)
+
+#: Columns and rows of the grid of average brightness values compared by L{perceptualHash}. Nine columns give
+#: eight comparisons per row, so the hash has 64 bits.
+_perceptualGrid = (9, 8)
+#: Pixels sampled along each side of a grid cell by L{perceptualHash}
+_perceptualSamples = 4
+
+
+def imageHash(pixels) -> int:
+	"""Calculates the hash of a captured image using the inbuilt hash function. All pixels must be used
+	since using only part of the image may cause false cache hits for images with padding.
+	@param pixels: 2D array of RGBAQUAD values, or any other object supporting the buffer protocol
+	"""
+	return hash(bytes(pixels))
+
+
+def getSampleRows(height: int) -> List[int]:
+	"""Returns the indices of the rows used for L{sampleChecksum} in an image of the given height."""
+	return [int(height * fraction) for fraction in _sampleRowFractions]
+
+
+def sampleChecksum(rows: Iterable) -> int:
+	"""Calculates a cheap checksum of an image from a few of its rows, as selected by L{getSampleRows}.
+	Only used to confirm that an object still shows the same image as when it was last recognized; a match
+	is not proof that the whole image is unchanged.
+	@param rows: captured pixels of every sampled row
+	"""
+	return hash(tuple(bytes(row) for row in rows))
+
+
+def perceptualHash(data, width: int, height: int, bytesPerPixel: int = 4, channelOffsets=(2, 1, 0)) -> int:
+	"""Calculates a 64 bit difference hash of an image. The image is reduced to a 9x8 grid of average
+	brightness values and every bit records whether a cell is brighter than its right neighbour. Unlike
+	L{imageHash}, the hash of an image usually survives scaling, screen capture and recompression, so it can
+	be used to find results detected offline from the original image files, see L{_offlineIndex}.
+	Cells are averaged from a fixed number of sampled pixels, so the cost does not depend on the image size.
+	@param data: packed pixels, row by row without padding
+	@param width: width of the image
+	@param height: height of the image
+	@param bytesPerPixel: 4 for captured BGRX pixels, 3 for packed RGB or BGR images
+	@param channelOffsets: offsets of the red, green and blue bytes within a pixel
+	@return: the hash, 0 for images without any detail, such as a blank image
+	"""
+	columns, rows = _perceptualGrid
+	redOffset, greenOffset, blueOffset = channelOffsets
+	rowStride = width * bytesPerPixel
+	# pixel offsets sampled in every cell, at the centres of an even sub-grid
+	xs = [
+		int((column * _perceptualSamples + sample + 0.5) * width / (columns * _perceptualSamples)) * bytesPerPixel
+		for column in range(columns) for sample in range(_perceptualSamples)
+	]
+	ys = [
+		int((row * _perceptualSamples + sample + 0.5) * height / (rows * _perceptualSamples)) * rowStride
+		for row in range(rows) for sample in range(_perceptualSamples)
+	]
+	value = 0
+	for row in range(rows):
+		brightness = [0] * columns
+		for y in ys[row * _perceptualSamples:(row + 1) * _perceptualSamples]:
+			for index, x in enumerate(xs):
+				offset = y + x
+				# integer approximation of the ITU-R BT.601 luma weights
+				brightness[index // _perceptualSamples] += (
+					299 * data[offset + redOffset]
+					+ 587 * data[offset + greenOffset]
+					+ 114 * data[offset + blueOffset]
+				)
+		for column in range(columns - 1):
+			value = (value << 1) | (brightness[column] > brightness[column + 1])
+	return value
@@ -0,0 +1,129 @@
+# Object Detection: lightweight performance instrumentation
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+#: Recording only happens when this is True. Every public function checks it first so that the cost of
+#: instrumentation is a single attribute lookup when it is disabled.
+enabled = False
+
+#: Number of most recent samples kept per histogram
+_histogramSize = 256
+
+_lock = threading.Lock()
+#: Rolling timing samples (in seconds) keyed by span name
+_histograms: Dict[str, deque] = {}
+#: Event counters keyed by name
+_counters: Dict[str, int] = {}
+#: Largest queue depth seen keyed by queue name
+_maxQueueDepths: Dict[str, int] = {}
+
+
+class _Span():
+	"""Context manager that records the time spent inside it in the histogram for its name."""
+	__slots__ = ("name", "start")
+
+	def __init__(self, name: str):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		recordTiming(self.name, time.perf_counter() - self.start)
+
+
+class _NullSpan():
+	"""Context manager returned by L{span} when instrumentation is disabled. Does nothing."""
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		pass
+
+
+_nullSpan = _NullSpan()
+
+
+def setEnabled(state: bool):
+	"""Turns recording on or off. Recorded data is kept when recording is turned off."""
+	global enabled
+	enabled = state
+
+
+def span(name: str):
+	"""Returns a context manager that records the time spent in it under I{name}."""
+	return _Span(name) if enabled else _nullSpan
+
+
+def recordTiming(name: str, seconds: float):
+	"""Adds a timing sample to the histogram for I{name}."""
+	if not enabled:
+		return
+	with _lock:
+		samples = _histograms.get(name)
+		if samples is None:
+			samples = _histograms[name] = deque(maxlen=_histogramSize)
+		samples.append(seconds)
+
+
+def increment(name: str, count: int = 1):
+	"""Increases the counter for I{name}."""
+	if not enabled:
+		return
+	with _lock:
+		_counters[name] = _counters.get(name, 0) + count
+
+
+def recordQueueDepth(name: str, depth: int):
+	"""Records the depth of a queue, keeping the largest depth seen."""
+	if not enabled:
+		return
+	with _lock:
+		if depth > _maxQueueDepths.get(name, 0):
+			_maxQueueDepths[name] = depth
+
+
+def reset():
+	"""Discards all recorded data."""
+	with _lock:
+		_histograms.clear()
+		_counters.clear()
+		_maxQueueDepths.clear()
+
+
+def percentile(sortedSamples: List[float], fraction: float) -> float:
+	"""Returns the nearest-rank percentile of already sorted samples."""
+	index = min(len(sortedSamples) - 1, int(fraction * len(sortedSamples)))
+	return sortedSamples[index]
+
+
+def getReport() -> List[str]:
+	"""Summarizes the recorded data.
+	@return: list of report lines: timings with p50/p95, cache hit rate, counters and queue depths
+	"""
+	with _lock:
+		histograms = {name: sorted(samples) for name, samples in _histograms.items()}
+		counters = dict(_counters)
+		queueDepths = dict(_maxQueueDepths)
+	lines = []
+	for name, samples in histograms.items():
+		lines.append(
+			f"{name}: p50 {percentile(samples, 0.5) * 1000:.0f}ms, "
+			f"p95 {percentile(samples, 0.95) * 1000:.0f}ms, {len(samples)} samples"
+		)
+	hits = counters.pop("cacheHits", 0)
+	misses = counters.pop("cacheMisses", 0)
+	if hits or misses:
+		lines.append(f"cache hit rate: {hits * 100 / (hits + misses):.0f}% of {hits + misses} lookups")
+	for name, count in counters.items():
+		lines.append(f"{name}: {count}")
+	for name, depth in queueDepths.items():
+		lines.append(f"{name} queue: max depth {depth}")
+	return lines
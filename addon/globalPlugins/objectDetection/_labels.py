@@ -0,0 +1,159 @@
+# Object Detection: precomputed class label tables and result sentence formatter
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from array import array
+from collections import namedtuple
+from typing import Dict, Optional, Sequence
+
+
+def N_(message: str) -> str:
+	"""Marks a string for translation without translating it, for strings that are translated later with
+	C{_}, such as the label tables below. xgettext extracts the strings marked with C{N_}, see the gettext
+	tool in site_scons."""
+	return message
+
+
+# define singular and plural forms of class labels
+# Translators: the singular forms of the objects the model can detect, used in object detection results,
+# eg. "The image contains a person and a dog."
+CLASSES_SINGULAR = [N_('a person'), N_('a bicycle'), N_('a car'), N_('a motorbike'), N_('an aeroplane'),
+					N_('a bus'), N_('a train'), N_('a truck'), N_('a boat'), N_('a traffic light'),
+					N_('a fire hydrant'), N_('a stop sign'), N_('a parking meter'), N_('a bench'),
+					N_('a bird'), N_('a cat'), N_('a dog'), N_('a horse'), N_('a sheep'), N_('a cow'),
+					N_('an elephant'), N_('a bear'), N_('a zebra'), N_('a giraffe'), N_('a backpack'),
+					N_('an umbrella'), N_('a handbag'), N_('a tie'), N_('a suitcase'), N_('a frisbee'),
+					N_('a pair of skis'), N_('a snowboard'), N_('a sports ball'), N_('a kite'),
+					N_('a baseball bat'), N_('a baseball glove'), N_('a skateboard'), N_('a surfboard'),
+					N_('a tennis racket'), N_('a bottle'), N_('a wine glass'), N_('a cup'), N_('a fork'),
+					N_('a knife'), N_('a spoon'), N_('a bowl'), N_('a banana'), N_('an apple'),
+					N_('a sandwich'), N_('an orange'), N_('broccoli'), N_('a carrot'), N_('a hot dog'),
+					N_('a pizza'), N_('a donut'), N_('a cake'), N_('a chair'), N_('a sofa'),
+					N_('a potted plant'), N_('a bed'), N_('a dining table'), N_('a toilet'),
+					N_('a tv monitor'), N_('a laptop'), N_('a mouse'), N_('a remote'), N_('a keyboard'),
+					N_('a cell phone'), N_('a microwave'), N_('an oven'), N_('a toaster'), N_('a sink'),
+					N_('a refrigerator'), N_('a book'), N_('a clock'), N_('a vase'), N_('a scissor'),
+					N_('a teddy bear'), N_('a hairdryer'), N_('a toothbrush')]
+
+# Translators: the plural forms of the objects the model can detect, used in object detection results when
+# an image contains several of them, eg. "The image contains people and a dog."
+CLASSES_PLURAL = [N_('people'), N_('bicycles'), N_('cars'), N_('motorbikes'), N_('aeroplanes'), N_('buses'),
+				N_('trains'), N_('trucks'), N_('boats'), N_('traffic lights'), N_('fire hydrants'),
+				N_('stop signs'), N_('parking meters'), N_('benches'), N_('birds'), N_('cats'), N_('dogs'),
+				N_('horses'), N_('multiple sheep'), N_('cows'), N_('elephants'), N_('bears'), N_('zebras'),
+				N_('giraffes'), N_('backpacks'), N_('umbrellas'), N_('handbags'), N_('ties'), N_('suitcases'),
+				N_('frisbees'), N_('skis'), N_('snowboards'), N_('sports balls'), N_('kites'),
+				N_('baseball bats'), N_('baseball gloves'), N_('skateboards'), N_('surfboards'),
+				N_('tennis rackets'), N_('bottles'), N_('wine glasses'), N_('cups'), N_('forks'),
+				N_('knives'), N_('spoons'), N_('bowls'), N_('bananas'), N_('apples'), N_('sandwiches'),
+				N_('oranges'), N_('broccoli'), N_('carrots'), N_('hot dogs'), N_('pizzas'), N_('donuts'),
+				N_('cakes'), N_('chairs'), N_('sofas'), N_('potted plants'), N_('beds'), N_('dining tables'),
+				N_('toilets'), N_('tv monitors'), N_('laptops'), N_('mice'), N_('remotes'), N_('keyboards'),
+				N_('cell phones'), N_('microwaves'), N_('ovens'), N_('toasters'), N_('sinks'),
+				N_('refrigerators'), N_('books'), N_('clocks'), N_('vases'), N_('scissors'),
+				N_('teddy bears'), N_('hairdryers'), N_('toothbrushes')]
+
+
+class ClassLabel(namedtuple("ClassLabel", ("singular", "plural", "bare"))):
+	"""Stores all the forms of a class label that are needed to present results.
+	@ivar singular: singular form including the article, used in sentences (eg. "a person")
+	@ivar plural: plural form, used in sentences when there are multiple instances (eg. "people")
+	@ivar bare: singular form without the article, used for bounding box labels (eg. "person")
+	"""
+
+
+def _stripArticle(label: str) -> str:
+	"""Removes the article from the singular form of a label, if it has one."""
+	words = label.split(" ")
+	return " ".join(words[1:]) if len(words) > 1 else words[0]
+
+
+#: Per-class label table indexed by class ID
+LABELS = tuple(
+	ClassLabel(singular, plural, _stripArticle(singular))
+	for singular, plural in zip(CLASSES_SINGULAR, CLASSES_PLURAL)
+)
+
+#: Number of classes the model can detect
+NUM_CLASSES = len(LABELS)
+
+
+class SentenceFormatter():
+	"""Creates the sentence form of a detection result from the class IDs of the detected objects using
+	precomputed, optionally localized, label tables."""
+
+	#: Formatters that have already been created, keyed by language
+	_formatters: Dict[str, "SentenceFormatter"] = {}
+
+	def __init__(self, labels: Sequence[ClassLabel], template: str, emptySentence: str,
+			separator: str, lastSeparator: str):
+		"""
+		@param labels: label table indexed by class ID
+		@param template: sentence template with a single C{{objects}} field for the list of objects
+		@param emptySentence: sentence used when no objects were detected
+		@param separator: placed between listed objects
+		@param lastSeparator: placed between the last two listed objects
+		"""
+		self.labels = labels
+		self.template = template
+		self.emptySentence = emptySentence
+		self.separator = separator
+		self.lastSeparator = lastSeparator
+		# fixed size table of zeros copied for every result instead of building a new counter
+		self._zeroCounts = array("I", [0]) * len(labels)
+		self._zeroSaliences = array("d", [0.0]) * len(labels)
+
+	@classmethod
+	def forLanguage(cls, language: str) -> "SentenceFormatter":
+		"""Returns the formatter for a language, building its label table the first time the language is used.
+		Labels and sentence parts are translated with the gettext function installed for the add-on, so it must
+		be installed before the first call, also outside NVDA. Bounding box labels are not translated.
+		@param language: language code, only used as the cache key
+		"""
+		formatter = cls._formatters.get(language)
+		if formatter:
+			return formatter
+		labels = tuple(ClassLabel(_(label.singular), _(label.plural), label.bare) for label in LABELS)
+		formatter = cls(
+			labels,
+			# Translators: the sentence form of an object detection result, {objects} is replaced with the list
+			# of detected objects
+			template=_("The image contains {objects}."),
+			# Translators: presented when no objects were detected in an image
+			emptySentence=_("Cannot identify any objects in the image."),
+			# Translators: separates the objects listed in an object detection result
+			separator=_(", "),
+			# Translators: separates the last two objects listed in an object detection result
+			lastSeparator=_(" and "),
+		)
+		cls._formatters[language] = formatter
+		return formatter
+
+	def format(self, classIds: Sequence[int], saliences: Optional[Sequence[float]] = None) -> str:
+		"""Creates the sentence form of a result.
+		@param classIds: class ID of every detected object
+		@param saliences: optional salience (eg. confidence times area) of every detected object. If given,
+			classes are listed by their total salience, most salient first. Otherwise they are listed in the
+			order they were first detected.
+		@return: sentence form of the result
+		"""
+		counts = self._zeroCounts[:]
+		order = []
+		for classId in classIds:
+			if not counts[classId]:
+				order.append(classId)
+			counts[classId] += 1
+		if not order:
+			return self.emptySentence
+		if saliences is not None:
+			totals = self._zeroSaliences[:]
+			for classId, salience in zip(classIds, saliences):
+				totals[classId] += salience
+			order.sort(key=totals.__getitem__, reverse=True)
+		labels = self.labels
+		# if there are multiple instances of the same object in the image, use plural form
+		parts = [labels[classId].plural if counts[classId] > 1 else labels[classId].singular for classId in order]
+		if len(parts) > 1:
+			objects = self.separator.join(parts[:-1]) + self.lastSeparator + parts[-1]
+		else:
+			objects = parts[0]
+		return self.template.format(objects=objects)
@@ -0,0 +1,256 @@
+# Object Detection: memory-mapped model store
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import json
+import mmap
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+#: Identifies model blob files
+_blobMagic = b"ODMB"
+#: Version of the blob layout, increased whenever the layout changes
+_blobVersion = 2
+#: magic, version, darknet weights header (major, minor, revision, seen), config offset and length, offset
+#: of the original darknet weights header, weights offset and length
+_blobHeader = struct.Struct("<4sIiiiqQQQQQ")
+#: The config is aligned to this many bytes
+_configAlignment = 64
+#: The weights are page aligned, so that a loader that can use weights in place could use them straight from
+#: the mapping. OpenCV cannot, see L{_backends.OpenCVBackend}.
+_weightsAlignment = 4096
+#: Size of the chunks used when copying and hashing files
+_chunkSize = 1 << 20
+
+
+def _align(offset: int, alignment: int) -> int:
+	return (offset + alignment - 1) // alignment * alignment
+
+
+@contextmanager
+def _lockFile(path: str):
+	"""Holds an exclusive lock on a file, shared with other processes, while the block runs. Used so that only
+	one process builds a blob while the others wait for it."""
+	with open(path, "a+b") as f:
+		if os.name == "nt":
+			import msvcrt
+			f.seek(0)
+			while True:
+				try:
+					# gives up after about 10 seconds, building a blob can take longer
+					msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+					break
+				except OSError:
+					continue
+		else:
+			import fcntl
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			if os.name == "nt":
+				f.seek(0)
+				msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+			else:
+				fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _fileStamp(path: str) -> Dict[str, int]:
+	"""Returns the size and modification time of a file, used to detect changed source files."""
+	stat = os.stat(path)
+	return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+class ModelBlob():
+	"""A read-only memory mapping of a model blob. All users of the same blob file share the pages of the
+	mapping through the OS page cache, in this and any other process."""
+	def __init__(self, path: str):
+		"""
+		@param path: path of the blob file
+		"""
+		self.path = path
+		with open(path, "rb") as f:
+			self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		(
+			magic, version, self.major, self.minor, self.revision, self.seen,
+			configOffset, configLength, darknetOffset, weightsOffset, weightsLength
+		) = _blobHeader.unpack_from(self._mmap, 0)
+		if magic != _blobMagic or version != _blobVersion:
+			self._mmap.close()
+			raise ValueError(f"objectDetection: {path} is not a version {_blobVersion} model blob")
+		view = memoryview(self._mmap)
+		#: The darknet config as bytes
+		self.config = view[configOffset:configOffset + configLength]
+		#: The darknet weights as a flat, read-only float32 buffer
+		self.weights = view[weightsOffset:weightsOffset + weightsLength].cast("f")
+		#: The weights in the original darknet file layout (header followed by the weights), for loaders
+		#: that accept a darknet weights buffer
+		self.darknetWeights = view[darknetOffset:weightsOffset + weightsLength]
+
+	def checksum(self) -> str:
+		"""Calculates the SHA-256 checksum of the whole blob."""
+		digest = hashlib.sha256()
+		for start in range(0, len(self._mmap), _chunkSize):
+			digest.update(self._mmap[start:start + _chunkSize])
+		return digest.hexdigest()
+
+	def close(self):
+		"""Releases the mapping. The L{config} and L{weights} buffers must not be used afterwards."""
+		self.config.release()
+		self.weights.release()
+		self.darknetWeights.release()
+		self._mmap.close()
+
+
+class ModelStore():
+	"""Converts a darknet .cfg/.weights pair into a single aligned blob once, and hands out a shared,
+	read-only memory mapping of it. A manifest next to the blob stores its checksum and the size and
+	modification time of the source files, so stale or damaged blobs are detected. Processes that open the
+	store at the same time, such as the workers of the bulk detection tool, take a lock file so that only one
+	of them builds the blob."""
+	def __init__(self, modelsDir: str, name: str = "yolov3"):
+		"""
+		@param modelsDir: directory containing the I{name}.cfg and I{name}.weights files
+		@param name: base name of the model files
+		"""
+		self.configFile = os.path.join(modelsDir, f"{name}.cfg")
+		self.weightsFile = os.path.join(modelsDir, f"{name}.weights")
+		self.blobFile = os.path.join(modelsDir, f"{name}.blob")
+		self.manifestFile = os.path.join(modelsDir, "manifest.json")
+		self.lockFile = os.path.join(modelsDir, f"{name}.lock")
+		self._blob: Optional[ModelBlob] = None
+		self._lock = threading.Lock()
+
+	def _readManifest(self) -> Optional[dict]:
+		try:
+			with open(self.manifestFile, "r", encoding="utf-8") as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def isBuilt(self) -> bool:
+		"""Checks if the blob exists and was built from the current source files."""
+		manifest = self._readManifest()
+		if not manifest or not os.path.exists(self.blobFile):
+			return False
+		try:
+			return (
+				manifest["version"] == _blobVersion
+				and manifest["size"] == os.path.getsize(self.blobFile)
+				and manifest["sources"]["config"] == _fileStamp(self.configFile)
+				and manifest["sources"]["weights"] == _fileStamp(self.weightsFile)
+			)
+		except (KeyError, OSError):
+			return False
+
+	def build(self):
+		"""Converts the darknet files to a blob and writes the manifest. The blob and the manifest are written to
+		temporary files of this process first so that readers never see partially written files. L{open} only
+		calls this while it holds the L{lockFile}."""
+		with open(self.configFile, "rb") as f:
+			config = f.read()
+		weightsSize = os.path.getsize(self.weightsFile)
+		with open(self.weightsFile, "rb") as weights:
+			major, minor, revision = struct.unpack("<iii", weights.read(12))
+			# newer darknet versions store the number of images seen as a 64 bit integer
+			if (major * 10 + minor) >= 2 and major < 1000 and minor < 1000:
+				seen, = struct.unpack("<q", weights.read(8))
+			else:
+				seen, = struct.unpack("<i", weights.read(4))
+			darknetHeaderLength = weights.tell()
+			weights.seek(0)
+			weightsLength = weightsSize - darknetHeaderLength
+			configOffset = _align(_blobHeader.size, _configAlignment)
+			# the original darknet header is kept right before the page aligned weights
+			weightsOffset = _align(configOffset + len(config) + darknetHeaderLength, _weightsAlignment)
+			darknetOffset = weightsOffset - darknetHeaderLength
+			header = _blobHeader.pack(
+				_blobMagic, _blobVersion, major, minor, revision, seen,
+				configOffset, len(config), darknetOffset, weightsOffset, weightsLength
+			)
+			digest = hashlib.sha256()
+			tempFile = f"{self.blobFile}.{os.getpid()}.tmp"
+			with open(tempFile, "wb") as blob:
+				for data in (
+					header, bytes(configOffset - len(header)),
+					config, bytes(darknetOffset - configOffset - len(config)),
+				):
+					blob.write(data)
+					digest.update(data)
+				while True:
+					data = weights.read(_chunkSize)
+					if not data:
+						break
+					blob.write(data)
+					digest.update(data)
+		os.replace(tempFile, self.blobFile)
+		manifest = {
+			"version": _blobVersion,
+			"blob": os.path.basename(self.blobFile),
+			"size": os.path.getsize(self.blobFile),
+			"sha256": digest.hexdigest(),
+			"sources": {
+				"config": _fileStamp(self.configFile),
+				"weights": _fileStamp(self.weightsFile),
+			},
+		}
+		tempFile = f"{self.manifestFile}.{os.getpid()}.tmp"
+		with open(tempFile, "w", encoding="utf-8") as f:
+			json.dump(manifest, f, indent="\t")
+		os.replace(tempFile, self.manifestFile)
+
+	def open(self) -> ModelBlob:
+		"""Returns the shared mapping of the blob, building the blob first if it is missing or stale. When the
+		blob is first mapped in a process, the checksum of the whole blob is compared with the manifest. A blob
+		that does not match is rebuilt once. Only one process builds the blob at a time, the others wait for it
+		and use the blob it built.
+		@raise ValueError: if the blob still does not match its manifest after a rebuild
+		"""
+		with self._lock:
+			if self._blob:
+				return self._blob
+			blob = self._mapVerified() if self.isBuilt() else None
+			if not blob:
+				with _lockFile(self.lockFile):
+					# another process may have built the blob while this one waited for the lock
+					blob = self._mapVerified() if self.isBuilt() else None
+					if not blob:
+						self.build()
+						blob = self._mapVerified()
+			if not blob:
+				raise ValueError(f"objectDetection: checksum mismatch for model blob {self.blobFile}")
+			self._blob = blob
+			return blob
+
+	def _mapVerified(self) -> Optional[ModelBlob]:
+		"""Maps the blob and compares its checksum with the manifest. This reads every page of the blob.
+		@return: the mapping, or None if the checksum does not match
+		"""
+		manifest = self._readManifest()
+		if not manifest:
+			return None
+		blob = ModelBlob(self.blobFile)
+		if blob.checksum() != manifest.get("sha256"):
+			blob.close()
+			return None
+		return blob
+
+	def close(self):
+		"""Releases the shared mapping, if any."""
+		with self._lock:
+			if self._blob:
+				self._blob.close()
+				self._blob = None
+
+
+#: Stores shared by all users in this process, keyed by the blob path
+_stores: Dict[str, ModelStore] = {}
+
+
+def getModelStore(modelsDir: str, name: str = "yolov3") -> ModelStore:
+	"""Returns the store for a model, so that every backend in a process shares a single mapping."""
+	store = ModelStore(modelsDir, name)
+	return _stores.setdefault(store.blobFile, store)
@@ -0,0 +1,228 @@
+# Object Detection: memory-mapped index of detections computed offline
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import mmap
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from ._detectionResult import Detection
+from ._labels import LABELS, NUM_CLASSES
+
+#: Identifies offline index files
+_indexMagic = b"ODIX"
+#: Version of the index layout, increased whenever the layout changes
+_indexVersion = 2
+#: magic, version, number of keys, number of boxes, network input size of the detections. Padded to 32 bytes
+#: so that the keys that follow are 8 byte aligned.
+_indexHeader = struct.Struct("<4sIIII12x")
+#: Every box is stored as six unsigned 16 bit values: class ID, probability and the box left, top, width and
+#: height, all but the class ID scaled from 0-1 to 0-65535 so boxes can be mapped onto images of any size
+_boxFields = 6
+_boxScale = 65535
+#: The width and height of every image are stored as two unsigned 16 bit values, larger sizes are clamped
+_sizeFields = 2
+_maxSize = 65535
+#: Largest relative difference between the aspect ratio of an indexed image and a captured one that are
+#: considered the same image. Fingerprints are taken from a fixed grid whatever the image size, so an image
+#: stretched to another shape, or a different image, can have the same or a nearly equal fingerprint.
+_aspectRatioTolerance = 0.05
+
+#: A box read from or written to an index: class ID, probability and the left, top, width and height of the
+#: box as fractions of the image size
+IndexBox = Tuple[int, float, float, float, float, float]
+
+
+def _toFixed(value: float) -> int:
+	return min(max(int(round(value * _boxScale)), 0), _boxScale)
+
+
+def _sameAspectRatio(width: int, height: int, otherWidth: int, otherHeight: int) -> bool:
+	if not (width and height and otherWidth and otherHeight):
+		return False
+	return abs(width * otherHeight / (height * otherWidth) - 1) <= _aspectRatioTolerance
+
+
+def writeIndex(
+		entries: Iterable[Tuple[int, int, int, Sequence[IndexBox]]], path: str, inputSize: int = 0
+) -> int:
+	"""Writes an offline index. Entries with a fingerprint of 0 (images without detail) are skipped, and if
+	several images have the same fingerprint only the first is kept.
+	@param entries: tuples of the L{perceptualHash} of an image, its width and height and the boxes detected
+		in it
+	@param path: path of the index file, replaced atomically
+	@param inputSize: network input size the detections were made at, 0 if unknown
+	@return: number of images in the index
+	"""
+	byKey = {}
+	for key, imageWidth, imageHeight, boxes in entries:
+		if key and key not in byKey:
+			byKey[key] = (imageWidth, imageHeight, boxes)
+	keys = array("Q", sorted(byKey))
+	# offsets[i] is the index of the first box of keys[i], the boxes of the last key end at offsets[-1]
+	offsets = array("I", [0])
+	# the width and height of keys[i] are sizes[2 * i] and sizes[2 * i + 1]
+	sizes = array("H")
+	boxes = array("H")
+	for key in keys:
+		imageWidth, imageHeight, imageBoxes = byKey[key]
+		sizes.extend((min(imageWidth, _maxSize), min(imageHeight, _maxSize)))
+		for classId, probability, left, top, width, height in imageBoxes:
+			boxes.append(classId)
+			boxes.extend(_toFixed(value) for value in (probability, left, top, width, height))
+		offsets.append(len(boxes) // _boxFields)
+	if keys.itemsize != 8 or offsets.itemsize != 4 or sizes.itemsize != 2 or boxes.itemsize != 2:
+		raise RuntimeError("objectDetection: unsupported array item sizes")
+	tempFile = path + ".tmp"
+	with open(tempFile, "wb") as f:
+		f.write(_indexHeader.pack(_indexMagic, _indexVersion, len(keys), len(boxes) // _boxFields, inputSize))
+		keys.tofile(f)
+		offsets.tofile(f)
+		sizes.tofile(f)
+		boxes.tofile(f)
+	os.replace(tempFile, path)
+	return len(keys)
+
+
+class OfflineIndex():
+	"""A read-only memory mapping of an offline index written by L{writeIndex}. The sorted fingerprints are
+	searched in place with a binary search, so opening the index costs the same for any number of images and
+	a lookup only touches a few pages of the mapping."""
+
+	#: Lookups also accept fingerprints that differ in a single bit, since capturing a scaled image can flip a
+	#: bit whose two cells have almost the same brightness. Matches must also have the same aspect ratio.
+	acceptNearMatches = True
+
+	def __init__(self, path: str):
+		"""
+		@param path: path of the index file
+		@raise ValueError: if the file is not an offline index
+		"""
+		self.path = path
+		with open(path, "rb") as f:
+			self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self._mmap) < _indexHeader.size:
+			self._mmap.close()
+			raise ValueError(f"objectDetection: {path} is not an offline index")
+		magic, version, keyCount, boxCount, self.inputSize = _indexHeader.unpack_from(self._mmap, 0)
+		keysOffset = _indexHeader.size
+		offsetsOffset = keysOffset + 8 * keyCount
+		sizesOffset = offsetsOffset + 4 * (keyCount + 1)
+		boxesOffset = sizesOffset + 2 * _sizeFields * keyCount
+		if (
+			magic != _indexMagic or version != _indexVersion
+			or len(self._mmap) != boxesOffset + 2 * _boxFields * boxCount
+		):
+			self._mmap.close()
+			raise ValueError(f"objectDetection: {path} is not a version {_indexVersion} offline index")
+		view = memoryview(self._mmap)
+		self._keys = view[keysOffset:offsetsOffset].cast("Q")
+		self._offsets = view[offsetsOffset:sizesOffset].cast("I")
+		self._sizes = view[sizesOffset:boxesOffset].cast("H")
+		self._boxes = view[boxesOffset:].cast("H")
+
+	def __len__(self) -> int:
+		return len(self._keys)
+
+	def _find(self, key: int, imageWidth: int, imageHeight: int) -> int:
+		keys = self._keys
+		position = bisect_left(keys, key)
+		if position < len(keys) and keys[position] == key:
+			sizes = self._sizes
+			width, height = sizes[position * _sizeFields], sizes[position * _sizeFields + 1]
+			if _sameAspectRatio(width, height, imageWidth, imageHeight):
+				return position
+		return -1
+
+	def findBoxes(self, key: int, imageWidth: int, imageHeight: int) -> Optional[List[IndexBox]]:
+		"""Looks up the boxes detected in an image.
+		@param key: L{perceptualHash} of the image
+		@param imageWidth: width of the image, only images of the same aspect ratio match
+		@param imageHeight: height of the image
+		@return: the boxes, or None if the image is not in the index
+		"""
+		if not key:
+			return None
+		position = self._find(key, imageWidth, imageHeight)
+		if position < 0 and self.acceptNearMatches:
+			for bit in range(64):
+				position = self._find(key ^ (1 << bit), imageWidth, imageHeight)
+				if position >= 0:
+					break
+		if position < 0:
+			return None
+		boxes = self._boxes
+		result = []
+		end = self._offsets[position + 1] * _boxFields
+		for start in range(self._offsets[position] * _boxFields, end, _boxFields):
+			classId, probability, left, top, width, height = boxes[start:start + _boxFields]
+			result.append((
+				classId, probability / _boxScale,
+				left / _boxScale, top / _boxScale, width / _boxScale, height / _boxScale
+			))
+		return result
+
+	def close(self):
+		"""Releases the mapping."""
+		self._keys.release()
+		self._offsets.release()
+		self._sizes.release()
+		self._boxes.release()
+		self._mmap.close()
+
+
+#: The index used for lookups by L{findDetections}, if any
+_index: Optional[OfflineIndex] = None
+_indexLock = threading.Lock()
+
+
+def loadIndex(path: Optional[str]) -> int:
+	"""Replaces the index used by L{findDetections}, closing the previous one. A missing file is not an error.
+	@param path: path of the index file, or None to only close the current index
+	@return: number of images in the new index
+	@raise ValueError: if the file is not an offline index
+	"""
+	global _index
+	with _indexLock:
+		if _index:
+			_index.close()
+			_index = None
+		if path and os.path.exists(path):
+			_index = OfflineIndex(path)
+			return len(_index)
+	return 0
+
+
+def hasIndex() -> bool:
+	"""Checks if an index is loaded, so that callers can skip calculating fingerprints otherwise."""
+	return _index is not None
+
+
+def findDetections(key: int, imageWidth: int, imageHeight: int) -> Optional[Tuple[List[Detection], int]]:
+	"""Looks up an image in the loaded index and scales the boxes to the size it was captured at.
+	@param key: L{perceptualHash} of the captured image
+	@param imageWidth: width of the captured image
+	@param imageHeight: height of the captured image
+	@return: the detections and the network input size they were made at, or None if the image is not in the
+		index with the same aspect ratio or no index is loaded
+	"""
+	with _indexLock:
+		if not _index:
+			return None
+		boxes = _index.findBoxes(key, imageWidth, imageHeight)
+		inputSize = _index.inputSize
+	if boxes is None:
+		return None
+	detections = []
+	for classId, probability, left, top, width, height in boxes:
+		if classId >= NUM_CLASSES:
+			continue
+		detections.append(Detection(
+			LABELS[classId].bare,
+			int(left * imageWidth), int(top * imageHeight), int(width * imageWidth), int(height * imageHeight),
+			classId, probability
+		))
+	return detections, inputSize
@@ -0,0 +1,194 @@
+# Object Detection: staged detection pipeline connected by queues
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import threading
+import time
+import queue
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from logHandler import log
+from . import _instrumentation
+
+#: Seconds L{DetectionPipeline.terminate} waits for the stage threads to stop. A running inference can take
+#: seconds and cannot be interrupted, so it is not waited for: its thread is a daemon that ends with NVDA.
+_terminateTimeout = 0.5
+
+
+class PipelineJob():
+	"""Stores the state of a single detection request as it moves through the pipeline stages."""
+	def __init__(self, recognizer, pixels, imgInfo, onResult: Callable[[Any], None], cachedResults=None):
+		"""
+		@param recognizer: the recognizer that submitted the job
+		@param pixels: 2D array of RGBAQUAD values captured on the main thread
+		@param imgInfo: stores details of the image to be recognized
+		@param onResult: called with the result (or exception) once the job completes
+		@param cachedResults: previous recognition results to look up before running inference
+		"""
+		self.recognizer = recognizer
+		self.pixels = pixels
+		self.imgInfo = imgInfo
+		self.onResult = onResult
+		self.cachedResults = cachedResults if cachedResults is not None else []
+		# The pipeline the job was submitted to, which stages use rather than whichever pipeline is current,
+		# see L{DetectionPipeline.submit}
+		self.pipeline: Optional[DetectionPipeline] = None
+		# Filled in by the pipeline stages
+		self.imageHash: Optional[int] = None
+		self.perceptualHash: Optional[int] = None
+		self.imagePath: Optional[str] = None
+		self.inputSize = 0
+		self.detector = None
+		self.detections = None
+		self.boxes = None
+		self.result: Any = None
+		# Stores the time (in seconds) each stage spent working on this job, keyed by stage name
+		self.timings: Dict[str, float] = {}
+		self.timeSubmitted = time.perf_counter()
+		self.cancelled = False
+		# Jobs for the same image that were attached to this one instead of running, see
+		# L{DetectionPipeline.coalesce}, and the job this one is attached to, if any
+		self.followers: List[PipelineJob] = []
+		self.leader: Optional[PipelineJob] = None
+
+	def cancel(self):
+		"""Marks the job as cancelled. The result is not delivered, and stages that have not started yet skip
+		their work unless other jobs are attached to this one."""
+		self.cancelled = True
+		self.onResult = None
+
+
+class _PipelineStage():
+	"""A single pipeline stage: a worker thread that takes jobs from its queue, runs the stage function on
+	them and hands them to the next stage."""
+	def __init__(self, name: str, func: Callable[[PipelineJob], bool], pipeline: "DetectionPipeline"):
+		"""
+		@param name: name of the stage, used for timings and thread names
+		@param func: stage function. Returns True if the job should move on to the next stage or False if
+			the job is complete (L{PipelineJob.result} holds the result).
+		@param pipeline: the pipeline this stage is part of
+		"""
+		self.name = name
+		self.func = func
+		self.pipeline = pipeline
+		self.nextStage: Optional[_PipelineStage] = None
+		self._queue = queue.Queue()
+		self._thread = threading.Thread(name=f"objectDetection.pipeline.{name}", target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def put(self, job: Optional[PipelineJob]):
+		"""Queues a job for this stage. L{None} stops the stage thread."""
+		self._queue.put(job)
+		_instrumentation.recordQueueDepth(self.name, self._queue.qsize())
+
+	def qsize(self) -> int:
+		return self._queue.qsize()
+
+	def _run(self):
+		while True:
+			job = self._queue.get()
+			if job is None:
+				break
+			if self.pipeline.terminated:
+				# queued ahead of the stop request, the result would no longer be presented
+				continue
+			start = time.perf_counter()
+			try:
+				forward = self.func(job)
+			except Exception as e:
+				job.result = e
+				forward = False
+			job.timings[self.name] = time.perf_counter() - start
+			_instrumentation.recordTiming(self.name, job.timings[self.name])
+			if forward and self.nextStage:
+				self.nextStage.put(job)
+			else:
+				self.pipeline._complete(job)
+
+	def terminate(self):
+		"""Asks the stage thread to stop once it has finished the job it is working on, without waiting."""
+		self.put(None)
+
+	def join(self, timeout: float):
+		self._thread.join(timeout)
+
+
+class DetectionPipeline():
+	"""Runs detection jobs through a chain of stages, each on its own thread, so that successive requests
+	can overlap stages and the main thread is free as soon as a job is submitted."""
+	def __init__(self, stages: List[Tuple[str, Callable[[PipelineJob], bool]]]):
+		"""
+		@param stages: list of (name, function) tuples in the order they must run
+		"""
+		self.stages = [_PipelineStage(name, func, self) for name, func in stages]
+		for stage, nextStage in zip(self.stages, self.stages[1:]):
+			stage.nextStage = nextStage
+		# Jobs that were fingerprinted and have not completed yet, keyed by image hash
+		self._inFlight: Dict[int, PipelineJob] = {}
+		self._inFlightLock = threading.Lock()
+		#: Set by L{terminate}, after which stages drop the jobs still queued
+		self.terminated = False
+
+	def submit(self, job: PipelineJob):
+		"""Queues a job for the first stage and returns immediately."""
+		job.pipeline = self
+		self.stages[0].put(job)
+
+	def coalesce(self, job: PipelineJob) -> bool:
+		"""Called by a stage once L{PipelineJob.imageHash} is known. If a job for the same image is already in
+		flight, I{job} is attached to it and completed with its result instead of running detection again.
+		@return: True if the job was attached and must not be processed any further
+		"""
+		with self._inFlightLock:
+			leader = self._inFlight.get(job.imageHash)
+			if not leader:
+				self._inFlight[job.imageHash] = job
+				return False
+			leader.followers.append(job)
+			job.leader = leader
+		_instrumentation.increment("coalescedRequests")
+		return True
+
+	def isAbandoned(self, job: PipelineJob) -> bool:
+		"""Checks if nobody is waiting for the result of a job anymore, because it and every job attached to it
+		were cancelled. An abandoned job no longer accepts attachments, so stages can safely skip it.
+		"""
+		with self._inFlightLock:
+			if not job.cancelled or any(not follower.cancelled for follower in job.followers):
+				return False
+			if self._inFlight.get(job.imageHash) is job:
+				del self._inFlight[job.imageHash]
+			return True
+
+	def _complete(self, job: PipelineJob):
+		"""Called on the stage thread that finished the job. Logs stage timings and delivers the result to
+		the job and every job attached to it."""
+		if job.leader:
+			# completed along with the job it is attached to
+			return
+		with self._inFlightLock:
+			if self._inFlight.get(job.imageHash) is job:
+				del self._inFlight[job.imageHash]
+			followers = job.followers
+		total = time.perf_counter() - job.timeSubmitted
+		_instrumentation.recordTiming("total", total)
+		log.debug(
+			"(objectDetection) pipeline timings: "
+			+ ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in job.timings.items())
+			+ f", total={total * 1000:.1f}ms"
+		)
+		for finishedJob in [job] + followers:
+			finishedJob.result = job.result
+			onResult = finishedJob.onResult
+			if onResult and not finishedJob.cancelled:
+				onResult(finishedJob.result)
+
+	def terminate(self):
+		"""Stops all stage threads. Jobs that are still queued are dropped, only the jobs the stages are working
+		on are finished. Waits at most L{_terminateTimeout} seconds, so that NVDA exits and reloads plugins
+		without waiting for a running inference."""
+		self.terminated = True
+		for stage in self.stages:
+			stage.terminate()
+		deadline = time.perf_counter() + _terminateTimeout
+		for stage in self.stages:
+			stage.join(max(0.0, deadline - time.perf_counter()))
@@ -0,0 +1,7 @@
+# Object Detection: network input size
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+#: Network input width and height the model is run at. YOLOv3-DLL.dll passes a fixed 416x416 size to
+#: cv::dnn::blobFromImage whatever the model config says, so every detection in NVDA runs at this size. The
+#: OpenCV backend of the bulk detection tool can run at other sizes and uses this one by default.
+MODEL_INPUT_SIZE = 416
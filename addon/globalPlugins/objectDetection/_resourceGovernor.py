@@ -0,0 +1,190 @@
+# Object Detection: limits on the CPU threads, priority and memory used by inference
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import ctypes
+from ctypes import wintypes
+
+#: Read by OpenCV's parallel framework when it is first used, so it must be set before the DLLs are loaded
+_openCVThreadsVariable = "OPENCV_FOR_THREADS_NUM"
+#: Decorated name of C{void cv::setNumThreads(int)} exported by the 64 bit opencv_core DLL
+_setNumThreadsSymbol = "?setNumThreads@cv@@YAXH@Z"
+
+THREAD_PRIORITY_NORMAL = 0
+THREAD_PRIORITY_BELOW_NORMAL = -1
+BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x100
+#: JobObjectExtendedLimitInformation class of SetInformationJobObject
+_jobObjectExtendedLimitInformation = 9
+
+_megabyte = 1024 * 1024
+
+if os.name == "nt":
+	# private instances, so that the prototypes below do not affect other users of ctypes.windll
+	_kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+	_psapi = ctypes.WinDLL("psapi", use_last_error=True)
+	_kernel32.GetCurrentThread.restype = wintypes.HANDLE
+	_kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+	_kernel32.SetThreadPriority.argtypes = [wintypes.HANDLE, ctypes.c_int]
+	_kernel32.SetPriorityClass.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+	_kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+	_kernel32.CreateJobObjectW.argtypes = [ctypes.c_void_p, wintypes.LPCWSTR]
+	_kernel32.SetInformationJobObject.argtypes = [wintypes.HANDLE, ctypes.c_int, ctypes.c_void_p, wintypes.DWORD]
+	_kernel32.AssignProcessToJobObject.argtypes = [wintypes.HANDLE, wintypes.HANDLE]
+	_psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.c_void_p, wintypes.DWORD]
+
+
+def getThreadCount(setting: int) -> int:
+	"""Returns the number of inference threads for a thread count setting.
+	@param setting: the requested number of threads, or 0 for one less than the number of processors so that
+		one is always left for NVDA's speech and the foreground application
+	"""
+	if setting > 0:
+		return setting
+	return max(1, (os.cpu_count() or 1) - 1)
+
+
+def prepareThreadLimit(threads: int):
+	"""Makes OpenCV use at most I{threads} threads once it is loaded. Must be called before the DLLs are
+	loaded, the limit can only be changed afterwards with L{setOpenCVThreads}."""
+	os.environ[_openCVThreadsVariable] = str(threads)
+
+
+def setOpenCVThreads(coreLib: ctypes.CDLL, threads: int) -> bool:
+	"""Changes the number of threads of a loaded OpenCV core DLL.
+	@param coreLib: the loaded opencv_core DLL
+	@return: False if the DLL does not export C{cv::setNumThreads}, such as 32 bit builds whose decorated name
+		differs
+	"""
+	try:
+		setNumThreads = coreLib[_setNumThreadsSymbol]
+	except AttributeError:
+		return False
+	setNumThreads.restype = None
+	setNumThreads.argtypes = [ctypes.c_int]
+	setNumThreads(threads)
+	return True
+
+
+def setCurrentThreadPriority(low: bool):
+	"""Runs the calling thread below normal priority, so that it gives way to NVDA's speech and input
+	handling, or restores normal priority. Only the calling thread is changed: lowering NVDA's process
+	priority would slow down speech as well.
+	OpenCV runs most of the inference on the worker threads of its parallel framework, which it creates and
+	which keep their normal priority; the DLL gives no access to them. Only with a single inference thread,
+	see L{setOpenCVThreads}, does all of the inference run on the calling thread at the lowered priority."""
+	if os.name != "nt":
+		return
+	priority = THREAD_PRIORITY_BELOW_NORMAL if low else THREAD_PRIORITY_NORMAL
+	_kernel32.SetThreadPriority(_kernel32.GetCurrentThread(), priority)
+
+
+def lowerProcessPriority():
+	"""Runs the whole process below normal priority. Only used for processes that do nothing but detection,
+	such as the workers of the bulk detection tool."""
+	if os.name == "nt":
+		_kernel32.SetPriorityClass(_kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+	else:
+		os.nice(10)
+
+
+class PROCESS_MEMORY_COUNTERS_EX(ctypes.Structure):
+	_fields_ = [
+		("cb", wintypes.DWORD),
+		("PageFaultCount", wintypes.DWORD),
+		("PeakWorkingSetSize", ctypes.c_size_t),
+		("WorkingSetSize", ctypes.c_size_t),
+		("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+		("QuotaPagedPoolUsage", ctypes.c_size_t),
+		("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+		("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+		("PagefileUsage", ctypes.c_size_t),
+		("PeakPagefileUsage", ctypes.c_size_t),
+		("PrivateUsage", ctypes.c_size_t),
+	]
+
+
+def getProcessMemory() -> int:
+	"""Returns the memory used by this process in bytes: the private (committed) memory on Windows, the
+	resident set size elsewhere."""
+	if os.name == "nt":
+		counters = PROCESS_MEMORY_COUNTERS_EX()
+		counters.cb = ctypes.sizeof(counters)
+		_psapi.GetProcessMemoryInfo(_kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+		return counters.PrivateUsage
+	with open("/proc/self/statm", "r") as f:
+		return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def checkMemory(limit: int, expectedGrowth: int = 0):
+	"""Checks that detection can run without this process exceeding a memory ceiling.
+	@param limit: the ceiling in megabytes, 0 for no ceiling
+	@param expectedGrowth: bytes the detection is expected to allocate, such as the model if it is not
+		loaded yet
+	@raise MemoryError: if the ceiling would be exceeded
+	"""
+	if not limit:
+		return
+	used = getProcessMemory()
+	if used + expectedGrowth > limit * _megabyte:
+		raise MemoryError(
+			f"objectDetection: {used // _megabyte}MB used and {expectedGrowth // _megabyte}MB needed, "
+			f"memory limit is {limit}MB"
+		)
+
+
+class IO_COUNTERS(ctypes.Structure):
+	_fields_ = [(name, ctypes.c_ulonglong) for name in (
+		"ReadOperationCount", "WriteOperationCount", "OtherOperationCount",
+		"ReadTransferCount", "WriteTransferCount", "OtherTransferCount",
+	)]
+
+
+class JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+	_fields_ = [
+		("PerProcessUserTimeLimit", ctypes.c_longlong),
+		("PerJobUserTimeLimit", ctypes.c_longlong),
+		("LimitFlags", wintypes.DWORD),
+		("MinimumWorkingSetSize", ctypes.c_size_t),
+		("MaximumWorkingSetSize", ctypes.c_size_t),
+		("ActiveProcessLimit", wintypes.DWORD),
+		("Affinity", ctypes.c_size_t),
+		("PriorityClass", wintypes.DWORD),
+		("SchedulingClass", wintypes.DWORD),
+	]
+
+
+class JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+	_fields_ = [
+		("BasicLimitInformation", JOBOBJECT_BASIC_LIMIT_INFORMATION),
+		("IoInfo", IO_COUNTERS),
+		("ProcessMemoryLimit", ctypes.c_size_t),
+		("JobMemoryLimit", ctypes.c_size_t),
+		("PeakProcessMemoryUsed", ctypes.c_size_t),
+		("PeakJobMemoryUsed", ctypes.c_size_t),
+	]
+
+
+def limitProcessMemory(limit: int):
+	"""Makes allocations fail once this process uses more than I{limit} megabytes, using a job object on
+	Windows and the address space limit elsewhere. Only used for processes that do nothing but detection,
+	such as the workers of the bulk detection tool; inside NVDA L{checkMemory} is used instead.
+	@raise OSError: if the limit could not be set
+	"""
+	if os.name == "nt":
+		job = _kernel32.CreateJobObjectW(None, None)
+		if not job:
+			raise ctypes.WinError(ctypes.get_last_error())
+		info = JOBOBJECT_EXTENDED_LIMIT_INFORMATION()
+		info.BasicLimitInformation.LimitFlags = JOB_OBJECT_LIMIT_PROCESS_MEMORY
+		info.ProcessMemoryLimit = limit * _megabyte
+		if (
+			not _kernel32.SetInformationJobObject(
+				job, _jobObjectExtendedLimitInformation, ctypes.byref(info), ctypes.sizeof(info)
+			)
+			or not _kernel32.AssignProcessToJobObject(job, _kernel32.GetCurrentProcess())
+		):
+			raise ctypes.WinError(ctypes.get_last_error())
+	else:
+		import resource
+		resource.setrlimit(resource.RLIMIT_AS, (limit * _megabyte, limit * _megabyte))
@@ -5,16 +5,78 @@ import api
 import ui
 import time
 import screenBitmap
-from typing import Optional
+from functools import partial
+from typing import Optional, Tuple
+from collections import OrderedDict
 from logHandler import log
 import queueHandler
 from contentRecog import ContentRecognizer, RecogImageInfo
 from contentRecog.recogUi import RecogResultNVDAObject
+from . import _instrumentation
+from ._fingerprint import getSampleRows, sampleChecksum
+from ._triage import ImageRejectedError
 
 
 #: Keeps track of the recognition in progress, if any.
 _activeRecog: Optional[ContentRecognizer] = None
 
+#: Maps the identity of recently recognized objects (see L{getObjectIdentity}) to the sampled checksum and
+#: full L{imageHash} of the image they showed, most recently used last.
+_objectIdentities: "OrderedDict[tuple, Tuple[int, int]]" = OrderedDict()
+#: Maximum number of entries in L{_objectIdentities}
+_maxObjectIdentities = 32
+
+
+def getObjectIdentity(obj, location) -> tuple:
+	"""Returns a key that identifies an object across gestures using its stable identifiers and location.
+	@param obj: the object to be recognized
+	@param location: screen location of the object
+	"""
+	return (
+		obj.windowHandle,
+		obj.role,
+		obj.name,
+		getattr(obj, "IA2UniqueID", None),
+		tuple(location),
+	)
+
+
+def captureSampleChecksum(left: int, top: int, width: int, height: int) -> int:
+	"""Captures a few rows of the object and calculates their L{sampleChecksum}. This is much cheaper than
+	capturing and hashing the whole image."""
+	sb = screenBitmap.ScreenBitmap(width, 1)
+	return sampleChecksum(sb.captureImage(left, top + row, width, 1) for row in getSampleRows(height))
+
+
+def findCachedResult(identity: tuple, checksum: int, cachedResults, imgInfo: RecogImageInfo):
+	"""Finds the cached result of an object if it was recognized before and its sampled checksum has not
+	changed since.
+	@param imgInfo: details of the object as it is recognized now. The result may have been cached when the
+		same image was shown elsewhere on the screen, so it is moved to this location.
+	@return: the cached result or None if the full fingerprint must be used
+	"""
+	entry = _objectIdentities.get(identity)
+	if not entry or not cachedResults:
+		return None
+	lastChecksum, lastImageHash = entry
+	if lastChecksum != checksum:
+		# the cheap checks disagree, the image must have changed
+		del _objectIdentities[identity]
+		return None
+	for result in cachedResults:
+		if result.imageHash == lastImageHash:
+			_objectIdentities.move_to_end(identity)
+			return result.movedTo(imgInfo)
+	return None
+
+
+def rememberObjectIdentity(identity: tuple, checksum: int, imageHash: int):
+	"""Stores the image hash of a recognized object so it can be found by L{findCachedResult}."""
+	_objectIdentities[identity] = (checksum, imageHash)
+	_objectIdentities.move_to_end(identity)
+	while len(_objectIdentities) > _maxObjectIdentities:
+		_objectIdentities.popitem(last=False)
+
 def recognizeNavigatorObject(recognizer: ContentRecognizer, filterNonGraphic=True, cachedResults=None):
 	"""User interface function to recognize content in the navigator object.
 	@param recognizer: The content recognizer to use.
@@ -63,6 +125,17 @@ def recognizeNavigatorObject(recognizer: ContentRecognizer, filterNonGraphic=Tru
 		ui.message(notVisibleMsg)
 		return
 
+	# Fast path: if the same object was recognized before and a few sampled rows still match, present the
+	# cached result without capturing and hashing the whole image.
+	recognizer.identity = getObjectIdentity(obj, obj.location)
+	with _instrumentation.span("sampleChecksum"):
+		recognizer.sampleChecksum = captureSampleChecksum(left, top, width, height)
+	cachedResult = findCachedResult(recognizer.identity, recognizer.sampleChecksum, cachedResults, imgInfo)
+	if cachedResult:
+		_instrumentation.increment("identityHits")
+		recognizer.getResultHandler(cachedResult)
+		return
+
 	global _activeRecog
 	if _activeRecog:
 		# If a recognition process is already occurring and a new one is started after more than 3 seconds,
@@ -77,54 +150,53 @@ def recognizeNavigatorObject(recognizer: ContentRecognizer, filterNonGraphic=Tru
 		else:
 			_activeRecog.cancel()
 
-	# capture object pixels
-	sb = screenBitmap.ScreenBitmap(imgInfo.recogWidth, imgInfo.recogHeight)
-	pixels = sb.captureImage(left, top, width, height)
-
-	# calculate L{imageHash} using the inbuilt hash function. Only one channel is used to calculate the
-	# hash to save time but all pixels in that channel must be used since using only part of the image may
-	# cause false cache hits for images with padding.
-	rowHashes = []
-	for i in range(imgInfo.recogWidth):
-		row = []
-		for j in range(imgInfo.recogHeight):
-			row.append(pixels[j][i].rgbRed)  # column major order
-		rowHashes.append(hash(str(row)))
-	imageHash = hash(str(rowHashes))
-
-	# check if the hash of the current object matches that of any previous result
-	for result in cachedResults:
-		# if a match is found, call the recognizer's I{getResultHandler} method with the cached result and
-		# end the current recognition process here.
-		if result.imageHash == imageHash:
-			handler = recognizer.getResultHandler(result)
-			return
+	# capture object pixels. This is the only step that must happen on the main thread, everything else
+	# runs on the detection pipeline threads.
+	with _instrumentation.span("capture"):
+		sb = screenBitmap.ScreenBitmap(imgInfo.recogWidth, imgInfo.recogHeight)
+		pixels = sb.captureImage(left, top, width, height)
 
-	# Translators: Reporting when content recognition begins.
-	ui.message(_("Recognizing"))
 	# Store a copy of the recognizer before object detection really starts. This can also be used to check
 	# recognition process is active
 	_activeRecog = recognizer
-	recognizer.recognize(imageHash, pixels, imgInfo, _recogOnResult)
+	# The callbacks are bound to the recognizer since a cancelled request for the same image may complete
+	# together with this one, see L{DetectionPipeline.coalesce}
+	recognizer.recognize(pixels, imgInfo, partial(_recogOnResult, recognizer), cachedResults)
 
 
-def _recogOnResult(result):
+def _recogOnResult(recognizer: ContentRecognizer, result):
 	"""Presents the object detection result whether successful or not.
+	@param recognizer: the recognizer that requested the detection
 	@param result: object detection result
 	"""
 	global _activeRecog
-	# Create a local copy of the active recognizer for later use and set original to L{None} so new
-	# recognition processes may be started.
-	recognizer: ContentRecognizer = _activeRecog
-	_activeRecog = None
+	# Clear the active recognizer so new recognition processes may be started.
+	if _activeRecog is recognizer:
+		_activeRecog = None
 	# This might get called from a background thread, so any UI calls must be queued to the main thread.
+	if isinstance(result, ImageRejectedError):
+		log.debug("Recognition skipped: %s" % result)
+		queueHandler.queueFunction(queueHandler.eventQueue, ui.message, str(result))
+		return
+	if isinstance(result, MemoryError):
+		log.debugWarning("Recognition refused: %s" % result)
+		# Translators: Reported when a detection is not started because it would exceed the memory limit set
+		# in the add-on settings.
+		queueHandler.queueFunction(queueHandler.eventQueue, ui.message, _("Not enough memory for object detection"))
+		return
 	if isinstance(result, Exception):
 		# Translators: Reported when recognition fails.
 		log.error("Recognition failed: %s" % result)
 		queueHandler.queueFunction(queueHandler.eventQueue, ui.message, _("Recognition failed"))
 		return
-	# Call the recognizer's L{getResultHandler} method. The __init__ method of the L{ResultHandlerClass}
-	# usually contains code that presents the result to the user and so the result is presented when this
-	# method is called.
-	if recognizer:
-		handler = recognizer.getResultHandler(result)
+	# Call the recognizer's L{getResultHandler} method on the main thread. The __init__ method of the
+	# L{ResultHandlerClass} usually contains code that presents the result to the user and so the result is
+	# presented when this method is called.
+	queueHandler.queueFunction(queueHandler.eventQueue, _presentResult, recognizer, result)
+
+
+def _presentResult(recognizer: ContentRecognizer, result):
+	"""Runs on the main thread. Remembers which image the recognized object showed and presents the
+	result."""
+	rememberObjectIdentity(recognizer.identity, recognizer.sampleChecksum, result.imageHash)
+	recognizer.getResultHandler(result)
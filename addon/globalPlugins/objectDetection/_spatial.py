@@ -0,0 +1,146 @@
+# Object Detection: spatial descriptions of detection results
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from typing import List, Sequence, Tuple
+
+#: Objects covering at least this fraction of the image are described as large
+_largeFraction = 0.25
+#: Objects covering at least this fraction of the image are described as medium sized
+_mediumFraction = 0.05
+#: Boxes closer than this fraction of the image height are considered to be touching, eg. a cup resting on a
+#: table
+_touchFraction = 0.03
+
+
+def _getRegions(centres: Sequence[float], extent: int, names: Tuple[str, str, str]) -> List[str]:
+	"""Maps every centre co-ordinate to the name of the third of the image it falls in."""
+	first, second = extent / 3, extent * 2 / 3
+	return [names[0] if c < first else names[1] if c < second else names[2] for c in centres]
+
+
+def _getOverlappingPairs(lefts, rights, tops, bottoms, margin: float) -> List[Tuple[int, int]]:
+	"""Finds all pairs of boxes that intersect, or are closer than I{margin}, using a sweep over the boxes
+	sorted by their left edge, so that only boxes whose horizontal extents overlap are compared.
+	@return: list of (i, j) index pairs
+	"""
+	order = sorted(range(len(lefts)), key=lefts.__getitem__)
+	sortedLefts = [lefts[i] for i in order]
+	pairs = []
+	for position, i in enumerate(order):
+		# every box starting before the right edge of box i (plus the margin) overlaps it horizontally
+		end = bisect_right(sortedLefts, rights[i] + margin, lo=position + 1)
+		pairs.extend(
+			(i, j) for j in order[position + 1:end]
+			if tops[j] <= bottoms[i] + margin and tops[i] <= bottoms[j] + margin
+		)
+	return pairs
+
+
+def _getNames(labels: Sequence[str], lefts: Sequence[float]) -> List[str]:
+	"""Numbers repeated labels from left to right (eg. "person 1", "person 2") so that relations between
+	objects of the same class can be told apart."""
+	counts = Counter(labels)
+	seen = Counter()
+	names = [""] * len(labels)
+	for i in sorted(range(len(labels)), key=lefts.__getitem__):
+		label = labels[i]
+		if counts[label] > 1:
+			seen[label] += 1
+			names[i] = f"{label} {seen[label]}"
+		else:
+			names[i] = label
+	return names
+
+
+def describe(boxes: Sequence, imageWidth: int, imageHeight: int) -> List[str]:
+	"""Describes the position and size of every detected object, and the relations between them.
+	Geometry is computed for all boxes at once on column arrays. Directional relations are only given
+	relative to the most prominent object and overlaps are found with a sweep, so the number of lines and
+	the work done stay close to linear in the number of detections.
+	@param boxes: list of L{Detection} objects in image co-ordinates
+	@param imageWidth: width of the recognized image
+	@param imageHeight: height of the recognized image
+	@return: list of description lines, one per object followed by one per relation
+	"""
+	if not boxes or imageWidth <= 0 or imageHeight <= 0:
+		return []
+	lefts = array("d", (b.x for b in boxes))
+	tops = array("d", (b.y for b in boxes))
+	widths = array("d", (b.width for b in boxes))
+	heights = array("d", (b.height for b in boxes))
+	rights = array("d", map(float.__add__, lefts, widths))
+	bottoms = array("d", map(float.__add__, tops, heights))
+	centreXs = [l + w / 2 for l, w in zip(lefts, widths)]
+	centreYs = [t + h / 2 for t, h in zip(tops, heights)]
+	imageArea = imageWidth * imageHeight
+	areaFractions = [w * h / imageArea for w, h in zip(widths, heights)]
+	names = _getNames([b.label for b in boxes], lefts)
+
+	# Translators: horizontal regions of an image
+	centre = _("centre")
+	horizontal = _getRegions(centreXs, imageWidth, (_("left"), centre, _("right")))
+	# Translators: vertical regions of an image
+	middle = _("middle")
+	vertical = _getRegions(centreYs, imageHeight, (_("top"), middle, _("bottom")))
+	lines = []
+	for name, h, v, fraction in zip(names, horizontal, vertical, areaFractions):
+		if v == middle:
+			position = h
+		elif h == centre:
+			position = v
+		else:
+			# Translators: position of a detected object, eg. "top left"
+			position = _("{vertical} {horizontal}").format(vertical=v, horizontal=h)
+		if fraction >= _largeFraction:
+			# Translators: relative size of a detected object
+			size = _("large")
+		elif fraction >= _mediumFraction:
+			# Translators: relative size of a detected object
+			size = _("medium")
+		else:
+			# Translators: relative size of a detected object
+			size = _("small")
+		# Translators: describes the position and size of a detected object, eg. "dog: bottom left, small"
+		lines.append(_("{name}: {position}, {size}").format(name=name, position=position, size=size))
+	if len(boxes) < 2:
+		return lines
+
+	margin = imageHeight * _touchFraction
+	overlapping = set()
+	for i, j in _getOverlappingPairs(lefts, rights, tops, bottoms, margin):
+		if not (rights[i] > lefts[j] and rights[j] > lefts[i]):
+			# only close horizontally, neither overlapping nor resting on each other
+			continue
+		# the box whose bottom edge is nearest the other box's top edge rests on it, if the boxes barely
+		# overlap vertically
+		upper, lower = (i, j) if bottoms[i] - tops[j] < bottoms[j] - tops[i] else (j, i)
+		if abs(bottoms[upper] - tops[lower]) <= margin:
+			# Translators: relation between two detected objects, eg. "cup is on top of dining table"
+			lines.append(_("{first} is on top of {second}").format(first=names[upper], second=names[lower]))
+		elif bottoms[upper] > tops[lower]:
+			# Translators: relation between two detected objects, eg. "person overlaps bicycle"
+			lines.append(_("{first} overlaps {second}").format(first=names[i], second=names[j]))
+		else:
+			continue
+		overlapping.add((i, j))
+		overlapping.add((j, i))
+
+	# Describe where every other object is relative to the most prominent one
+	anchor = max(range(len(boxes)), key=lambda i: areaFractions[i] * boxes[i].probability)
+	for i in range(len(boxes)):
+		if i == anchor or (i, anchor) in overlapping:
+			continue
+		dx = centreXs[i] - centreXs[anchor]
+		dy = centreYs[i] - centreYs[anchor]
+		# use the axis along which the objects are furthest apart relative to the image size
+		if abs(dx) / imageWidth >= abs(dy) / imageHeight:
+			# Translators: relation between two detected objects, eg. "dog is left of person"
+			relation = _("{first} is left of {second}") if dx < 0 else _("{first} is right of {second}")
+		else:
+			# Translators: relation between two detected objects, eg. "bird is above person"
+			relation = _("{first} is above {second}") if dy < 0 else _("{first} is below {second}")
+		lines.append(relation.format(first=names[i], second=names[anchor]))
+	return lines
@@ -0,0 +1,115 @@
+# Object Detection: cheap checks that find images the model cannot find objects in
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Statistics of a downsampled image that tell, in a few milliseconds, whether running the model on it is
+worthwhile. Images that are almost entirely one colour, such as placeholders and images that have not loaded
+yet, and images of rendered text, only ever produce "Cannot identify any objects". Does not depend on NVDA
+so that thresholds can be evaluated offline, see L{_bulkDetect.benchmarkTriage}.
+"""
+
+import math
+from collections import Counter, namedtuple
+from typing import Optional
+
+#: Columns and rows of the downsample the statistics are computed on
+_sampleGrid = (64, 64)
+
+#: Smallest brightness difference (out of 255) between neighbouring samples that counts as an edge
+_edgeStep = 32
+
+#: Bits kept of every colour channel when building the colour histogram
+_colourBits = 3
+
+#: Reason given by L{triage} for images that are almost entirely one colour
+BLANK = "blank"
+#: Reason given by L{triage} for images that look like rendered text
+TEXT = "text"
+
+
+class TriageStatistics(namedtuple("TriageStatistics", ("variance", "edgeDensity", "colourEntropy"))):
+	"""Statistics of the downsample of an image:
+		- variance: variance of the brightness, from 0 for a single colour to 16256 for black and white halves
+		- edgeDensity: fraction of neighbouring samples whose brightness differs by at least L{_edgeStep}
+		- colourEntropy: Shannon entropy in bits of the histogram of colours, reduced to L{_colourBits} bits per
+			channel. Text on a plain background uses few colours, photographs use many.
+	"""
+
+
+class TriageThresholds(
+		namedtuple("TriageThresholds", ("minVariance", "textMaxEntropy", "textMinEdgeDensity"))
+):
+	"""Thresholds used by L{triage}:
+		- minVariance: images with a smaller brightness variance are L{BLANK}
+		- textMaxEntropy, textMinEdgeDensity: images with fewer colours and more edges than these are L{TEXT}
+	"""
+
+
+#: Default thresholds, also the defaults of the triage settings of the provider. They were set by hand on a
+#: few placeholder, screenshot and photo images; users tune them in the add-on settings after measuring them
+#: on their own images with L{_bulkDetect.benchmarkTriage}.
+DEFAULT_THRESHOLDS = TriageThresholds(minVariance=20.0, textMaxEntropy=1.5, textMinEdgeDensity=0.15)
+
+
+class ImageRejectedError(Exception):
+	"""Completes a detection request for an image that triage found not worth detecting. The message says
+	why and is presented to the user in place of a result."""
+
+
+def getStatistics(
+		data, width: int, height: int, bytesPerPixel: int = 4, channelOffsets=(2, 1, 0)
+) -> TriageStatistics:
+	"""Calculates the L{TriageStatistics} of an image. Samples are taken with strided slices of every sampled
+	row, so the cost depends on the size of the downsample rather than that of the image.
+	@param data: packed pixels, row by row without padding
+	@param width: width of the image
+	@param height: height of the image
+	@param bytesPerPixel: 4 for captured BGRX pixels, 3 for packed RGB or BGR images
+	@param channelOffsets: offsets of the red, green and blue bytes within a pixel
+	"""
+	columns, rows = _sampleGrid
+	view = memoryview(data).cast("B")
+	rowStride = width * bytesPerPixel
+	xStep = max(1, width // columns) * bytesPerPixel
+	yStep = max(1, height // rows)
+	redOffset, greenOffset, blueOffset = channelOffsets
+	shift = 8 - _colourBits
+	colours = Counter()
+	brightnessRows = []
+	for y in range(0, height, yStep)[:rows]:
+		row = view[y * rowStride:(y + 1) * rowStride]
+		reds = row[redOffset::xStep][:columns]
+		greens = row[greenOffset::xStep][:columns]
+		blues = row[blueOffset::xStep][:columns]
+		# integer approximation of the ITU-R BT.601 luma weights
+		brightnessRows.append([(299 * r + 587 * g + 114 * b) // 1000 for r, g, b in zip(reds, greens, blues)])
+		colours.update(
+			(r >> shift) << (2 * _colourBits) | (g >> shift) << _colourBits | b >> shift
+			for r, g, b in zip(reds, greens, blues)
+		)
+	samples = [value for row in brightnessRows for value in row]
+	count = len(samples)
+	mean = sum(samples) / count
+	variance = sum(value * value for value in samples) / count - mean * mean
+	edges = pairs = 0
+	for row, nextRow in zip(brightnessRows, brightnessRows[1:] + [None]):
+		edges += sum(abs(a - b) >= _edgeStep for a, b in zip(row, row[1:]))
+		pairs += len(row) - 1
+		if nextRow is not None:
+			edges += sum(abs(a - b) >= _edgeStep for a, b in zip(row, nextRow))
+			pairs += len(row)
+	entropy = sum(n / count * math.log2(count / n) for n in colours.values())
+	return TriageStatistics(max(0.0, variance), edges / pairs if pairs else 0.0, entropy)
+
+
+def triage(statistics: TriageStatistics, thresholds: TriageThresholds = DEFAULT_THRESHOLDS) -> Optional[str]:
+	"""Decides if an image is worth detecting.
+	@return: None if it is, otherwise the reason, L{BLANK} or L{TEXT}
+	"""
+	if statistics.variance < thresholds.minVariance:
+		return BLANK
+	if (
+		statistics.colourEntropy <= thresholds.textMaxEntropy
+		and statistics.edgeDensity >= thresholds.textMinEdgeDensity
+	):
+		return TEXT
+	return None
@@ -0,0 +1,122 @@
+# Object Detection: idle-time model warm-up
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import time
+import tempfile
+import threading
+from ctypes import Structure, byref, sizeof, windll, c_uint
+from typing import Callable, Optional
+import core
+from logHandler import log
+
+#: Size of the blank frame used for the warm-up inference
+_warmUpFrameSize = 416
+
+#: Time (in seconds) the warm-up took to load the DLLs. None if the warm-up has not run.
+_dllLoadTime: Optional[float] = None
+#: Time (in seconds) the warm-up inference took, which read the model files from disk for the first time.
+#: None if the warm-up has not run.
+_coldInferenceTime: Optional[float] = None
+#: True once the first real detection of the session has been compared with the warm-up inference
+_firstDetectionNoted = False
+
+
+class _LASTINPUTINFO(Structure):
+	_fields_ = [("cbSize", c_uint), ("dwTime", c_uint)]
+
+
+def getIdleSeconds() -> float:
+	"""Returns the number of seconds since the user last pressed a key, moved the mouse or touched the
+	screen."""
+	info = _LASTINPUTINFO(sizeof(_LASTINPUTINFO), 0)
+	if not windll.user32.GetLastInputInfo(byref(info)):
+		return 0.0
+	# both values are tick counts in milliseconds that wrap around after 49.7 days
+	return ((windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000
+
+
+def noteDetectionTime(seconds: float):
+	"""Called with the inference time of every detection. Logs what the warm-up saved the first detection of
+	the session: loading the DLLs, and reading the model files from disk rather than from the file cache."""
+	global _firstDetectionNoted
+	if _firstDetectionNoted:
+		return
+	_firstDetectionNoted = True
+	if _coldInferenceTime is not None:
+		log.info(
+			f"(objectDetection) first detection took {seconds * 1000:.0f}ms. The warm-up loaded the DLLs in "
+			f"{_dllLoadTime * 1000:.0f}ms and its inference, the first to read the model files, took "
+			f"{_coldInferenceTime * 1000:.0f}ms"
+		)
+
+
+class WarmUpService():
+	"""Loads the DLLs and runs one inference on a blank frame once the user has been idle for a while, so that
+	the first detection of the session does not pay for loading the DLLs. The DLL reads the model files on
+	every detection, so the model itself is not kept loaded, but the warm-up brings the files into the file
+	cache. Backs off while the user is interacting."""
+	def __init__(self, getDetectionModule: Callable, delay: int):
+		"""
+		@param getDetectionModule: returns the detection module, importing it if required
+		@param delay: number of seconds the user must be idle before warming up. 0 disables the warm-up.
+		"""
+		self.getDetectionModule = getDetectionModule
+		self.delay = delay
+		self._terminated = False
+
+	def start(self):
+		"""Schedules the warm-up."""
+		if self.delay > 0:
+			core.callLater(self.delay * 1000, self._check)
+
+	def terminate(self):
+		self._terminated = True
+
+	def _check(self):
+		"""Runs on the main thread. Starts the warm-up if the user has been idle long enough, otherwise
+		checks again once they could have been."""
+		if self._terminated:
+			return
+		idle = getIdleSeconds()
+		if idle < self.delay:
+			core.callLater(int((self.delay - idle) * 1000) + 100, self._check)
+			return
+		detectionModule = self.getDetectionModule()
+		# a detection may already have loaded the DLLs
+		if detectionModule.YOLOv3Detection.isLoaded():
+			return
+		thread = threading.Thread(
+			name="objectDetection.warmUp",
+			target=self._warmUp,
+			args=(detectionModule,)
+		)
+		thread.daemon = True
+		thread.start()
+
+	def _warmUp(self, detectionModule):
+		"""Loads the DLLs, which stay loaded for the session, and runs one inference on a blank frame, which
+		reads the model files into the file cache. The user's resource limits apply to the warm-up like to any
+		other detection."""
+		global _dllLoadTime, _coldInferenceTime
+		import wx
+		imagePath = tempfile.mktemp(prefix="nvda_ObjectDetect_warmUp_", suffix=".jpg")
+		try:
+			wx.Image(_warmUpFrameSize, _warmUpFrameSize).SaveFile(imagePath, wx.BITMAP_TYPE_JPEG)
+			detectionModule.applyResourceLimits()
+			detector = detectionModule.YOLOv3Detection(imagePath)
+			startTime = time.perf_counter()
+			detector.loadDLLs()
+			dllLoadTime = time.perf_counter() - startTime
+			startTime = time.perf_counter()
+			detector.detect()
+			_dllLoadTime, _coldInferenceTime = dllLoadTime, time.perf_counter() - startTime
+			log.debug(
+				f"(objectDetection) warm-up loaded the DLLs in {_dllLoadTime * 1000:.0f}ms, "
+				f"inference took {_coldInferenceTime * 1000:.0f}ms"
+			)
+		except Exception:
+			log.debugWarning("(objectDetection) warm-up failed", exc_info=True)
+		finally:
+			if os.path.exists(imagePath):
+				os.remove(imagePath)
@@ -16,6 +16,7 @@ from mouseHandler import getTotalWidthAndHeightAndMinimumPosition
 from locationHelper import RectLTRB, RectLTWH
 from collections import namedtuple
 import threading
+import time
 import winGDI
 import weakref
 from colors import RGB
@@ -174,8 +175,31 @@ class ObjectDetectionHighlightWindow(CustomWindow):
 
 class ObjectDetectionSettings(providerBase.VisionEnhancementProviderSettings):
 	"""Class that defines the settings for the visionEnhancementProvider"""
-	# only setting we use if is non-graphic elements must be filtered or not.
+	# whether non-graphic elements must be filtered or not.
 	filterNonGraphicElements = True
+	# whether the most prominent objects are listed first in the result sentence
+	orderObjectsBySalience = False
+	# whether object positions and relations are added to results presented in a virtual window
+	describeObjectPositions = False
+	# whether pipeline timings, cache hit rate and other performance statistics are recorded
+	recordPerformanceStatistics = False
+	# number of seconds the user must be idle before the model is loaded in the background, 0 to disable
+	warmUpDelay = 30
+	# number of threads used for inference, 0 for one less than the number of processors
+	inferenceThreads = 0
+	# whether the thread that runs inference is lowered below normal priority so that it does not delay
+	# speech. OpenCV's own worker threads keep normal priority, so this fully applies only with one thread.
+	lowerInferencePriority = True
+	# detections are refused while NVDA uses more than this many megabytes, 0 for no limit
+	memoryLimit = 0
+	# whether images that are almost entirely one colour or show only text are reported without detection
+	skipImagesWithoutObjects = True
+	# images whose brightness variance is below this value are reported as almost entirely one colour
+	triageMinVariance = 20
+	# images with a colour entropy of at most this many tenths of a bit and at least triageTextMinEdgeDensity
+	# percent of edges are reported as text
+	triageTextMaxEntropy = 15
+	triageTextMinEdgeDensity = 15
 
 	@classmethod
 	def getId(cls) -> str:
@@ -191,7 +215,80 @@ class ObjectDetectionSettings(providerBase.VisionEnhancementProviderSettings):
 				"filterNonGraphicElements",
 				"filter non-graphic elements",
 				defaultVal=True
-			)
+			),
+			driverHandler.BooleanDriverSetting(
+				"orderObjectsBySalience",
+				"list most prominent objects first",
+				defaultVal=False
+			),
+			driverHandler.BooleanDriverSetting(
+				"describeObjectPositions",
+				"describe object positions in the result window",
+				defaultVal=False
+			),
+			driverHandler.BooleanDriverSetting(
+				"recordPerformanceStatistics",
+				"record performance statistics",
+				defaultVal=False
+			),
+			driverHandler.NumericDriverSetting(
+				"warmUpDelay",
+				"seconds of inactivity before preloading the model (0 to disable)",
+				defaultVal=30,
+				minVal=0,
+				maxVal=300
+			),
+			driverHandler.NumericDriverSetting(
+				"inferenceThreads",
+				"detection threads (0 for all processors but one)",
+				defaultVal=0,
+				minVal=0,
+				maxVal=16
+			),
+			driverHandler.BooleanDriverSetting(
+				"lowerInferencePriority",
+				"run detection at low priority",
+				defaultVal=True
+			),
+			driverHandler.NumericDriverSetting(
+				"memoryLimit",
+				"memory limit for detection in megabytes (0 for no limit)",
+				defaultVal=0,
+				minVal=0,
+				maxVal=16384,
+				minStep=64,
+				normalStep=256,
+				largeStep=1024
+			),
+			driverHandler.BooleanDriverSetting(
+				"skipImagesWithoutObjects",
+				"skip blank images and images of text",
+				defaultVal=True
+			),
+			driverHandler.NumericDriverSetting(
+				"triageMinVariance",
+				"brightness variance below which an image is blank",
+				defaultVal=20,
+				minVal=0,
+				maxVal=1000,
+				minStep=1,
+				normalStep=5,
+				largeStep=50
+			),
+			driverHandler.NumericDriverSetting(
+				"triageTextMaxEntropy",
+				"colour entropy of text images, in tenths of a bit",
+				defaultVal=15,
+				minVal=0,
+				maxVal=90
+			),
+			driverHandler.NumericDriverSetting(
+				"triageTextMinEdgeDensity",
+				"percentage of edges in text images",
+				defaultVal=15,
+				minVal=0,
+				maxVal=100
+			),
 		]
 		return settings
 
@@ -227,10 +324,18 @@ class ObjectDetection(providerBase.VisionEnhancementProvider):
 	def __init__(self):
 		super().__init__()
 		log.debug("Starting ObjectDetection")
+		startTime = time.perf_counter()
 		# store the label and location for each bounding box
 		self.objectRects = []
 		# store True is the corresponding I{objectRect} must be announced, else False
 		self.announce = []
+		# GDI+ and the highlighter thread and window are only needed once bounding boxes are drawn, so they
+		# are started by L{_startHighlighter} when the first box is added rather than at NVDA startup.
+		self._highlighterThread: Optional[threading.Thread] = None
+		log.debug(f"ObjectDetection started in {(time.perf_counter() - startTime) * 1000:.1f}ms")
+
+	def _startHighlighter(self):
+		"""Initializes GDI+ and starts the highlighter thread, which creates the highlighter window."""
 		winGDI.gdiPlusInitialize()
 		self._highlighterThread = threading.Thread(
 			name=f"{self.__class__.__module__}.{self.__class__.__qualname__}",
@@ -246,13 +351,14 @@ class ObjectDetection(providerBase.VisionEnhancementProvider):
 
 	def terminate(self):
 		log.debug("Terminating ObjectDetection")
-		if self._highlighterThread and self._window and self._window.handle:
-			if not winUser.user32.PostThreadMessageW(self._highlighterThread.ident, winUser.WM_QUIT, 0, 0):
-				raise WinError()
-			else:
-				self._highlighterThread.join()
+		if self._highlighterThread:
+			if self._window and self._window.handle:
+				if not winUser.user32.PostThreadMessageW(self._highlighterThread.ident, winUser.WM_QUIT, 0, 0):
+					raise WinError()
+				else:
+					self._highlighterThread.join()
 			self._highlighterThread = None
-		winGDI.gdiPlusTerminate()
+			winGDI.gdiPlusTerminate()
 		self.clearObjectRects()
 		super().terminate()
 
@@ -314,6 +420,8 @@ class ObjectDetection(providerBase.VisionEnhancementProvider):
 	def addObjectRect(self, label: str, rect: RectLTRB):
 		"""Appends object label and bounding box location to L{objectRects} and sets corresponding value
 		in L{announce} to True."""
+		if not self._highlighterThread:
+			self._startHighlighter()
 		self.objectRects.append((label, rect))
 		self.announce.append(True)
 
@@ -324,6 +432,8 @@ class ObjectDetection(providerBase.VisionEnhancementProvider):
 		"""
 		if self.objectRects:
 			self.objectRects.clear()
+			# the flags belong to the cleared boxes, new boxes start with their own
+			self.announce.clear()
 
 	def currentlyDisplayingRects(self) -> bool:
 		"""Checks if any bounding boxes are being displayed
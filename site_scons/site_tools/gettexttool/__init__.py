@@ -25,6 +25,7 @@ XGETTEXT_COMMON_ARGS = (
 	"--package-name='$gettext_package_name' "
 	"--package-version='$gettext_package_version' "
 	"--keyword=pgettext:1c,2 "
+	"--keyword=N_ "
 	"-c -o $TARGET $SOURCES"
 )
 
@@ -0,0 +1,2 @@
+# Object Detection: tests run with a fake NVDA runtime, see fakeNVDA
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
@@ -0,0 +1,119 @@
+# Object Detection: test fixtures
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import sys
+import time
+import tempfile
+
+import pytest
+
+from . import fakeNVDA
+
+fakeNVDA.install(tempfile.mkdtemp(prefix="objectDetectionTests"))
+
+import api  # noqa: E402
+import ui  # noqa: E402
+import vision  # noqa: E402
+import screenBitmap  # noqa: E402
+import queueHandler  # noqa: E402
+import winUser  # noqa: E402
+from contentRecog import recogUi  # noqa: E402
+import globalPlugins.objectDetection as plugin  # noqa: E402
+from globalPlugins.objectDetection import (  # noqa: E402
+	_doObjectDetection, _resultUI, _instrumentation, _offlineIndex, _classIndex
+)
+from visionEnhancementProviders.objectDetection import ObjectDetection  # noqa: E402
+from .fakeDetector import FakeYOLOv3Detection  # noqa: E402
+
+#: Longest time a test waits for the detection pipeline
+_timeout = 5.0
+
+
+class Runtime():
+	"""Access to the fake NVDA runtime and the add-on for a single test."""
+	def __init__(self, provider: ObjectDetection):
+		self.provider = provider
+		self.plugin = plugin.GlobalPlugin()
+		self.screen = screenBitmap.screen
+		self.detector = FakeYOLOv3Detection
+
+	@property
+	def messages(self):
+		return ui.messages
+
+	@property
+	def resultWindows(self):
+		return recogUi.focusedResults
+
+	def showImage(self, left: int, top: int, width: int, height: int, pattern: bytes, name: str = "image"):
+		"""Draws an image on the fake screen and makes it the focus and navigator object.
+		@param pattern: BGRX pixels repeated to fill the image
+		"""
+		self.screen.fill(left, top, width, height, pattern)
+		api.focusObject = api.navigatorObject = fakeNVDA.FakeObject((left, top, width, height), name=name)
+
+	def pressGesture(self, wait: bool = True):
+		"""Runs the detection script like a key press would, then waits for the result and presents it.
+		@param wait: if False, returns as soon as the request was submitted
+		"""
+		self.plugin.script_detectObjectsYOLOv3(None)
+		if wait:
+			self.waitForResult()
+
+	def waitForResult(self):
+		"""Waits until the pipeline delivered the result of the active request, then runs the functions it
+		queued for the main thread."""
+		deadline = time.perf_counter() + _timeout
+		while _resultUI._activeRecog is not None or (self._pipelineBusy() and not queueHandler.pending):
+			if time.perf_counter() > deadline:
+				raise TimeoutError("detection did not complete")
+			time.sleep(0.001)
+		queueHandler.pump()
+
+	@staticmethod
+	def _pipelineBusy() -> bool:
+		pipeline = _doObjectDetection._pipeline
+		return bool(pipeline and (pipeline._inFlight or any(stage.qsize() for stage in pipeline.stages)))
+
+	def forgetRecentPress(self):
+		"""Makes the next press count as a new press rather than a repeated one."""
+		plugin._lastCalled = 0
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+	ui.messages.clear()
+	queueHandler.pending.clear()
+	recogUi.focusedResults.clear()
+	screenBitmap.screen = fakeNVDA.FakeScreen()
+	api.focusObject = api.navigatorObject = None
+	api.foregroundObject = fakeNVDA.FakeObject((0, 0, 1024, 768), name="window")
+	winUser.cursorPositions.clear()
+	_classIndex.clear()
+	plugin._cachedResults.clear()
+	plugin._lastCalled = 0
+	_resultUI._activeRecog = None
+	_resultUI._objectIdentities.clear()
+	_instrumentation.reset()
+	_instrumentation.setEnabled(False)
+	FakeYOLOv3Detection.reset()
+	monkeypatch.setattr(_doObjectDetection, "YOLOv3Detection", FakeYOLOv3Detection)
+	# the highlighter window needs a real desktop, boxes are only recorded
+	monkeypatch.setattr(
+		ObjectDetection, "_startHighlighter", lambda self: setattr(self, "_highlighterThread", True)
+	)
+	# the test images are plain colours, which triage would reject
+	for name in (
+		"orderObjectsBySalience", "describeObjectPositions", "skipImagesWithoutObjects"
+	):
+		monkeypatch.setattr(ObjectDetection.getSettings(), name, False)
+	provider = ObjectDetection()
+	vision.handler.providerInstance = provider
+	yield Runtime(provider)
+	_offlineIndex.loadIndex(None)
+	_doObjectDetection.terminatePipeline()
+
+
+def pytest_sessionfinish(session, exitstatus):
+	if "globalPlugins.objectDetection._doObjectDetection" in sys.modules:
+		_doObjectDetection.terminatePipeline()
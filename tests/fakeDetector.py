@@ -0,0 +1,47 @@
+# Object Detection: deterministic stand-in for the YOLOv3 DLL
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from globalPlugins.objectDetection._YOLOv3 import YOLOv3Detection
+
+#: A detection as returned by the DLL: class ID, probability, x, y, width and height
+RawDetection = Tuple[int, float, int, int, int, int]
+
+
+class FakeYOLOv3Detection(YOLOv3Detection):
+	"""Replaces the DLL calls of L{YOLOv3Detection} and keeps everything else, so that boxes and sentences
+	are built by the real code. The fake NVDA runtime saves captures as raw RGB data, and the detections of an
+	image are looked up in L{scenes} by the colour of its top left pixel."""
+
+	#: Detections keyed by the RGB colour of the top left pixel of an image. Other images have no detections.
+	scenes: Dict[Tuple[int, int, int], List[RawDetection]] = {}
+	#: Seconds every detection takes, to keep requests in flight
+	delay = 0.0
+	#: Paths of the images of every detection run so far
+	calls: List[str] = []
+	_callsLock = threading.Lock()
+
+	def __init__(self, imagePath):
+		self.imagePath = imagePath
+
+	@classmethod
+	def reset(cls):
+		cls.scenes = {}
+		cls.delay = 0.0
+		cls.calls = []
+
+	@classmethod
+	def isLoaded(cls) -> bool:
+		return True
+
+	def detect(self) -> list:
+		with self._callsLock:
+			self.calls.append(self.imagePath)
+		if self.delay:
+			time.sleep(self.delay)
+		with open(self.imagePath, "rb") as f:
+			colour = tuple(f.read(3))
+		return [self.Detection(*detection) for detection in self.scenes.get(colour, [])]
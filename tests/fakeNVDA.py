@@ -0,0 +1,342 @@
+# Object Detection: minimal fake NVDA runtime used to import and test the add-on outside NVDA
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Installs stand-ins for the NVDA modules used by the add-on into C{sys.modules}. Only the behaviour the
+add-on relies on is implemented. Calls that would reach the user interface are recorded instead, so that
+tests can assert on them:
+	- C{ui.messages}: every message spoken with C{ui.message}
+	- C{queueHandler.pending}: functions queued to the main thread, run with C{queueHandler.pump}
+	- C{contentRecog.recogUi.focusedResults}: text of every virtual result window that was opened
+	- C{screenBitmap.screen}: the L{FakeScreen} captures are taken from
+	- C{winUser.cursorPositions}: every position the mouse was moved to
+"""
+
+import builtins
+import ctypes
+import os
+import sys
+import threading
+import types
+from collections import namedtuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADDON_DIR = os.path.join(ROOT_DIR, "addon")
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+	module = types.ModuleType(name)
+	module.__dict__.update(attributes)
+	sys.modules[name] = module
+	parent, _sep, child = name.rpartition(".")
+	if parent:
+		setattr(sys.modules[parent], child, module)
+	return module
+
+
+def _constants(name: str, **attributes) -> types.ModuleType:
+	"""Creates a module whose unknown upper case attributes, such as window style constants, are 0."""
+	module = _module(name, **attributes)
+
+	def __getattr__(attribute):
+		if attribute.isupper() or attribute[:1].isupper():
+			return 0
+		raise AttributeError(attribute)
+	module.__getattr__ = __getattr__
+	return module
+
+
+class _Recorder():
+	"""Accepts any call and attribute access, like the user32 and gdi32 function tables."""
+	def __getattr__(self, name):
+		return _Recorder()
+
+	def __call__(self, *args, **kwargs):
+		return 1
+
+
+class _Log():
+	def __init__(self):
+		self.records = []
+
+	def _record(self, level):
+		def record(message, *args, **kwargs):
+			self.records.append((level, message % args if args else message))
+		return record
+
+	def __getattr__(self, level):
+		return self._record(level)
+
+
+class FakeScreen():
+	"""A screen of BGRX pixels that captures are cropped from."""
+	def __init__(self, width: int = 1024, height: int = 768):
+		self.width = width
+		self.height = height
+		self.pixels = bytearray(width * height * 4)
+
+	def fill(self, left: int, top: int, width: int, height: int, pattern: bytes):
+		"""Fills a rectangle of the screen by repeating a pattern of BGRX pixels row by row."""
+		rowLength = width * 4
+		row = (pattern * (rowLength // len(pattern) + 1))[:rowLength]
+		for y in range(top, top + height):
+			start = (y * self.width + left) * 4
+			self.pixels[start:start + rowLength] = row
+
+	def capture(self, left: int, top: int, width: int, height: int) -> bytearray:
+		data = bytearray(width * height * 4)
+		rowLength = width * 4
+		for y in range(height):
+			start = ((top + y) * self.width + left) * 4
+			data[y * rowLength:(y + 1) * rowLength] = self.pixels[start:start + rowLength]
+		return data
+
+
+class RectLTWH(namedtuple("RectLTWH", ("left", "top", "width", "height"))):
+	@property
+	def right(self):
+		return self.left + self.width
+
+	@property
+	def bottom(self):
+		return self.top + self.height
+
+
+class RectLTRB(namedtuple("RectLTRB", ("left", "top", "right", "bottom"))):
+	@property
+	def width(self):
+		return self.right - self.left
+
+	@property
+	def height(self):
+		return self.bottom - self.top
+
+
+class FakeObject():
+	"""An NVDA object with the properties used by the add-on."""
+	def __init__(self, location, role=None, name="image", windowHandle=1, children=()):
+		self.location = RectLTWH(*location) if location else None
+		self.role = sys.modules["controlTypes"].ROLE_GRAPHIC if role is None else role
+		self.name = name
+		self.windowHandle = windowHandle
+		self.children = list(children)
+		self.treeInterceptor = None
+
+
+def install(configDir: str):
+	"""Installs the fake runtime and makes the add-on importable as C{globalPlugins.objectDetection} and
+	C{visionEnhancementProviders.objectDetection}, the names NVDA imports it with.
+	@param configDir: directory used as the NVDA user configuration directory
+	"""
+	if "api" in sys.modules and getattr(sys.modules["api"], "isFake", False):
+		return
+	# gettext is installed into builtins by NVDA
+	builtins._ = lambda text: text
+	# Windows only ctypes attributes used at import time
+	if not hasattr(ctypes, "windll"):
+		ctypes.windll = _Recorder()
+	if not hasattr(ctypes, "WinError"):
+		ctypes.WinError = lambda *args: OSError(*args)
+
+	_module("logHandler", log=_Log())
+
+	messages = []
+	_module("ui", messages=messages, message=lambda text, *args, **kwargs: messages.append(text))
+
+	pending = []
+	pendingLock = threading.Lock()
+
+	def queueFunction(queue, func, *args, **kwargs):
+		with pendingLock:
+			pending.append((func, args, kwargs))
+
+	def pump() -> int:
+		"""Runs the queued functions on the calling thread, standing in for NVDA's main thread.
+		@return: number of functions run
+		"""
+		count = 0
+		while True:
+			with pendingLock:
+				if not pending:
+					return count
+				func, args, kwargs = pending.pop(0)
+			func(*args, **kwargs)
+			count += 1
+	_module("queueHandler", eventQueue=object(), pending=pending, queueFunction=queueFunction, pump=pump)
+
+	laterCalls = []
+	_module(
+		"core", laterCalls=laterCalls,
+		callLater=lambda delay, func, *args, **kwargs: laterCalls.append(func)
+	)
+	_module("controlTypes", ROLE_GRAPHIC=16, ROLE_BUTTON=9)
+	_module("locationHelper", RectLTWH=RectLTWH, RectLTRB=RectLTRB)
+	_module("languageHandler", getLanguage=lambda: "en")
+	_module("globalVars", appArgs=types.SimpleNamespace(configPath=configDir))
+	_module("globalCommands", SCRCAT_VISION="Vision")
+	_module("gui", mainFrame=_Recorder())
+
+	class GlobalPlugin():
+		def __init__(self):
+			pass
+
+		def terminate(self):
+			pass
+	_module("globalPluginHandler", GlobalPlugin=GlobalPlugin)
+
+	def script(**kwargs):
+		def decorator(func):
+			func.__dict__.update(kwargs)
+			return func
+		return decorator
+	_module("scriptHandler", script=script)
+
+	class DesktopObject(FakeObject):
+		def objectFromPoint(self, x, y):
+			return FakeObject((x, y, 1, 1), name=f"object at {x}, {y}")
+
+	api = _module(
+		"api", isFake=True, focusObject=None, navigatorObject=None,
+		foregroundObject=FakeObject((0, 0, 1024, 768), name="window"),
+		desktopObject=DesktopObject((0, 0, 1024, 768), name="desktop")
+	)
+	api.getFocusObject = lambda: api.focusObject
+	api.getNavigatorObject = lambda: api.navigatorObject
+	api.getForegroundObject = lambda: api.foregroundObject
+	api.getDesktopObject = lambda: api.desktopObject
+	api.setNavigatorObject = lambda obj: setattr(api, "navigatorObject", obj)
+
+	class ScreenBitmap():
+		def __init__(self, width, height):
+			self.width = width
+			self.height = height
+
+		def captureImage(self, left, top, width, height):
+			return sys.modules["screenBitmap"].screen.capture(left, top, width, height)
+	_module("screenBitmap", ScreenBitmap=ScreenBitmap, screen=FakeScreen())
+
+	class ContentRecognizer():
+		def getResizeFactor(self, width, height):
+			return 1
+
+	class RecogImageInfo():
+		def __init__(self, screenLeft, screenTop, screenWidth, screenHeight, resizeFactor):
+			self.screenLeft = screenLeft
+			self.screenTop = screenTop
+			self.screenWidth = screenWidth
+			self.screenHeight = screenHeight
+			self.resizeFactor = resizeFactor
+			self.recogWidth = int(screenWidth * resizeFactor)
+			self.recogHeight = int(screenHeight * resizeFactor)
+
+		@classmethod
+		def createFromRecognizer(cls, screenLeft, screenTop, screenWidth, screenHeight, recognizer):
+			resizeFactor = recognizer.getResizeFactor(screenWidth, screenHeight)
+			return cls(screenLeft, screenTop, screenWidth, screenHeight, resizeFactor)
+
+	class SimpleTextResult():
+		def __init__(self, text):
+			self.text = text
+
+	_module(
+		"contentRecog", ContentRecognizer=ContentRecognizer, RecogImageInfo=RecogImageInfo,
+		SimpleTextResult=SimpleTextResult
+	)
+	focusedResults = []
+
+	class RecogResultNVDAObject():
+		def __init__(self, result=None, **kwargs):
+			self.result = result
+
+		def setFocus(self):
+			focusedResults.append(self.result.text)
+	_module("contentRecog.recogUi", RecogResultNVDAObject=RecogResultNVDAObject, focusedResults=focusedResults)
+
+	class Image():
+		def __init__(self, width, height, data=None):
+			self.width = width
+			self.height = height
+			self.data = bytes(data) if data is not None else bytes(width * height * 3)
+
+		def SaveFile(self, path, fileType):
+			# the raw RGB data stands in for the encoded image, so fake detectors can read it back
+			with open(path, "wb") as f:
+				f.write(self.data)
+			return True
+	_constants(
+		"wx", Image=Image, BITMAP_TYPE_JPEG=17, CallAfter=lambda func, *args: func(*args),
+		CallLater=lambda delay, func, *args: func(*args)
+	)
+
+	_module("autoSettingsUtils")
+	_module("autoSettingsUtils.autoSettings", SupportedSettingType=list)
+
+	class DriverSetting():
+		def __init__(self, id, displayName, defaultVal=None, **kwargs):
+			self.id = id
+			self.displayName = displayName
+			self.defaultVal = defaultVal
+			self.__dict__.update(kwargs)
+	_module("driverHandler", BooleanDriverSetting=DriverSetting, NumericDriverSetting=DriverSetting)
+
+	class VisionEnhancementProviderSettings():
+		@classmethod
+		def getId(cls):
+			return cls.__name__
+
+	class VisionEnhancementProvider():
+		def __init__(self):
+			pass
+
+		def terminate(self):
+			pass
+
+	class Handler():
+		def __init__(self):
+			self.activeProviderInfos = []
+			self.providerInstance = None
+
+		def getActiveProviderInfos(self):
+			return self.activeProviderInfos
+
+		def getProviderInfo(self, providerId):
+			return providerId
+
+		def getProviderInstance(self, providerInfo):
+			return self.providerInstance
+	_module("vision", handler=Handler(), _isDebug=lambda: False)
+	_module(
+		"vision.providerBase", VisionEnhancementProviderSettings=VisionEnhancementProviderSettings,
+		VisionEnhancementProvider=VisionEnhancementProvider
+	)
+	_module("vision.visionHandlerExtensionPoints", EventExtensionPoints=object)
+
+	class ScreenCurtainSettings(VisionEnhancementProviderSettings):
+		@classmethod
+		def getId(cls):
+			return "screenCurtain"
+
+	class CustomWindow():
+		def __init__(self, *args, **kwargs):
+			self.handle = 1
+
+	class RGB(namedtuple("RGB", ("red", "green", "blue"))):
+		def toGDIPlusARGB(self):
+			return 0xFF000000 | (self.red << 16) | (self.green << 8) | self.blue
+
+	_module("windowUtils", CustomWindow=CustomWindow)
+	cursorPositions = []
+	_constants(
+		"winUser", user32=_Recorder(), cursorPositions=cursorPositions,
+		setCursorPos=lambda x, y: cursorPositions.append((x, y))
+	)
+	_constants("winGDI", gdi32=_Recorder(), gdiPlusInitialize=lambda: None, gdiPlusTerminate=lambda: None)
+	_module("colors", RGB=RGB)
+	_module(
+		"mouseHandler", getTotalWidthAndHeightAndMinimumPosition=lambda displays: (0, 0, None),
+		executeMouseMoveEvent=lambda x, y: None
+	)
+
+	# the add-on's packages, with NVDA's own modules next to them where NVDA provides them
+	_module("visionEnhancementProviders", __path__=[os.path.join(ADDON_DIR, "visionEnhancementProviders")])
+	_module("visionEnhancementProviders.screenCurtain", ScreenCurtainSettings=ScreenCurtainSettings)
+	_module("globalPlugins", __path__=[os.path.join(ADDON_DIR, "globalPlugins")])
@@ -0,0 +1,148 @@
+# Object Detection: micro-benchmarks of the code run on every key press and mouse move
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Every benchmark asserts a limit several times above the time measured on a typical Linux machine, so
+that only real regressions, such as an accidentally quadratic loop or a lost fast path, fail the run."""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pytest
+
+from contentRecog import RecogImageInfo
+from locationHelper import RectLTRB
+from globalPlugins.objectDetection import _offlineIndex
+from globalPlugins.objectDetection._classIndex import ClassIndex
+from globalPlugins.objectDetection._detectionResult import Detection, ObjectDetectionResults
+from globalPlugins.objectDetection._fingerprint import imageHash, perceptualHash
+from globalPlugins.objectDetection._labels import SentenceFormatter
+from globalPlugins.objectDetection._spatial import describe
+from globalPlugins.objectDetection._triage import getStatistics
+
+pytestmark = pytest.mark.skipif(
+	not sys.platform.startswith("linux"), reason="limits are calibrated on Linux"
+)
+
+#: Number of timed runs of every benchmark, the fastest of which is compared with the limit
+_repeats = 5
+
+
+def _bestTime(func, *args) -> float:
+	"""Runs a function several times.
+	@return: the shortest run time in seconds
+	"""
+	best = float("inf")
+	for i in range(_repeats):
+		start = time.perf_counter()
+		func(*args)
+		best = min(best, time.perf_counter() - start)
+	return best
+
+
+def _randomDetections(count: int, width: int, height: int):
+	rand = random.Random(count)
+	detections = []
+	for i in range(count):
+		w = rand.randint(10, width // 3)
+		h = rand.randint(10, height // 3)
+		x = rand.randint(0, width - w)
+		y = rand.randint(0, height - h)
+		classId = rand.randrange(80)
+		detections.append(Detection(str(classId), x, y, w, h, classId, rand.random()))
+	return detections
+
+
+def test_sentenceSpeed():
+	formatter = SentenceFormatter.forLanguage("en")
+	rand = random.Random(0)
+	classIds = [rand.randrange(80) for i in range(100)]
+	saliences = [rand.random() for i in range(100)]
+
+	def run():
+		for i in range(100):
+			formatter.format(classIds, saliences)
+	assert _bestTime(run) < 0.03
+
+
+def test_adjustedBoxesSpeed():
+	imgInfo = RecogImageInfo(200, 100, 1280, 720, 1)
+	result = ObjectDetectionResults(0, imgInfo, "", _randomDetections(100, 1280, 720))
+
+	def run():
+		for i in range(100):
+			result.getAdjustedLTRBBoxes()
+	assert _bestTime(run) < 0.1
+
+
+def test_mouseMoveSpeed(runtime):
+	provider = runtime.provider
+	for i in range(50):
+		provider.addObjectRect(str(i), RectLTRB(i * 20, 0, i * 20 + 100, 100))
+	points = [(x, 50) for x in range(0, 1200, 3)]
+
+	def run():
+		for x, y in points:
+			provider.handleMouseMove(None, x, y)
+	# a mouse move event arrives every few milliseconds, each must take a small fraction of that
+	assert _bestTime(run) / len(points) < 0.0002
+
+
+def test_imageHashSpeed():
+	block = bytearray(random.Random(0).getrandbits(8) for i in range(64 * 1024))
+	pixels = block * (1920 * 1080 * 4 // len(block))
+	assert _bestTime(imageHash, pixels) < 0.02
+
+
+def test_perceptualHashSpeed():
+	width, height = 1920, 1080
+	block = bytes(random.Random(0).getrandbits(8) for i in range(64 * 1024))
+	data = block * (width * height * 4 // len(block))
+	assert _bestTime(perceptualHash, data, width, height) < 0.005
+
+
+def test_triageSpeed():
+	width, height = 1920, 1080
+	block = bytes(random.Random(0).getrandbits(8) for i in range(64 * 1024))
+	data = block * (width * height * 4 // len(block))
+	# triage runs on every image that is not found in a cache
+	assert _bestTime(getStatistics, data, width, height) < 0.02
+
+
+def test_offlineIndexLookupSpeed():
+	rand = random.Random(0)
+	keys = [rand.getrandbits(64) | 1 for i in range(50000)]
+	path = os.path.join(tempfile.mkdtemp(), "index.odx")
+	_offlineIndex.writeIndex(((key, 400, 300, [(0, 0.9, 0.1, 0.1, 0.5, 0.5)]) for key in keys), path)
+	index = _offlineIndex.OfflineIndex(path)
+	misses = [rand.getrandbits(64) for i in range(100)]
+	try:
+		def run():
+			for key in keys[:1000]:
+				index.findBoxes(key, 400, 300)
+			for key in misses:
+				index.findBoxes(key, 400, 300)
+		assert _bestTime(run) < 0.1
+	finally:
+		index.close()
+
+
+def test_classIndexSpeed():
+	index = ClassIndex()
+	for imageHash in range(2000):
+		imgInfo = RecogImageInfo(imageHash % 800, imageHash % 600, 400, 300, 1)
+		index.addResult(ObjectDetectionResults(imageHash, imgInfo, "", _randomDetections(5, 400, 300), 416))
+	area = (0, 0, 1024, 768)
+
+	def run():
+		index.getClassCounts(area)
+		for classId in range(0, 80, 8):
+			index.findBest(classId, area)
+	assert _bestTime(run) < 0.05
+
+
+def test_describeSpeed():
+	boxes = _randomDetections(60, 1280, 720)
+	assert _bestTime(describe, boxes, 1280, 720) < 0.01
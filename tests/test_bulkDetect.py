@@ -0,0 +1,130 @@
+# Object Detection: offline bulk detection tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import io
+import os
+import json
+import tempfile
+
+import pytest
+
+from globalPlugins.objectDetection import _backends, _bulkDetect
+from globalPlugins.objectDetection._backends import DetectorBackend, RawDetection
+from globalPlugins.objectDetection._offlineIndex import OfflineIndex
+
+#: PID of the test process, so that a backend can tell it is loaded in a worker
+_parentPid = os.getpid()
+
+
+class _FakeBackend(DetectorBackend):
+	"""Finds a dog in every image."""
+	name = "fake"
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		return True
+
+	def load(self):
+		pass
+
+	def setThreadCount(self, threads: int):
+		pass
+
+	def detect(self, imagePath: str, inputSize: int = 0):
+		return [RawDetection(16, 0.9, 10, 20, 30, 40)]
+
+
+class _FailingWorkerBackend(_FakeBackend):
+	"""Loads in the test process but not in worker processes."""
+	name = "failingWorker"
+
+	def load(self):
+		if os.getpid() != _parentPid:
+			raise RuntimeError("cannot load the model")
+
+
+@pytest.fixture
+def imageDir():
+	imageDir = tempfile.mkdtemp()
+	for path in ("b.jpg", "a.PNG", "notes.txt", os.path.join("sub", "c.bmp"), os.path.join("sub", "d.gif")):
+		os.makedirs(os.path.dirname(os.path.join(imageDir, path)), exist_ok=True)
+		with open(os.path.join(imageDir, path), "wb") as f:
+			f.write(b"not decoded")
+	return imageDir
+
+
+@pytest.fixture
+def fakeBackends(monkeypatch):
+	backends = dict(_backends.BACKENDS)
+	backends.update({_FakeBackend.name: _FakeBackend, _FailingWorkerBackend.name: _FailingWorkerBackend})
+	monkeypatch.setattr(_backends, "BACKENDS", backends)
+	# no decoder is installed in every test environment, results are written without a fingerprint
+	monkeypatch.setattr(_bulkDetect, "readFingerprint", lambda imagePath: None)
+
+
+def test_findImages(imageDir):
+	assert _bulkDetect.findImages(imageDir) == ["a.PNG", "b.jpg", "sub/c.bmp"]
+
+
+def test_loadCheckpointRemovesPartialLine():
+	outputPath = os.path.join(tempfile.mkdtemp(), "out.jsonl")
+	complete = json.dumps({"path": "a.png"}) + "\n" + json.dumps({"path": "b.png", "error": "failed"}) + "\n"
+	with open(outputPath, "w", encoding="utf-8") as f:
+		f.write(complete + '{"path": "c.pn')
+	assert _bulkDetect.loadCheckpoint(outputPath) == {"a.png", "b.png"}
+	with open(outputPath, "r", encoding="utf-8") as f:
+		assert f.read() == complete
+
+
+def test_loadCheckpointWithoutOutput():
+	assert _bulkDetect.loadCheckpoint(os.path.join(tempfile.mkdtemp(), "missing.jsonl")) == set()
+
+
+def test_buildIndex():
+	outputDir = tempfile.mkdtemp()
+	outputPath = os.path.join(outputDir, "out.jsonl")
+	records = [
+		{
+			"path": "a.png", "fingerprint": "00000000000000ff", "width": 200, "height": 100,
+			"detections": [{"classId": 16, "probability": 0.5, "x": 50, "y": 25, "width": 100, "height": 50}],
+		},
+		{"path": "b.png", "detections": []},
+		{"path": "c.png", "error": "cannot read image"},
+	]
+	with open(outputPath, "w", encoding="utf-8") as f:
+		for record in records:
+			f.write(json.dumps(record) + "\n")
+	indexPath = os.path.join(outputDir, "index.odx")
+	assert _bulkDetect.buildIndex(outputPath, indexPath, 416, log=io.StringIO()) == 1
+	index = OfflineIndex(indexPath)
+	try:
+		assert index.inputSize == 416
+		classId, probability, left, top, width, height = index.findBoxes(0xff, 400, 200)[0]
+		assert classId == 16
+		assert [round(value, 3) for value in (probability, left, top, width, height)] == [0.5, 0.25, 0.25, 0.5, 0.5]
+	finally:
+		index.close()
+
+
+def test_bulkDetectInWorkers(imageDir, fakeBackends):
+	outputPath = os.path.join(tempfile.mkdtemp(), "out.jsonl")
+	report = _bulkDetect.bulkDetect(imageDir, outputPath, backendName="fake", workers=2, log=io.StringIO())
+	assert report["images"] == 3 and report["errors"] == 0
+	with open(outputPath, "r", encoding="utf-8") as f:
+		records = [json.loads(line) for line in f]
+	assert sorted(record["path"] for record in records) == ["a.PNG", "b.jpg", "sub/c.bmp"]
+	assert {record["sentence"] for record in records} == {"The image contains a dog."}
+
+
+def test_unavailableBackendFailsBeforeWorkersStart(imageDir, fakeBackends, monkeypatch):
+	monkeypatch.setattr(_FakeBackend, "isAvailable", classmethod(lambda cls: False))
+	outputPath = os.path.join(tempfile.mkdtemp(), "out.jsonl")
+	with pytest.raises(ValueError):
+		_bulkDetect.bulkDetect(imageDir, outputPath, backendName="fake", workers=2, log=io.StringIO())
+	assert not os.path.exists(outputPath)
+
+
+def test_workerThatCannotStartEndsRun(imageDir, fakeBackends):
+	outputPath = os.path.join(tempfile.mkdtemp(), "out.jsonl")
+	with pytest.raises(RuntimeError, match="cannot load the model"):
+		_bulkDetect.bulkDetect(imageDir, outputPath, backendName="failingWorker", workers=2, log=io.StringIO())
@@ -0,0 +1,92 @@
+# Object Detection: tests of the index of detected objects by class
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import api
+import winUser
+from contentRecog import RecogImageInfo
+import globalPlugins.objectDetection as plugin
+from globalPlugins.objectDetection._classIndex import ClassIndex
+from globalPlugins.objectDetection._detectionResult import Detection, ObjectDetectionResults
+
+_person, _dog = 0, 16
+
+
+def _result(imageHash, left, top, boxes, inputSize=416, width=400, height=300):
+	imgInfo = RecogImageInfo(left, top, width, height, 1)
+	detections = [Detection(str(classId), *box, classId, probability) for classId, probability, box in boxes]
+	return ObjectDetectionResults(imageHash, imgInfo, "", detections, inputSize)
+
+
+def test_findsMostSalientObject():
+	index = ClassIndex()
+	index.addResult(_result(1, 0, 0, [(_dog, 0.9, (0, 0, 40, 40)), (_person, 0.8, (100, 100, 200, 100))]))
+	index.addResult(_result(2, 500, 0, [(_dog, 0.6, (100, 100, 200, 200))]))
+	found = index.findBest(_dog)
+	assert (found.left, found.top, found.right, found.bottom) == (600, 100, 800, 300)
+	assert round(found.probability, 3) == 0.6
+	assert index.getClassCounts() == {_dog: 2, _person: 1}
+	assert index.findBest(15) is None
+
+
+def test_onlySearchesArea():
+	index = ClassIndex()
+	index.addResult(_result(1, 0, 0, [(_dog, 0.9, (0, 0, 40, 40))]))
+	index.addResult(_result(2, 500, 0, [(_dog, 0.6, (100, 100, 200, 200))]))
+	found = index.findBest(_dog, area=(0, 0, 450, 300))
+	assert (found.left, found.top) == (0, 0)
+	assert index.getClassCounts(area=(0, 400, 1024, 768)) == {}
+
+
+def test_movedImageMovesBoxes():
+	index = ClassIndex()
+	index.addResult(_result(1, 0, 0, [(_dog, 0.9, (10, 20, 40, 40))]))
+	# the same image after scrolling, shown at twice the size
+	index.addResult(_result(1, 100, 50, [], width=800, height=600))
+	found = index.findBest(_dog)
+	assert (found.left, found.top, found.right, found.bottom) == (120, 90, 200, 170)
+	assert len(index) == 1
+
+
+def test_betterResultReplacesBoxes():
+	index = ClassIndex()
+	index.addResult(_result(1, 0, 0, [(_dog, 0.9, (10, 20, 40, 40))], inputSize=320))
+	index.addResult(_result(1, 0, 0, [(_person, 0.7, (10, 20, 40, 40))], inputSize=608))
+	assert index.getClassCounts() == {_person: 1}
+
+
+def test_evictsLeastRecentlySeenImages():
+	index = ClassIndex(maxImages=4)
+	for imageHash in range(4):
+		index.addResult(_result(imageHash, imageHash * 10, 0, [(_dog, 0.9, (0, 0, 40, 40))]))
+	# seeing the first image again keeps it
+	index.addResult(_result(0, 0, 0, []))
+	index.addResult(_result(4, 40, 0, [(_dog, 0.9, (0, 0, 40, 40))]))
+	assert len(index) == 4
+	assert sorted(found.left for found in index._iterObjects(_dog, None)) == [0, 20, 30, 40]
+
+
+def test_indexIsCompact():
+	index = ClassIndex()
+	for imageHash in range(2000):
+		index.addResult(_result(imageHash, 0, 0, [(imageHash % 80, 0.5, (0, 0, 40, 40))] * 3))
+	size = sum(len(keys) * keys.itemsize for keys in index._keys.values())
+	size += sum(len(boxes) * boxes.itemsize for boxes in index._boxes.values())
+	# an 8 byte image key and five 2 byte fields per box
+	assert size == 2000 * 3 * 18
+
+
+def test_moveToObject(runtime):
+	runtime.detector.scenes[(10, 20, 30)] = [(16, 0.9, 5, 6, 100, 120), (0, 0.8, 150, 10, 80, 200)]
+	runtime.showImage(100, 50, 300, 250, bytes((30, 20, 10, 0)))
+	runtime.pressGesture()
+	runtime.messages.clear()
+	assert plugin.moveToObject(_dog, plugin.getForegroundArea())
+	assert winUser.cursorPositions == [(155, 116)]
+	assert api.navigatorObject.name == "object at 155, 116"
+	assert runtime.messages == ["dog"]
+	assert not plugin.moveToObject(15, plugin.getForegroundArea())
+
+
+def test_findObjectWithoutObjects(runtime):
+	runtime.plugin.script_findObject(None)
+	assert runtime.messages == ["No objects detected in this window yet"]
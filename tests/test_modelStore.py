@@ -0,0 +1,59 @@
+# Object Detection: model store tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import struct
+import tempfile
+import multiprocessing
+
+from globalPlugins.objectDetection._modelStore import ModelStore, getModelStore
+
+
+def _writeModel(modelsDir: str):
+	with open(os.path.join(modelsDir, "yolov3.cfg"), "w") as f:
+		f.write("[net]\nwidth=416\nheight=416\n")
+	with open(os.path.join(modelsDir, "yolov3.weights"), "wb") as f:
+		f.write(struct.pack("<iiiq", 0, 2, 0, 32013312))
+		f.write(struct.pack("<4f", 0.5, -1.0, 2.0, 0.25))
+
+
+def test_blobHasWeights():
+	modelsDir = tempfile.mkdtemp()
+	_writeModel(modelsDir)
+	store = ModelStore(modelsDir)
+	blob = store.open()
+	assert list(blob.weights) == [0.5, -1.0, 2.0, 0.25]
+	assert bytes(blob.config).startswith(b"[net]")
+	store.close()
+
+
+def test_damagedBlobIsRebuilt():
+	modelsDir = tempfile.mkdtemp()
+	_writeModel(modelsDir)
+	store = ModelStore(modelsDir)
+	store.open()
+	store.close()
+	# damage a weight without changing the size of the blob
+	with open(store.blobFile, "r+b") as f:
+		f.seek(-4, os.SEEK_END)
+		f.write(struct.pack("<f", 9.0))
+	blob = store.open()
+	assert list(blob.weights) == [0.5, -1.0, 2.0, 0.25]
+	store.close()
+
+
+def _openStore(modelsDir: str) -> list:
+	blob = getModelStore(modelsDir).open()
+	return list(blob.weights)
+
+
+def test_storeOpenedByManyProcesses():
+	modelsDir = tempfile.mkdtemp()
+	_writeModel(modelsDir)
+	# every process finds no blob and must wait for the one that builds it
+	with multiprocessing.Pool(8) as pool:
+		results = pool.map(_openStore, [modelsDir] * 8)
+	assert results == [[0.5, -1.0, 2.0, 0.25]] * 8
+	assert sorted(os.listdir(modelsDir)) == [
+		"manifest.json", "yolov3.blob", "yolov3.cfg", "yolov3.lock", "yolov3.weights"
+	]
@@ -0,0 +1,54 @@
+# Object Detection: bounding box label announcement tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from locationHelper import RectLTRB
+
+
+def _addBoxes(runtime):
+	runtime.provider.addObjectRect("dog", RectLTRB(100, 100, 200, 200))
+	runtime.provider.addObjectRect("person", RectLTRB(150, 50, 300, 250))
+
+
+def test_labelAnnouncedOnceInsideBox(runtime):
+	_addBoxes(runtime)
+	provider = runtime.provider
+	provider.handleMouseMove(None, 50, 50)
+	provider.handleMouseMove(None, 120, 120)
+	provider.handleMouseMove(None, 130, 130)
+	assert runtime.messages == ["dog"]
+
+
+def test_labelAnnouncedAgainAfterLeaving(runtime):
+	_addBoxes(runtime)
+	provider = runtime.provider
+	provider.handleMouseMove(None, 120, 120)
+	provider.handleMouseMove(None, 50, 50)
+	provider.handleMouseMove(None, 120, 120)
+	assert runtime.messages == ["dog", "dog"]
+
+
+def test_overlappingBoxes(runtime):
+	_addBoxes(runtime)
+	provider = runtime.provider
+	provider.handleMouseMove(None, 120, 120)
+	# entering the person while still inside the dog only announces the person
+	provider.handleMouseMove(None, 170, 120)
+	provider.handleMouseMove(None, 250, 120)
+	provider.handleMouseMove(None, 170, 120)
+	assert runtime.messages == ["dog", "person", "dog"]
+
+
+def test_edgeIsOutsideBox(runtime):
+	_addBoxes(runtime)
+	runtime.provider.handleMouseMove(None, 100, 120)
+	assert runtime.messages == []
+
+
+def test_newBoxesAreAnnounced(runtime):
+	_addBoxes(runtime)
+	provider = runtime.provider
+	provider.handleMouseMove(None, 120, 120)
+	provider.clearObjectRects()
+	provider.addObjectRect("cat", RectLTRB(100, 100, 200, 200))
+	provider.handleMouseMove(None, 130, 130)
+	assert runtime.messages == ["dog", "cat"]
@@ -0,0 +1,300 @@
+# Object Detection: end-to-end recognition and result cache tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import time
+import tempfile
+
+from contentRecog import RecogImageInfo
+import globalPlugins.objectDetection as plugin
+from globalPlugins.objectDetection import (
+	_classIndex, _doObjectDetection, _instrumentation, _offlineIndex, _triage
+)
+from globalPlugins.objectDetection._detectionResult import ObjectDetectionResults
+from globalPlugins.objectDetection._fingerprint import perceptualHash
+from visionEnhancementProviders.objectDetection import ObjectDetection
+
+#: BGRX pixels of the test images, and the RGB colour the fake detector looks them up by
+_dogAndPerson = bytes((30, 20, 10, 0))
+_dogAndPersonColour = (10, 20, 30)
+_cat = bytes((60, 50, 40, 0))
+_catColour = (40, 50, 60)
+
+_dogAndPersonSentence = "The image contains a dog and a person."
+
+
+def _addScenes(runtime):
+	runtime.detector.scenes[_dogAndPersonColour] = [(16, 0.9, 5, 6, 100, 120), (0, 0.8, 150, 10, 80, 200)]
+	runtime.detector.scenes[_catColour] = [(15, 0.7, 20, 20, 100, 100)]
+
+
+def test_speaksAndDrawsResult(runtime):
+	_addScenes(runtime)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture()
+	assert runtime.messages == ["Recognizing", _dogAndPersonSentence]
+	assert [(label, tuple(rect)) for label, rect in runtime.provider.objectRects] == [
+		("dog", (105, 56, 205, 176)),
+		("person", (250, 60, 330, 260)),
+	]
+	assert len(runtime.detector.calls) == 1
+
+
+def test_repeatedPressOpensResultWindow(runtime):
+	_addScenes(runtime)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture()
+	runtime.pressGesture()
+	assert runtime.resultWindows == [_dogAndPersonSentence]
+	# the second press is answered from the cache
+	assert len(runtime.detector.calls) == 1
+
+
+def test_identityFastPath(runtime, monkeypatch):
+	_addScenes(runtime)
+	monkeypatch.setattr(ObjectDetection.getSettings(), "recordPerformanceStatistics", True)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture()
+	runtime.forgetRecentPress()
+	runtime.pressGesture()
+	assert runtime.messages == ["Recognizing", _dogAndPersonSentence, _dogAndPersonSentence]
+	assert len(runtime.detector.calls) == 1
+	assert _instrumentation._counters.get("identityHits") == 1
+	# the full capture is skipped, so the pipeline sees a single lookup
+	assert _instrumentation._counters.get("cacheMisses") == 1
+	assert "cacheHits" not in _instrumentation._counters
+
+
+def test_changedImageIsDetectedAgain(runtime):
+	_addScenes(runtime)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture()
+	runtime.forgetRecentPress()
+	# same object, new content
+	runtime.showImage(100, 50, 300, 250, _cat)
+	runtime.pressGesture()
+	assert runtime.messages[-1] == "The image contains a cat."
+	assert len(runtime.detector.calls) == 2
+
+
+def test_sameImageElsewhereIsCacheHit(runtime):
+	_addScenes(runtime)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson, name="first")
+	runtime.pressGesture()
+	runtime.forgetRecentPress()
+	runtime.showImage(500, 300, 300, 250, _dogAndPerson, name="second")
+	runtime.pressGesture()
+	assert runtime.messages == ["Recognizing", _dogAndPersonSentence, _dogAndPersonSentence]
+	assert len(runtime.detector.calls) == 1
+	# boxes are drawn where the image is now
+	assert [tuple(rect)[:2] for label, rect in runtime.provider.objectRects] == [(505, 306), (650, 310)]
+
+
+def test_identityFastPathDrawsWhereImageIsNow(runtime):
+	_addScenes(runtime)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson, name="first")
+	runtime.pressGesture()
+	runtime.forgetRecentPress()
+	runtime.showImage(500, 300, 300, 250, _dogAndPerson, name="second")
+	runtime.pressGesture()
+	runtime.forgetRecentPress()
+	# answered by the identity fast path from the result cached at the first location
+	runtime.pressGesture()
+	assert len(runtime.detector.calls) == 1
+	assert [tuple(rect)[:2] for label, rect in runtime.provider.objectRects] == [(505, 306), (650, 310)]
+	# the class index also keeps the image where it is now
+	found = _classIndex.findBest(16)
+	assert (found.left, found.top) == (505, 306)
+
+
+def test_cacheReplacesSmallerInputSize(runtime):
+	imgInfo = RecogImageInfo(0, 0, 300, 250, 1)
+	small = ObjectDetectionResults(1, imgInfo, "small", [], 320)
+	large = ObjectDetectionResults(1, imgInfo, "large", [], 608)
+	plugin.cacheResult(small)
+	plugin.cacheResult(large)
+	assert list(plugin._cachedResults) == [large]
+	# a result detected at a smaller size does not replace a better one
+	plugin.cacheResult(ObjectDetectionResults(1, imgInfo, "other", [], 416))
+	assert list(plugin._cachedResults) == [large]
+
+
+def test_cacheKeepsTenResults(runtime):
+	imgInfo = RecogImageInfo(0, 0, 300, 250, 1)
+	for imageHash in range(12):
+		plugin.cacheResult(ObjectDetectionResults(imageHash, imgInfo, "", [], 416))
+	assert [result.imageHash for result in plugin._cachedResults] == list(range(11, 1, -1))
+
+
+def test_repeatedPressesAreCoalesced(runtime):
+	_addScenes(runtime)
+	runtime.detector.delay = 0.2
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture(wait=False)
+	runtime.pressGesture()
+	# the first request was cancelled but its inference answers the second one
+	assert len(runtime.detector.calls) == 1
+	assert runtime.resultWindows == [_dogAndPersonSentence]
+	assert _dogAndPersonSentence not in runtime.messages
+
+
+def _writeOfflineIndex(runtime, width: int, height: int):
+	"""Writes an offline index with a cat in the image shown at 100, 50 with a brightened left half."""
+	runtime.showImage(100, 50, 320, 240, _dogAndPerson)
+	# a plain image has no detail to fingerprint, so brighten its left half
+	runtime.screen.fill(100, 50, 160, 240, bytes((200, 200, 200, 0)))
+	fingerprint = perceptualHash(runtime.screen.capture(100, 50, 320, 240), 320, 240)
+	indexPath = os.path.join(tempfile.mkdtemp(), "index.odx")
+	_offlineIndex.writeIndex([(fingerprint, width, height, [(15, 0.75, 0.25, 0.5, 0.5, 0.25)])], indexPath)
+	assert _offlineIndex.loadIndex(indexPath) == 1
+
+
+def test_offlineIndexHit(runtime):
+	_addScenes(runtime)
+	# indexed at twice the size it is shown at
+	_writeOfflineIndex(runtime, 640, 480)
+	runtime.pressGesture()
+	assert runtime.messages == ["The image contains a cat."]
+	assert runtime.detector.calls == []
+	rects = [(label, tuple(rect)) for label, rect in runtime.provider.objectRects]
+	assert rects == [("cat", (180, 170, 340, 230))]
+
+
+def test_offlineIndexRejectsOtherAspectRatio(runtime):
+	_addScenes(runtime)
+	# an image of another shape with the same fingerprint
+	_writeOfflineIndex(runtime, 320, 120)
+	runtime.pressGesture()
+	# detected instead of answered from the index
+	assert runtime.messages[0] == "Recognizing"
+	assert len(runtime.detector.calls) == 1
+
+
+def test_offlineIndexImport(runtime, monkeypatch):
+	# imported to a temporary directory, so that plugins created by later tests do not load it
+	importedPath = os.path.join(tempfile.mkdtemp(), "objectDetection", "offlineIndex.odx")
+	monkeypatch.setattr(plugin, "getOfflineIndexPath", lambda: importedPath)
+	indexPath = os.path.join(tempfile.mkdtemp(), "index.odx")
+	_offlineIndex.writeIndex([(1, 320, 240, []), (2, 320, 240, [])], indexPath)
+	plugin.importOfflineIndex(indexPath)
+	assert runtime.messages == ["Offline index imported with 2 images"]
+	assert os.path.exists(importedPath)
+	runtime.messages.clear()
+
+	def failCopy(source, destination):
+		raise OSError("disk full")
+	monkeypatch.setattr(plugin.shutil, "copyfile", failCopy)
+	otherPath = os.path.join(tempfile.mkdtemp(), "other.odx")
+	_offlineIndex.writeIndex([(3, 320, 240, [])], otherPath)
+	plugin.importOfflineIndex(otherPath)
+	assert runtime.messages == ["Could not import the offline index"]
+	# the previously imported index is still used
+	assert len(_offlineIndex._index) == 2
+
+
+def test_memoryLimitRefusesDetection(runtime, monkeypatch):
+	_addScenes(runtime)
+	monkeypatch.setattr(ObjectDetection.getSettings(), "memoryLimit", 1)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture()
+	assert runtime.messages == ["Recognizing", "Not enough memory for object detection"]
+	assert runtime.detector.calls == []
+
+
+def test_smallImageIsRejected(runtime):
+	runtime.showImage(100, 50, 100, 250, _dogAndPerson)
+	runtime.pressGesture()
+	assert runtime.messages == ["Image too small to produce good results. Please try again with a larger image."]
+
+
+def test_nonGraphicObjectIsRejected(runtime):
+	import api
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	api.navigatorObject.role = 9
+	runtime.pressGesture()
+	assert runtime.messages[0].startswith("Currently focused element is not an image.")
+
+
+def test_blankImageIsNotDetected(runtime, monkeypatch):
+	monkeypatch.setattr(ObjectDetection.getSettings(), "skipImagesWithoutObjects", True)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture()
+	assert runtime.messages == ["The image is almost entirely one colour, there are no objects to detect."]
+	assert runtime.detector.calls == []
+
+
+def test_textIsNotDetected(runtime, monkeypatch):
+	monkeypatch.setattr(ObjectDetection.getSettings(), "skipImagesWithoutObjects", True)
+	# thin black strokes on white
+	runtime.showImage(100, 50, 300, 250, bytes((0, 0, 0, 0)) * 2 + bytes((255, 255, 255, 0)) * 4)
+	runtime.pressGesture()
+	assert runtime.messages == ["The image seems to show only text. Try text recognition instead."]
+	assert runtime.detector.calls == []
+
+
+def test_colourfulImageIsDetected(runtime, monkeypatch):
+	_addScenes(runtime)
+	monkeypatch.setattr(ObjectDetection.getSettings(), "skipImagesWithoutObjects", True)
+	colours = bytes(value for i in range(16) for value in (i * 16, 255 - i * 16, i * 40 % 256, 0))
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson + colours)
+	runtime.pressGesture()
+	assert runtime.messages == ["Recognizing", _dogAndPersonSentence]
+
+
+def test_triageSettingsDefaultToDefaultThresholds():
+	settings = ObjectDetection.getSettings()
+	assert _doObjectDetection.getTriageThresholds(settings) == _triage.DEFAULT_THRESHOLDS
+
+
+def test_triageThresholdsFollowSettings(runtime, monkeypatch):
+	_addScenes(runtime)
+	settings = ObjectDetection.getSettings()
+	monkeypatch.setattr(settings, "skipImagesWithoutObjects", True)
+	# a plain colour has no brightness variance at all, so no image is blank
+	monkeypatch.setattr(settings, "triageMinVariance", 0)
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture()
+	assert runtime.messages == ["Recognizing", _dogAndPersonSentence]
+
+
+def test_terminateDoesNotWaitForInference(runtime):
+	_addScenes(runtime)
+	runtime.detector.delay = 2.0
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture(wait=False)
+	while not runtime.detector.calls:
+		time.sleep(0.001)
+	startTime = time.perf_counter()
+	_doObjectDetection.terminatePipeline()
+	assert time.perf_counter() - startTime < 1.0
+
+
+def test_terminatedPipelineIsNotRecreated(runtime):
+	_addScenes(runtime)
+	runtime.detector.delay = 0.3
+	runtime.showImage(100, 50, 300, 250, _dogAndPerson)
+	runtime.pressGesture(wait=False)
+	while not runtime.detector.calls:
+		time.sleep(0.001)
+	runtime.forgetRecentPress()
+	runtime.showImage(100, 50, 300, 250, _cat)
+	runtime.pressGesture(wait=False)
+	pipeline = _doObjectDetection._pipeline
+	inference = next(stage for stage in pipeline.stages if stage.name == "inference")
+	# the second job waits for the inference of the first one
+	while not inference.qsize():
+		time.sleep(0.001)
+	_doObjectDetection.terminatePipeline()
+	time.sleep(runtime.detector.delay)
+	assert _doObjectDetection._pipeline is None
+	assert len(runtime.detector.calls) == 1
+	assert not [stage for stage in pipeline.stages if stage._thread.is_alive()]
+
+
+def test_statisticsRecordedFromStart(runtime, monkeypatch):
+	monkeypatch.setattr(ObjectDetection.getSettings(), "recordPerformanceStatistics", True)
+	globalPlugin = plugin.GlobalPlugin()
+	try:
+		assert _instrumentation.enabled
+	finally:
+		globalPlugin.terminate()
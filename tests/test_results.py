@@ -0,0 +1,69 @@
+# Object Detection: golden output tests for result sentences, boxes and object positions
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import json
+import os
+
+import pytest
+
+from contentRecog import RecogImageInfo
+from globalPlugins.objectDetection._labels import SentenceFormatter
+from globalPlugins.objectDetection._detectionResult import Detection, ObjectDetectionResults
+from globalPlugins.objectDetection._spatial import describe
+from globalPlugins.objectDetection._YOLOv3 import YOLOv3Detection
+
+_goldenDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+def _loadGolden(name: str):
+	with open(os.path.join(_goldenDir, name), "r", encoding="utf-8") as f:
+		return json.load(f)
+
+
+_sentenceCases = _loadGolden("sentences.json")
+_results = _loadGolden("results.json")
+
+
+@pytest.mark.parametrize("case", _sentenceCases, ids=lambda case: case["sentence"])
+def test_sentence(case):
+	formatter = SentenceFormatter.forLanguage("en")
+	assert formatter.format(case["classIds"], case["saliences"]) == case["sentence"]
+
+
+def test_sentenceBySalience():
+	# a large, confident dog is listed before the person that was detected first
+	detections = [
+		YOLOv3Detection.Detection(0, 0.6, 0, 0, 10, 10),
+		YOLOv3Detection.Detection(16, 0.9, 0, 0, 100, 100),
+	]
+	assert YOLOv3Detection.getSentence(detections) == "The image contains a person and a dog."
+	sentence = YOLOv3Detection.getSentence(detections, orderBySalience=True)
+	assert sentence == "The image contains a dog and a person."
+
+
+def _goldenResult() -> ObjectDetectionResults:
+	image = _results["image"]
+	imgInfo = RecogImageInfo(image["screenLeft"], image["screenTop"], image["width"], image["height"], 1)
+	boxes = [
+		Detection(d["label"], d["x"], d["y"], d["width"], d["height"], d["classId"], d["probability"])
+		for d in _results["detections"]
+	]
+	return ObjectDetectionResults(0, imgInfo, "", boxes)
+
+
+def test_adjustedBoxes():
+	boxes = _goldenResult().getAdjustedLTRBBoxes()
+	assert [list(box) for box in boxes] == _results["screenBoxes"]
+
+
+def test_positions():
+	result = _goldenResult()
+	assert describe(result.boxes, result.imgInfo.recogWidth, result.imgInfo.recogHeight) == _results["positions"]
+
+
+def test_rerunWorthwhile():
+	result = _goldenResult()
+	result.inputSize = 416
+	assert not result.isRerunWorthwhile(320)
+	assert not result.isRerunWorthwhile(416)
+	assert result.isRerunWorthwhile(608)
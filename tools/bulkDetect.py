@@ -0,0 +1,30 @@
+# Object Detection: command line entry point for offline bulk detection
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Detects objects in every image of a folder without NVDA, eg.
+C{python tools/bulkDetect.py screenshots results.jsonl --workers 4}
+"""
+
+import os
+import sys
+import types
+
+_packageDir = os.path.join(
+	os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "addon", "globalPlugins", "objectDetection"
+)
+
+
+def _registerPackage():
+	"""Makes the add-on's modules importable as the C{objectDetection} package without running the global
+	plugin's __init__, which needs NVDA. Also runs in every worker process, which imports this script."""
+	if "objectDetection" not in sys.modules:
+		package = types.ModuleType("objectDetection")
+		package.__path__ = [_packageDir]
+		sys.modules["objectDetection"] = package
+
+
+_registerPackage()
+
+if __name__ == "__main__":
+	from objectDetection._bulkDetect import main
+	sys.exit(main())